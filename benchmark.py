@@ -0,0 +1,1391 @@
+"""Offline benchmarks for the Secret Hitler bot.
+
+Drives the real command handlers against fake channels and players, so no Discord connection is needed.
+
+Usage:
+    python benchmark.py [sessions] [attachments] [dashboard] [votes] [roles] [handoff] [persistence] [replay] [engine] [simulate] [commands] [deck] [startup] [metrics] [tracing] [logging] [timers] [cluster] [stats] [stress]
+"""
+import asyncio
+import collections
+import functools
+import glob
+import gzip
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import MagicMock, AsyncMock
+
+# The bot reads its config on import, so provide placeholders for anything missing
+for key, value in {
+    'ENV': '_DEV',
+    'DISCORD_TOKEN_DEV': 'benchmark',
+    'FASCIST_CARD_EMOJI_NAME': 'fascist',
+    'LIBERAL_CARD_EMOJI_NAME': 'liberal',
+    'FASCIST_CARD_EMOJI_ID': '0',
+    'LIBERAL_CARD_EMOJI_ID': '0',
+}.items():
+    os.environ.setdefault(key, value)
+os.environ['SECRET_HITLER_CHANNEL_ID'] = ''
+
+import aiohttp
+import discord
+
+import cluster
+import engine
+import logs
+import metrics
+import persistence
+import replay
+import secrethitler
+import simulate
+import stats
+import timers
+import tracing
+
+secrethitler.load_config()
+# Keep the benchmark's fake CDN URLs out of the real attachment cache
+secrethitler.ATTACHMENT_CACHE_FILE = os.devnull
+secrethitler.load_assets()
+# Most benchmarks measure the bot's own work, so don't pace sends unless a benchmark asks for it
+DISCORD_RATE_LIMIT = (secrethitler.CHANNEL_SEND_RATE_LIMIT, secrethitler.CHANNEL_SEND_RATE_PERIOD)
+secrethitler.CHANNEL_SEND_RATE_LIMIT = 10**9
+
+# Totals across every fake channel and player
+api_calls = 0
+uploads = 0
+bytes_uploaded = 0
+edits = 0
+ids = itertools.count(1)  # Message and attachment IDs
+# Seconds each fake API call takes, to stand in for the round trip to Discord
+api_latency = 0
+# Milliseconds taken by each command run while this is a list
+command_timings = None
+# (phase, ms, API calls, bytes uploaded) of each command run while this is a list
+command_log = None
+# Events announced by the command being run
+announced_events = []
+
+
+class FakeAttachment:
+    def __init__(self, filename):
+        self.filename = filename
+        self.url = f"https://cdn.example.invalid/attachments/{next(ids)}/{filename}"
+
+
+class FakeMessage:
+    def __init__(self, channel, files, id=None):
+        self.id = id or next(ids)
+        self.channel = channel
+        self.attachments = [FakeAttachment(file.filename) for file in files]
+
+    async def edit(self, content=None, embeds=None, attachments=None):
+        global api_calls, edits
+        api_calls += 1
+        edits += 1
+        files = [attachment for attachment in attachments if not isinstance(attachment, FakeAttachment)]
+        count_uploads(files)
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        message = FakeMessage(self.channel, files, self.id)
+        message.attachments[:0] = [attachment for attachment in attachments if isinstance(attachment, FakeAttachment)]
+        return message
+
+    async def pin(self):
+        global api_calls
+        api_calls += 1
+
+    async def unpin(self):
+        global api_calls
+        api_calls += 1
+
+
+def count_uploads(files):
+    global uploads, bytes_uploaded
+    for file in files:
+        uploads += 1
+        bytes_uploaded += file.fp.seek(0, os.SEEK_END)
+        file.close()
+
+
+class FakeMessageable:
+    """Stands in for anything the bot can send to, and counts what is sent."""
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.messages = 0
+        self.image_messages = 0
+
+    async def send(self, content=None, file=None, embed=None, files=None, embeds=None):
+        global api_calls
+        api_calls += 1
+        self.messages += 1
+        self.image_messages += bool(file or embed or files or embeds)
+        files = ([file] if file is not None else []) + (files or [])
+        count_uploads(files)
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        return FakeMessage(self, files)
+
+
+class FakeChannel(FakeMessageable):
+    def __init__(self, id):
+        super().__init__(id, f"game-{id}")
+
+
+class FakePlayer(FakeMessageable):
+    def __init__(self, id):
+        super().__init__(id, f"Player{id}")
+        self.dm_channel = None
+
+    async def create_dm(self):
+        global api_calls
+        api_calls += 1
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        self.dm_channel = self
+        return self
+
+
+class FakeContext:
+    def __init__(self, channel, author, command=None):
+        self.channel = channel
+        self.author = author
+        self.command = command
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+async def run_command(command, channel, author, *args):
+    """Runs a bot command the same way discord.py would, checks included, queued in its game's inbox like Bot.invoke does."""
+    ctx = FakeContext(channel, author, command)
+    calls, uploaded = api_calls, bytes_uploaded
+    began = time.perf_counter()
+
+    async def invoke():
+        announced_events.clear()
+        with secrethitler.start_command_trace(ctx), logs.context(**secrethitler.get_log_fields(ctx)):
+            for check in command.checks:
+                if not await check(ctx):
+                    return False
+            await secrethitler.before_command(ctx)
+            await command(ctx, *args)
+            await secrethitler.after_command(ctx)
+            return True
+    session = secrethitler.get_command_session(ctx)
+    if not await (session.inbox.run(invoke) if session is not None else invoke()):
+        return
+    elapsed = (time.perf_counter() - began) * 1000
+    if command_timings is not None:
+        command_timings.append(elapsed)
+    if command_log is not None:
+        command_log.append((get_phase(command.name, announced_events), elapsed, api_calls - calls, bytes_uploaded - uploaded))
+
+
+async def recording_announce(session, events):
+    announced_events.extend(events)
+    await announce(session, events)
+announce = secrethitler.announce
+secrethitler.announce = recording_announce
+
+
+def get_phase(command_name, events):
+    """The part of the game a command played, from the events it caused."""
+    kinds = {event[0] for event in events}
+    if 'game_over' in kinds:
+        return 'game over'
+    if 'power' in kinds:
+        return f"{command_name} + power"
+    if kinds & {'election_passed', 'election_failed'}:
+        return 'last vote'
+    return command_name
+
+
+async def start_game(channel, num_players):
+    players = [FakePlayer(channel.id * 100 + i) for i in range(num_players)]
+    for player in players:
+        await run_command(secrethitler.join, channel, player)
+    await run_command(secrethitler.ready, channel, players[0])
+    await run_command(secrethitler.start, channel, players[0])
+    return players
+
+
+async def play_election(channel):
+    """Plays one nomination and vote, then legislation if the vote passes."""
+    session = secrethitler.sessions[channel.id]
+    president = session.current_president
+    candidates = [p for p in session.players if p != president and p != session.previous_president]
+    await run_command(secrethitler.nominate, channel, president, random.choice(candidates).name)
+    for voter in list(session.players):
+        if session.game_state != secrethitler.ELECTION:
+            break
+        if voter not in (session.current_president, session.current_chancellor):
+            await run_command(secrethitler.ja, channel, voter)
+    if session.game_state == secrethitler.PRESIDENTIAL_LEGISLATION:
+        await run_command(secrethitler.discard, channel, session.current_president, '1')
+        await run_command(secrethitler.enact, channel, session.current_chancellor, '1')
+    target = next((p for p in session.players if p != session.current_president), None)
+    if session.game_state == secrethitler.EXECUTIVE_INVESTIGATION:
+        await run_command(secrethitler.investigate, channel, session.current_president, target.name)
+    elif session.game_state == secrethitler.EXECUTIVE_APPOINTMENT:
+        await run_command(secrethitler.appoint, channel, session.current_president, target.name)
+    elif session.game_state == secrethitler.EXECUTIVE_KILL:
+        await run_command(secrethitler.kill, channel, session.current_president, target.name)
+
+
+async def bench_sessions(session_counts=(1, 10, 100, 1000), rounds=200):
+    """Measures the latency of a full election round as the number of active games grows."""
+    print(f"{'sessions':>10} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for count in session_counts:
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        channels = [FakeChannel(i + 1) for i in range(count)]
+        for channel in channels:
+            await start_game(channel, 7)
+        timings = []
+        for _ in range(rounds):
+            channel = random.choice(channels)
+            if channel.id not in secrethitler.sessions or secrethitler.sessions[channel.id].game_state == secrethitler.GAME_NOT_STARTED:
+                await start_game(channel, 7)
+            began = time.perf_counter()
+            await play_election(channel)
+            timings.append((time.perf_counter() - began) * 1000)
+        timings.sort()
+        print(f"{count:>10} {statistics.mean(timings):>10.3f} {statistics.median(timings):>10.3f} {timings[int(len(timings) * 0.99) - 1]:>10.3f}")
+
+
+async def bench_attachments(rounds=500):
+    """Compares image uploads with and without the attachment cache over the same games."""
+    global uploads, bytes_uploaded
+    print(f"{'cache':>10} {'uploads':>10} {'MB':>10} {'seconds':>10}")
+    for cached in (False, True):
+        random.seed(0)
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        secrethitler.attachment_urls = {}
+        uploads = bytes_uploaded = 0
+        if not cached:
+            secrethitler.attachment_urls = DisabledCache()
+        channel = FakeChannel(1)
+        began = time.perf_counter()
+        for _ in range(rounds):
+            if channel.id not in secrethitler.sessions or secrethitler.sessions[channel.id].game_state == secrethitler.GAME_NOT_STARTED:
+                await start_game(channel, 7)
+            await play_election(channel)
+        elapsed = time.perf_counter() - began
+        print(f"{str(cached):>10} {uploads:>10} {bytes_uploaded / 1024 / 1024:>10.1f} {elapsed:>10.3f}")
+
+
+class DisabledCache(dict):
+    """An attachment cache that never remembers anything, so every image is uploaded."""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+async def bench_dashboard(dashboards=100, latency=0.05, games=20):
+    """Compares API calls and wall-clock time per dashboard between the classic, single message and live modes.
+
+    Then plays the same games in each mode and counts the messages posted to the channel.
+    The same dashboard is printed every time in the first part, so the live mode only posts the update.
+    """
+    global api_calls, api_latency, edits, bytes_uploaded
+    print(f"Each API call takes {latency * 1000:.0f} ms.")
+    print(f"{'mode':>10} {'API calls':>10} {'mean ms':>10}")
+    channel = FakeChannel(1)
+    secrethitler.sessions.clear()
+    secrethitler.player_sessions.clear()
+    await start_game(channel, 7)
+    session = secrethitler.sessions[channel.id]
+    # Warm the renderer and attachment cache so only the dashboard itself is measured
+    await secrethitler.print_game_dashboard(session, "Before", "After")
+    api_latency = latency
+    for mode in ('classic', 'single', 'live'):
+        secrethitler.DASHBOARD_MODE = mode
+        api_calls = 0
+        began = time.perf_counter()
+        for _ in range(dashboards):
+            await secrethitler.print_game_dashboard(session, None, "Game update")
+        elapsed = time.perf_counter() - began
+        print(f"{mode:>10} {api_calls / dashboards:>10.1f} {elapsed / dashboards * 1000:>10.1f}")
+    api_latency = 0
+    print(f"\n{games} games, per game:")
+    print(f"{'mode':>10} {'messages':>9} {'w/images':>9} {'edits':>6} {'API calls':>10} {'KB up':>8}")
+    for mode in ('classic', 'single', 'live'):
+        secrethitler.DASHBOARD_MODE = mode
+        random.seed(0)
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        secrethitler.attachment_urls = {}
+        channel = FakeChannel(2)
+        api_calls = edits = bytes_uploaded = 0
+        for game in range(games):
+            await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+        print(f"{mode:>10} {channel.messages / games:>9.1f} {channel.image_messages / games:>9.1f} {edits / games:>6.1f} {api_calls / games:>10.1f} {bytes_uploaded / games / 1024:>8.1f}")
+    secrethitler.DASHBOARD_MODE = 'single'
+
+
+class UncoalescedSendQueue(secrethitler.ChannelSendQueue):
+    """The send queue without coalescing, so every vote posts its own progress message."""
+
+    def queue(self, target, content, coalesce_key, kwargs):
+        return super().queue(target, content, None, kwargs)
+
+
+async def bench_votes(num_players=10, speedup=10):
+    """Sends a burst of votes from a full table and counts the channel messages with and without coalescing.
+
+    Discord's per-channel rate limit is applied, sped up so the benchmark runs quickly.
+    """
+    global api_calls
+    limit, period = DISCORD_RATE_LIMIT
+    secrethitler.CHANNEL_SEND_RATE_LIMIT, secrethitler.CHANNEL_SEND_RATE_PERIOD = limit, period / speedup
+    print(f"Rate limit: {limit} messages per {period / speedup:.2f}s ({speedup}x faster than Discord)")
+    print(f"{'queue':>12} {'messages':>10} {'coalesced':>10} {'max depth':>10} {'rate wait s':>12} {'seconds':>10}")
+    for queue_class in (UncoalescedSendQueue, secrethitler.ChannelSendQueue):
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        channel = FakeChannel(1)
+        await start_game(channel, num_players)
+        session = secrethitler.sessions[channel.id]
+        session.outbox = queue_class(channel)
+        await run_command(secrethitler.nominate, channel, session.current_president, next(p for p in session.players if p != session.current_president).name)
+        voters = [p for p in session.players if p not in (session.current_president, session.current_chancellor)]
+        api_calls = 0
+        began = time.perf_counter()
+        # Everyone votes at once, each command handled in its own task like discord.py does
+        await asyncio.gather(*(run_command(secrethitler.ja, channel, voter) for voter in voters))
+        elapsed = time.perf_counter() - began
+        stats = session.outbox.stats()
+        print(f"{'coalescing' if queue_class is secrethitler.ChannelSendQueue else 'none':>12} {api_calls:>10} {stats['coalesced']:>10} {stats['max_depth']:>10} {stats['rate_limit_wait']:>12.2f} {elapsed:>10.2f}")
+    secrethitler.CHANNEL_SEND_RATE_LIMIT = 10**9
+
+
+def make_mock_author(id, name, latency, failures=0):
+    """A player built the way the tester command builds them, whose DMs take `latency` seconds and fail `failures` times first."""
+    async def send(*args, **kwargs):
+        nonlocal failures
+        await asyncio.sleep(latency)
+        if failures:
+            failures -= 1
+            raise secrethitler.discord.Forbidden(MagicMock(status=403, reason='Forbidden'), 'Cannot send messages to this user')
+    mock_author = MagicMock()
+    mock_author.send = AsyncMock(side_effect=send)
+    mock_author.dm_channel = None
+    mock_author.create_dm = AsyncMock(return_value=mock_author)
+    mock_author.name = name
+    mock_author.id = id
+    return mock_author
+
+
+async def bench_roles(num_players=10, latency=0.05):
+    """Times the role reveal at game start, one DM at a time versus concurrently, with one player whose DMs fail twice."""
+    print(f"Each DM takes {latency * 1000:.0f} ms, retries start after {secrethitler.ROLE_DM_RETRY_DELAY * 1000:.0f} ms.")
+    print(f"{'concurrency':>12} {'failing':>8} {'DMs':>6} {'delivered':>10} {'ms':>8}")
+    concurrency = secrethitler.ROLE_DM_CONCURRENCY
+    for limit in (1, concurrency):
+        for failing in (0, 1):
+            secrethitler.ROLE_DM_CONCURRENCY = limit
+            session = secrethitler.GameSession(FakeChannel(1))
+            session.players = [make_mock_author(i, f"Player{i}", latency, failures=2 if i < failing else 0) for i in range(num_players)]
+            roles = [secrethitler.HITLER] + [secrethitler.FASCIST] * 3 + [secrethitler.LIBERAL] * (num_players - 4)
+            session.role_assignments = dict(zip(session.players, roles))
+            began = time.perf_counter()
+            delivered = await secrethitler.send_roles_to_players(session)
+            elapsed = time.perf_counter() - began
+            dms = sum(player.send.await_count for player in session.players)
+            print(f"{limit:>12} {failing:>8} {dms:>6} {sum(delivered.values()):>7}/{num_players:<2} {elapsed * 1000:>8.0f}")
+    secrethitler.ROLE_DM_CONCURRENCY = concurrency
+
+
+async def bench_handoff(rounds=20, latency=0.05):
+    """Times the vote that elects a government until the President has their cards, with cold and pre-opened DM channels."""
+    global api_calls, api_latency
+    print(f"Each API call takes {latency * 1000:.0f} ms.")
+    print(f"{'DM channels':>12} {'API calls':>10} {'mean ms':>10}")
+    for warm in (False, True):
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        channel = FakeChannel(1)
+        players = await start_game(channel, 7)
+        session = secrethitler.sessions[channel.id]
+        calls = elapsed = 0
+        for _ in range(rounds):
+            if session.game_state != secrethitler.NOMINATE_CHANCELLOR:
+                players = await start_game(channel, 7)
+                session = secrethitler.sessions[channel.id]
+            if not warm:
+                session.dm_channels.clear()
+                for player in players:
+                    player.dm_channel = None
+            president = session.current_president
+            chancellor = next(p for p in session.players if p not in (president, session.previous_president))
+            await run_command(secrethitler.nominate, channel, president, chancellor.name)
+            voters = [p for p in session.players if p not in (president, chancellor)]
+            for voter in voters[:-1]:
+                await run_command(secrethitler.ja, channel, voter)
+            api_calls, api_latency = 0, latency
+            began = time.perf_counter()
+            await run_command(secrethitler.ja, channel, voters[-1])
+            elapsed += time.perf_counter() - began
+            calls += api_calls
+            api_latency = 0
+            if session.game_state == secrethitler.PRESIDENTIAL_LEGISLATION:
+                await run_command(secrethitler.discard, channel, session.current_president, '1')
+                await run_command(secrethitler.enact, channel, session.current_chancellor, '1')
+            while session.game_state not in (secrethitler.NOMINATE_CHANCELLOR, secrethitler.GAME_NOT_STARTED):
+                await play_election(channel)
+        print(f"{'pre-opened' if warm else 'cold':>12} {calls / rounds:>10.1f} {elapsed / rounds * 1000:>10.1f}")
+
+
+async def bench_persistence(rounds=500):
+    """Measures what snapshotting the game after every command adds to per-command latency, then resumes the games."""
+    global command_timings
+    saves = 0
+    save_game = persistence.save_game
+
+    def counting_save_game(*args):
+        nonlocal saves
+        saves += 1
+        save_game(*args)
+    persistence.save_game = counting_save_game
+    print(f"{'store':>10} {'commands':>10} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10} {'saves':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # The first pass only warms the renderer
+        for pass_number, store in enumerate((None, None, 'sqlite')):
+            random.seed(0)
+            secrethitler.sessions.clear()
+            secrethitler.player_sessions.clear()
+            secrethitler.game_store = persistence.open_store(os.path.join(tmp, 'games.db')) if store else None
+            saves = 0
+            command_timings = []
+            channels = [FakeChannel(i + 1) for i in range(10)]
+            for _ in range(rounds):
+                channel = random.choice(channels)
+                if channel.id not in secrethitler.sessions or secrethitler.sessions[channel.id].game_state == secrethitler.GAME_NOT_STARTED:
+                    await start_game(channel, 7)
+                await play_election(channel)
+            timings = sorted(command_timings)
+            command_timings = None
+            if pass_number > 0:
+                print(f"{str(store):>10} {len(timings):>10} {statistics.mean(timings):>10.3f} {statistics.median(timings):>10.3f} {timings[int(len(timings) * 0.99) - 1]:>10.3f} {saves:>8}")
+        # Check every game comes back exactly as it was saved
+        saved = persistence.load_games(secrethitler.game_store)
+        resumed = 0
+        for channel_id, snapshot in saved.items():
+            running = secrethitler.sessions[channel_id]
+            session = secrethitler.GameSession(FakeChannel(channel_id))
+            secrethitler.restore_session(session, snapshot, {player.id: player for player in running.players + running.assassinated})
+            resumed += secrethitler.get_session_snapshot(session) == secrethitler.get_session_snapshot(running)
+        print(f"Resumed {resumed}/{len(saved)} saved games exactly.")
+        secrethitler.game_store.close()
+        secrethitler.game_store = None
+    persistence.save_game = save_game
+
+async def bench_replay(rounds=2000):
+    """Plays games with the event log on, then rebuilds every game from its events and checks games in progress match."""
+    print(f"{'games':>8} {'events':>8} {'seconds':>10} {'events/s':>10} {'matched':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        random.seed(0)
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        secrethitler.game_store = persistence.open_store(os.path.join(tmp, 'games.db'))
+        channels = [FakeChannel(i + 1) for i in range(10)]
+        for _ in range(rounds):
+            channel = random.choice(channels)
+            if channel.id not in secrethitler.sessions or secrethitler.sessions[channel.id].game_state == secrethitler.GAME_NOT_STARTED:
+                await start_game(channel, random.randint(5, 10))
+            await play_election(channel)
+        games = {game_id: persistence.load_events(secrethitler.game_store, game_id) for game_id, *_ in persistence.list_games(secrethitler.game_store, limit=-1)}
+        began = time.perf_counter()
+        replayed = {game_id: replay.replay(events) for game_id, (_, events) in games.items()}
+        elapsed = time.perf_counter() - began
+        running = [session for session in secrethitler.sessions.values() if session.game_id in games]
+        matched = sum(replay.get_state_summary(replayed[session.game_id]) == replay.get_state_summary(session) for session in running)
+        num_events = sum(len(events) for _, events in games.values())
+        print(f"{len(games):>8} {num_events:>8} {elapsed:>10.3f} {num_events / elapsed:>10.0f} {matched:>7}/{len(running):<2}")
+        secrethitler.game_store.close()
+        secrethitler.game_store = None
+
+
+async def play_scripted_game(channel, num_players):
+    """Plays a whole game through the command handlers, every player choosing at random."""
+    await start_game(channel, num_players)
+    session = secrethitler.sessions[channel.id]
+
+    def pick(players):
+        return random.choice(players).name
+
+    while session.game_state != secrethitler.GAME_NOT_STARTED:
+        president, chancellor = session.current_president, session.current_chancellor
+        others = [p for p in session.players if p != president]
+        if session.game_state == secrethitler.NOMINATE_CHANCELLOR:
+            await run_command(secrethitler.nominate, channel, president, pick([p for p in others if p != session.previous_president]))
+        elif session.game_state == secrethitler.ELECTION:
+            voter = next(p for p in others if p not in session.votes and p != chancellor)
+            await run_command(secrethitler.ja if random.random() < 0.6 else secrethitler.nein, channel, voter)
+        elif session.game_state == secrethitler.PRESIDENTIAL_LEGISLATION:
+            await run_command(secrethitler.discard, channel, president, str(random.randint(1, len(session.top_cards))))
+        elif session.game_state == secrethitler.CHANCELLOR_LEGISLATION:
+            if session.fascist_policies == 5 and random.random() < 0.2:
+                await run_command(secrethitler.veto, channel, chancellor)
+            else:
+                await run_command(secrethitler.enact, channel, chancellor, str(random.randint(1, len(session.top_cards))))
+        elif session.game_state == secrethitler.AGENDA_VETOED:
+            await run_command(random.choice((secrethitler.ja, secrethitler.nein)), channel, president)
+        elif session.game_state == secrethitler.EXECUTIVE_INVESTIGATION:
+            await run_command(secrethitler.investigate, channel, president, pick(others))
+        elif session.game_state == secrethitler.EXECUTIVE_APPOINTMENT:
+            await run_command(secrethitler.appoint, channel, president, pick(others))
+        elif session.game_state == secrethitler.EXECUTIVE_KILL:
+            await run_command(secrethitler.kill, channel, president, pick(others))
+
+
+def get_percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+async def bench_commands(games=60, latency=0.0):
+    """Plays whole games through the command handlers and reports latency, API calls and upload size per phase of the game.
+
+    Watch these numbers for regressions. Start with an empty attachment cache, so the first upload of each image is counted.
+    """
+    global command_log, api_latency
+    random.seed(0)
+    secrethitler.sessions.clear()
+    secrethitler.player_sessions.clear()
+    secrethitler.attachment_urls = {}
+    api_latency = latency
+    command_log = []
+    channel = FakeChannel(1)
+    for game in range(games):
+        await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+    phases = {}
+    for phase, elapsed, calls, uploaded in command_log:
+        phases.setdefault(phase, []).append((elapsed, calls, uploaded))
+    command_log = None
+    api_latency = 0
+    print(f"{games} games, each API call takes {latency * 1000:.0f} ms.")
+    print(f"{'phase':>18} {'commands':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'API calls':>10} {'KB up':>8}")
+    for phase, runs in sorted(phases.items(), key=lambda item: -len(item[1])):
+        timings = sorted(elapsed for elapsed, _, _ in runs)
+        calls = sum(calls for _, calls, _ in runs) / len(runs)
+        uploaded = sum(uploaded for _, _, uploaded in runs) / len(runs) / 1024
+        print(f"{phase:>18} {len(runs):>9} {get_percentile(timings, 0.5):>8.2f} {get_percentile(timings, 0.9):>8.2f} "
+              f"{get_percentile(timings, 0.99):>8.2f} {timings[-1]:>8.2f} {calls:>10.2f} {uploaded:>8.1f}")
+    print("API calls and KB up are per command. 'last vote' is the vote that decides an election.")
+
+
+def play_engine_game(num_players, rng):
+    """Plays one game on the engine alone with players who pick at random, returning the number of actions applied."""
+    state = engine.GameState()
+    players = list(range(num_players))
+    actions = [('join', player) for player in players] + [('ready', 0), ('start', 0)]
+    for action in actions:
+        engine.apply(state, action, rng)
+    applied = len(actions)
+    while state.game_state != engine.GAME_OVER:
+        president = state.current_president
+        if state.game_state == engine.NOMINATE_CHANCELLOR:
+            action = ('nominate', president, rng.choice([p for p in state.players if p != president and p != state.previous_president]))
+        elif state.game_state == engine.ELECTION:
+            voter = next(p for p in state.players if p not in state.votes and p != president and p != state.current_chancellor)
+            action = (rng.choice(('ja', 'nein')), voter)
+        elif state.game_state == engine.PRESIDENTIAL_LEGISLATION:
+            action = ('discard', president, rng.randint(1, len(state.top_cards)))
+        elif state.game_state == engine.CHANCELLOR_LEGISLATION:
+            action = ('enact', state.current_chancellor, rng.randint(1, len(state.top_cards)))
+        else:
+            power = {engine.EXECUTIVE_INVESTIGATION: 'investigate', engine.EXECUTIVE_APPOINTMENT: 'appoint', engine.EXECUTIVE_KILL: 'kill'}[state.game_state]
+            action = (power, president, rng.choice([p for p in state.players if p != president]))
+        engine.apply(state, action, rng)
+        applied += 1
+    return applied
+
+
+def bench_engine(games=20000):
+    """Measures how many actions per second the rules engine applies with no Discord layer at all."""
+    rng = random.Random(0)
+    began = time.perf_counter()
+    actions = sum(play_engine_game(rng.randint(5, 10), rng) for _ in range(games))
+    elapsed = time.perf_counter() - began
+    print(f"{'games':>8} {'actions':>10} {'seconds':>10} {'actions/s':>10} {'games/s':>10}")
+    print(f"{games:>8} {actions:>10} {elapsed:>10.3f} {actions / elapsed:>10.0f} {games / elapsed:>10.0f}")
+
+
+def bench_simulate(games=20000):
+    """Measures the simulator on one process and on every core, and checks both runs add up to the same totals."""
+    print(f"{'processes':>9} {'games':>8} {'seconds':>10} {'games/s':>10}")
+    results = []
+    for processes in sorted({1, os.cpu_count()}):
+        began = time.perf_counter()
+        totals = simulate.simulate(games, processes=processes)
+        elapsed = time.perf_counter() - began
+        results.append({num_players: (total.counts, total.rounds) for num_players, total in totals.items()})
+        print(f"{processes:>9} {games:>8} {elapsed:>10.3f} {games / elapsed:>10.0f}")
+    print(f"Same totals on every process count: {all(result == results[0] for result in results)}")
+
+
+SESSIONS_PER_GAME = 10  # At most 9 policies can be enacted without either side winning
+
+
+class UnshuffledRandom(random.Random):
+    """A random.Random that leaves lists as they are, to time the piles without the shuffles both ways share."""
+
+    def shuffle(self, x):
+        pass
+
+
+def get_new_deck(shuffler):
+    policy_cards = [engine.LIBERAL] * engine.LIBERAL_POLICY_COUNT + [engine.FASCIST] * engine.FASCIST_POLICY_COUNT
+    shuffler.shuffle(policy_cards)
+    return policy_cards
+
+
+def cycle_list_deck(sessions, shuffler):
+    """Legislative sessions on the plain lists the engine used to keep its piles in, with a new deck every game."""
+    for session in range(sessions):
+        if session % SESSIONS_PER_GAME == 0:
+            policy_cards = get_new_deck(shuffler)
+            discarded_policies = []
+        top_cards = policy_cards[:min(3, len(policy_cards))]
+        policy_cards = policy_cards[min(3, len(policy_cards)):]
+        discarded_policies.append(top_cards.pop(0))
+        discarded_policies.extend(top_cards[1:])
+        if len(policy_cards) < 3:
+            policy_cards.extend(discarded_policies)
+            discarded_policies.clear()
+            shuffler.shuffle(policy_cards)
+        policy_cards.count(engine.LIBERAL), discarded_policies.count(engine.LIBERAL)
+
+
+def cycle_policy_deck(sessions, shuffler):
+    """The same legislative sessions on a PolicyDeck."""
+    deck = engine.PolicyDeck()
+    for session in range(sessions):
+        if session % SESSIONS_PER_GAME == 0:
+            deck.load(get_new_deck(shuffler))
+        top_cards = deck.draw(3)
+        deck.discard([top_cards.pop(0)])
+        deck.discard(top_cards[1:])
+        if deck.drawable < 3:
+            deck.reshuffle(shuffler)
+        deck.liberal_drawable, deck.liberal_discarded
+
+
+def bench_deck(sessions=50000, repeats=15):
+    """Times draw, discard, reshuffle and counting the Liberal cards left, per legislative session, for both ways of keeping the piles.
+
+    Each game starts from a new deck, as in the bot, so the piles never dwindle to a card or two. Both ways are
+    timed with the seeded shuffles and without them, since they shuffle the same lists, in turn on every repeat
+    so they see the same noise, and the best of `repeats` runs is shown.
+    """
+    runs = [
+        (name, shuffles, cycle, shuffler_class)
+        for shuffles, shuffler_class in (('yes', random.Random), ('no', UnshuffledRandom))
+        for name, cycle in (('lists', cycle_list_deck), ('PolicyDeck', cycle_policy_deck))
+    ]
+    best = {}
+    for _ in range(repeats):
+        for name, shuffles, cycle, shuffler_class in runs:
+            began = time.perf_counter()
+            cycle(sessions, shuffler_class(0))
+            elapsed = time.perf_counter() - began
+            best[name, shuffles] = min(best.get((name, shuffles), elapsed), elapsed)
+    print(f"{'deck':>12} {'shuffles':>9} {'sessions':>10} {'ns/session':>11}")
+    for name, shuffles, _, _ in runs:
+        print(f"{name:>12} {shuffles:>9} {sessions:>10} {best[name, shuffles] / sessions * 1e9:>11.0f}")
+
+
+async def bench_metrics(games=20):
+    """Plays games through the command handlers, then scrapes /metrics and checks its API call count against the fake transport's."""
+    global api_calls
+    random.seed(0)
+    secrethitler.sessions.clear()
+    secrethitler.player_sessions.clear()
+    secrethitler.API_CALLS.values.clear()
+    api_calls = 0
+    channel = FakeChannel(1)
+    for game in range(games):
+        await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+    runner = await metrics.serve('127.0.0.1', 0)
+    port = runner.addresses[0][1]
+    async with aiohttp.ClientSession() as client:
+        began = time.perf_counter()
+        async with client.get(f"http://127.0.0.1:{port}/metrics") as response:
+            text = await response.text()
+        elapsed = time.perf_counter() - began
+    await runner.cleanup()
+    counted = sum(secrethitler.API_CALLS.values.values())
+    print(f"Scraped {len(text) // 1024} KB, {text.count(chr(10))} lines in {elapsed * 1000:.1f} ms")
+    print(f"API calls: {api_calls} sent by the fake transport, {counted} counted by the metrics")
+    for line in text.splitlines():
+        if line.startswith(('secret_hitler_api_calls_total', 'secret_hitler_command_seconds_count{command="start"}', 'secret_hitler_games{')):
+            print(line)
+
+
+async def bench_tracing(games=30):
+    """Plays the same games with tracing off and at two sample rates, and checks every span written belongs to a complete trace.
+
+    A chat message that isn't a command is sent between games, and 'chat' counts the spans it wrote, which should be none.
+    """
+    global command_timings
+    print(f"{'sample rate':>12} {'commands':>9} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'traces':>7} {'spans':>7} {'KB':>7} {'complete':>9} {'chat':>5}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # The first pass only warms the renderer
+        for pass_number, rate in enumerate((0.0, 0.0, 0.1, 1.0)):
+            path = os.path.join(tmp, f"traces-{pass_number}.jsonl")
+            tracing.configure(path, rate)
+            random.seed(0)
+            secrethitler.sessions.clear()
+            secrethitler.player_sessions.clear()
+            command_timings = []
+            channel = FakeChannel(1)
+            for game in range(games):
+                await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+                with secrethitler.start_command_trace(FakeContext(channel, FakePlayer(1))):
+                    pass
+            tracing.configure(path, 0.0)
+            timings = sorted(command_timings)
+            command_timings = None
+            spans = []
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as trace_file:
+                    spans = [json.loads(line) for line in trace_file]
+            traces = {}
+            for span in spans:
+                traces.setdefault(span['traceId'], {})[span['spanId']] = span
+            # A trace is complete if it has one root and every other span's parent is in it
+            complete = sum(
+                sum(not span['parentSpanId'] for span in trace.values()) == 1
+                and all(not span['parentSpanId'] or span['parentSpanId'] in trace for span in trace.values())
+                for trace in traces.values()
+            )
+            if pass_number > 0:
+                print(f"{rate:>12} {len(timings):>9} {statistics.mean(timings):>8.3f} {statistics.median(timings):>8.3f} "
+                      f"{get_percentile(timings, 0.99):>8.3f} {len(traces):>7} {len(spans):>7} {os.path.getsize(path) // 1024 if spans else 0:>7} {complete:>6}/{len(traces):<3} {sum(span['attributes'].get('command') is None for span in spans if span['name'] == 'command'):>4}")
+
+
+class SlowDiskHandler(logs.CompressingRotatingFileHandler):
+    """Writes to a disk that takes `stall` seconds per write, as a busy or network disk can."""
+
+    def __init__(self, filename, stall):
+        super().__init__(filename, maxBytes=16*1024, backupCount=1000, encoding='utf-8')
+        self.stall = stall
+
+    def emit(self, record):
+        time.sleep(self.stall)
+        super().emit(record)
+
+
+async def measure_lag(lags, interval=0.001):
+    loop = asyncio.get_running_loop()
+    while True:
+        began = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - began - interval) * 1000)
+
+
+async def bench_logging(games=30, stall=0.005, latency=0.001):
+    """Plays the same games without logging, logging straight to a slow disk from the event loop, then through the queue to a background thread.
+
+    Reports command latency and how late the event loop woke up from 1 ms sleeps, and checks no line is lost.
+    The log rotates every 16 KB, so the rotations and their compression are included.
+    """
+    global command_timings, api_latency
+    print(f"{stall * 1000:.0f} ms per write, each API call takes {latency * 1000:.0f} ms.")
+    print(f"{'logging':>8} {'commands':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'lag p99 ms':>11} {'lag max ms':>11} {'lines':>7} {'files':>6}")
+    logger = secrethitler.logger
+    bot_handlers = logger.handlers[:]
+    api_latency = latency
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The first pass only warms the renderer
+            for pass_number, mode in enumerate(('off', 'off', 'direct', 'queued')):
+                for handler in logger.handlers[:]:
+                    logger.removeHandler(handler)
+                path = os.path.join(tmp, f"{pass_number}-{mode}.log")
+                handler = SlowDiskHandler(path, stall)
+                if mode == 'direct':
+                    handler.setFormatter(logs.JsonFormatter())
+                    logger.addHandler(handler)
+                elif mode == 'queued':
+                    listener = logs.setup(logger, handler)
+                random.seed(0)
+                secrethitler.sessions.clear()
+                secrethitler.player_sessions.clear()
+                command_timings = []
+                lags = []
+                monitor = asyncio.create_task(measure_lag(lags))
+                channel = FakeChannel(1)
+                for game in range(games):
+                    await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+                monitor.cancel()
+                if mode == 'queued':
+                    listener.stop()
+                handler.close()
+                timings = sorted(command_timings)
+                command_timings = None
+                lags.sort()
+                files = glob.glob(path + '*')
+                lines = 0
+                for name in files:
+                    with (gzip.open(name, 'rt', encoding='utf-8') if name.endswith('.gz') else open(name, encoding='utf-8')) as log_file:
+                        lines += sum(1 for line in log_file if json.loads(line))
+                if pass_number > 0:
+                    print(f"{mode:>8} {len(timings):>9} {get_percentile(timings, 0.5):>8.2f} {get_percentile(timings, 0.99):>8.2f} {timings[-1]:>8.2f} "
+                          f"{get_percentile(lags, 0.99):>11.2f} {lags[-1]:>11.2f} {lines:>7} {len(files):>6}")
+    finally:
+        api_latency = 0
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        for handler in bot_handlers:
+            logger.addHandler(handler)
+
+
+async def arm_sleep_tasks(deadlines, fired):
+    """One asyncio.sleep task per idle player, the way each turn could time out on its own."""
+    loop = asyncio.get_running_loop()
+
+    async def wait(deadline):
+        await asyncio.sleep(deadline - loop.time())
+        fired.append(loop.time() - deadline)
+
+    return [asyncio.create_task(wait(deadline)) for deadline in deadlines]
+
+
+async def arm_shared_heap(scheduler, deadlines, fired):
+    loop = asyncio.get_running_loop()
+
+    def on_timer(deadline):
+        fired.append(loop.time() - deadline)
+
+    return [scheduler.call_later(deadline - loop.time(), on_timer, deadline) for deadline in deadlines]
+
+
+async def play_idle_games(games, num_players, timeout):
+    """Starts games nobody plays after !start and waits for the turn timers to finish them, returning the seconds it took."""
+    secrethitler.sessions.clear()
+    secrethitler.player_sessions.clear()
+    secrethitler.TURN_TIMEOUT = timeout
+    secrethitler.TURN_REMINDER = timeout / 2
+    channels = [FakeChannel(game + 1) for game in range(games)]
+    try:
+        for channel in channels:
+            await start_game(channel, num_players)
+        began = time.perf_counter()
+        while any(session.game_state != secrethitler.GAME_NOT_STARTED for session in secrethitler.sessions.values()):
+            await asyncio.sleep(timeout)
+        elapsed = time.perf_counter() - began
+        while secrethitler.background_tasks:
+            await asyncio.sleep(0)
+        return elapsed
+    finally:
+        secrethitler.TURN_TIMEOUT = 0
+        secrethitler.turn_timers.clear()
+
+
+async def bench_timers(games=2000, players_waited_on=7, spread=1.0):
+    """Arms a deadline for every player of `games` games as separate asyncio.sleep tasks, then as one per game on the shared heap.
+
+    Each arms every deadline, cancels and re-arms them all as a phase change would, then lets them fire.
+    Memory is measured on a third arming. It then plays games where nobody does anything after !start,
+    which only the turn timers can finish.
+    """
+    loop = asyncio.get_running_loop()
+    print(f"{games} games, {players_waited_on} players waited on per game, deadlines spread over {spread * 1000:.0f} ms.")
+    print(f"{'timers':>12} {'armed':>7} {'arm ms':>8} {'re-arm ms':>10} {'KB':>8} {'late p50 ms':>12} {'late p99 ms':>12}")
+    for name, count in (('sleep tasks', games * players_waited_on), ('shared heap', games)):
+        scheduler = timers.Scheduler()
+        fired = []
+
+        async def arm():
+            deadlines = [loop.time() + spread + random.random() * spread for _ in range(count)]
+            if name == 'sleep tasks':
+                return await arm_sleep_tasks(deadlines, fired)
+            return await arm_shared_heap(scheduler, deadlines, fired)
+
+        async def cancel(handles):
+            for handle in handles:
+                handle.cancel()
+            if name == 'sleep tasks':
+                await asyncio.gather(*handles, return_exceptions=True)
+
+        began = time.perf_counter()
+        handles = await arm()
+        armed = time.perf_counter() - began
+        began = time.perf_counter()
+        await cancel(handles)
+        handles = await arm()
+        rearmed = time.perf_counter() - began
+        await cancel(handles)
+        tracemalloc.start()
+        handles = await arm()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        while len(fired) < count:
+            await asyncio.sleep(0.05)
+        fired.sort()
+        print(f"{name:>12} {count:>7} {armed * 1000:>8.1f} {rearmed * 1000:>10.1f} {memory // 1024:>8} "
+              f"{get_percentile(fired, 0.5) * 1000:>12.2f} {get_percentile(fired, 0.99) * 1000:>12.2f}")
+    random.seed(0)
+    idle_games, timeout = 200, 0.02
+    elapsed = await play_idle_games(idle_games, players_waited_on, timeout)
+    print(f"{idle_games} idle games of {players_waited_on} players finished by {timeout * 1000:.0f} ms turn timers in {elapsed:.2f}s, "
+          f"{len(secrethitler.turn_timers)} timers left")
+
+
+def run_cluster_worker(events, results, latency):
+    """A worker process of the load harness, playing the game of every event the stand-in gateway routes to it."""
+    asyncio.run(serve_cluster_worker(events, results, latency))
+
+
+async def serve_cluster_worker(events, results, latency):
+    global api_latency, command_timings
+    api_latency = latency
+    command_timings = []
+    loop = asyncio.get_running_loop()
+    games = []
+    channels = []
+    while True:
+        event = await loop.run_in_executor(None, events.get)
+        if event is None:
+            break
+        guild_id, channel_id, num_players = event
+        channels.append(FakeChannel(channel_id))
+        games.append(asyncio.create_task(play_scripted_game(channels[-1], num_players)))
+    await asyncio.gather(*games)
+    # Sessions are dropped once their game is over, so count the channels this worker sent messages to
+    results.put((len(command_timings), sorted(channel.id for channel in channels if channel.messages)))
+
+
+def bench_cluster(worker_counts=(1, 2, 4), guilds=48, shard_count=8, latency=0.005):
+    """Routes a game per guild to worker processes by shard, as Discord's gateway would, and measures commands per second.
+
+    Each worker owns a range of shards as cluster.py would give it, and plays its games through the real command
+    handlers. The stand-in gateway sends each guild to the worker owning shard (guild_id >> 22) % shard_count,
+    and the run checks that no channel was played by more than one worker.
+    Throughput only scales while there are idle cores for the workers to run on. Then it checks that workers
+    can share the attachment cache, and where players are sent for DM commands, see check_dm_routing().
+    """
+    rng = random.Random(0)
+    guild_ids = [rng.getrandbits(63) for _ in range(guilds)]
+    # Render every image before forking, or each worker would render its own copies and that would swamp the commands
+    began = time.perf_counter()
+    for key in secrethitler.get_rendered_asset_keys():
+        secrethitler.renderer.render(key, secrethitler.IMAGE_TIER)
+    print(f"Rendered every image in {time.perf_counter() - began:.1f}s")
+    print(f"{guilds} guilds, one game each, {shard_count} shards, each API call takes {latency * 1000:.0f} ms, {os.cpu_count()} cores.")
+    print(f"{'workers':>8} {'games':>12} {'commands':>9} {'seconds':>8} {'commands/s':>11} {'disjoint':>9}")
+    for workers in worker_counts:
+        owners = {shard_id: worker for worker, shard_ids in enumerate(cluster.get_shard_ranges(shard_count, workers)) for shard_id in shard_ids}
+        queues = [multiprocessing.Queue() for _ in range(workers)]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=run_cluster_worker, args=(queue, results, latency)) for queue in queues]
+        for process in processes:
+            process.start()
+        began = time.perf_counter()
+        routed = [0] * workers
+        for channel_id, guild_id in enumerate(guild_ids, 1):
+            worker = owners[cluster.get_shard(guild_id, shard_count)]
+            routed[worker] += 1
+            queues[worker].put((guild_id, channel_id, engine.MIN_PLAYERS + channel_id % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1)))
+        for queue in queues:
+            queue.put(None)
+        collected = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - began
+        for process in processes:
+            process.join()
+        commands = sum(count for count, _ in collected)
+        channels = [channel_id for _, channel_ids in collected for channel_id in channel_ids]
+        disjoint = len(channels) == len(set(channels)) == guilds
+        print(f"{workers:>8} {'/'.join(map(str, routed)):>12} {commands:>9} {elapsed:>8.2f} {commands / elapsed:>11.0f} {str(disjoint):>9}")
+    check_shared_attachment_cache()
+    asyncio.run(check_dm_routing())
+
+
+def save_attachment_cache_repeatedly(path, worker, saves):
+    """A worker process saving its own version of the attachment cache over and over."""
+    secrethitler.ATTACHMENT_CACHE_FILE = path
+    for save in range(saves):
+        secrethitler.attachment_urls = {f"image-{worker}-{n}.png": f"https://cdn.example/{worker}/{save}/{n}" for n in range(200)}
+        secrethitler.save_attachment_cache()
+
+
+def check_shared_attachment_cache(workers=4, saves=200):
+    """Has several workers save the attachment cache at once, reading it back all the while, and counts the reads that aren't valid JSON."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'attachment_cache.json')
+        processes = [multiprocessing.Process(target=save_attachment_cache_repeatedly, args=(path, worker, saves)) for worker in range(workers)]
+        for process in processes:
+            process.start()
+        reads = corrupt = 0
+        while any(process.is_alive() for process in processes) or not reads:
+            try:
+                with open(path, encoding='utf-8') as cache_file:
+                    json.load(cache_file)
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                corrupt += 1
+            reads += 1
+        for process in processes:
+            process.join()
+        leftovers = len(glob.glob(os.path.join(tmp, '*.tmp')))
+    print(f"Attachment cache: {workers} workers saved it {workers * saves} times, {corrupt} of {reads} reads were corrupt, {leftovers} temp files left")
+
+
+class FakeDMChannel(discord.DMChannel):
+    """A DM to the bot, which checks tell apart from a game channel by its type."""
+
+    def __init__(self, player):
+        self.id = player.id
+        self.replies = []
+
+    async def send(self, content=None, **kwargs):
+        self.replies.append(content)
+
+
+async def check_dm_routing():
+    """Checks where players are told to send the commands their card DMs ask for, on a worker with shard 0 and on one without.
+
+    Discord only sends DMs to the connection of shard 0, so on any other worker the DM must point to the game channel,
+    and a DM command for a game shard 0's worker doesn't run must be answered rather than dropped.
+    """
+    shard_ids = secrethitler.SHARD_IDS
+    try:
+        for secrethitler.SHARD_IDS in ([0, 1], [1]):
+            secrethitler.sessions.clear()
+            secrethitler.player_sessions.clear()
+            channel = FakeChannel(1)
+            players = await start_game(channel, engine.MIN_PLAYERS)
+            dms = {player.id: [] for player in players}
+            for player in players:
+                player.send = functools.partial(record_dm, player, dms[player.id])
+            session = secrethitler.sessions[channel.id]
+            president = session.current_president
+            await run_command(secrethitler.nominate, channel, president, next(p for p in session.players if p != president).name)
+            for voter in list(session.players):
+                if voter not in (session.current_president, session.current_chancellor):
+                    await run_command(secrethitler.ja, channel, voter)
+            pointed = f"#{channel.name}" in dms[president.id][-1]
+            print(f"SHARD_IDS {secrethitler.SHARD_IDS}: the President's card DM points to the game channel: {pointed}")
+        secrethitler.SHARD_IDS = [0]
+        stranger = FakePlayer(999)
+        dm = FakeDMChannel(stranger)
+        await run_command(secrethitler.discard, dm, stranger, '1')
+        print(f"SHARD_IDS [0]: a DM !discard for a game run elsewhere is answered with: {dm.replies}")
+    finally:
+        secrethitler.SHARD_IDS = shard_ids
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+
+
+async def record_dm(player, dms, content=None, **kwargs):
+    dms.append(content)
+    return await FakeMessageable.send(player, content, **kwargs)
+
+
+STARTUP_SCRIPT = '''
+import time
+began = time.perf_counter()
+import sys
+import secrethitler
+imported = time.perf_counter()
+secrethitler.load_config()
+secrethitler.warm_caches()
+print(imported - began, time.perf_counter() - imported, 'unittest.mock' in sys.modules)
+'''
+
+
+def bench_startup(runs=5):
+    """Times importing the bot and warming its caches in fresh interpreters, and checks the test tooling isn't imported.
+
+    The bot warms its caches while it logs in, so only the imports and the config delay the login.
+    """
+    print(f"{'run':>5} {'import s':>10} {'warm s':>10} {'unittest.mock':>14}")
+    imports = []
+    for run in range(runs):
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        import_seconds, warm_seconds, mock_imported = result.stdout.split()
+        imports.append(float(import_seconds))
+        print(f"{run + 1:>5} {float(import_seconds):>10.3f} {float(warm_seconds):>10.3f} {mock_imported:>14}")
+    print(f"Median import: {statistics.median(imports):.3f}s")
+
+
+def make_game_summary(rng, player_ids, ended):
+    """A finished game with random players, roles, winner and actions, as stats.summarize_game() returns it."""
+    num_players = rng.randint(engine.MIN_PLAYERS, engine.MAX_PLAYERS)
+    num_fascists = engine.NUM_FASCISTS[num_players]
+    roles = [engine.HITLER] + [engine.FASCIST] * num_fascists + [engine.LIBERAL] * (num_players - num_fascists - 1)
+    reason = rng.choice(list(stats.WIN_CONDITIONS))
+    winner = engine.LIBERAL if reason in ('liberal_policies', 'hitler_assassinated') else engine.FASCIST
+    players = []
+    for player_id, role in zip(rng.sample(player_ids, num_players), roles):
+        players.append({
+            'id': player_id, 'name': f"Player{player_id}", 'role': role, 'won': (role == engine.LIBERAL) == (winner == engine.LIBERAL),
+            'killed': rng.random() < 0.1, **{name: rng.randint(0, 3) for name in stats.ACTION_COUNTERS},
+        })
+    return {'started': ended - 1800, 'ended': ended, 'winner': winner, 'reason': reason,
+            'liberal_policies': rng.randint(0, 5), 'fascist_policies': rng.randint(0, 6), 'players': players}
+
+
+def time_queries(query, args_list):
+    """Milliseconds each call of `query` takes, sorted."""
+    timings = []
+    for args in args_list:
+        began = time.perf_counter()
+        query(*args)
+        timings.append((time.perf_counter() - began) * 1000)
+    return sorted(timings)
+
+
+def count_player_totals(conn, player_id):
+    return conn.execute('SELECT COUNT(*), SUM(won) FROM game_players WHERE player_id = ?', (player_id,)).fetchone()
+
+
+def count_leaderboard(conn, limit=10):
+    return conn.execute('SELECT player_id, COUNT(*), SUM(won) AS wins FROM game_players GROUP BY player_id ORDER BY wins DESC LIMIT ?', (limit,)).fetchall()
+
+
+async def bench_stats(games=40, history=200000, players=20000, queries=1000, committed=5000):
+    """Checks the statistics of games played through the commands, then times !stats and !leaderboard against a long history.
+
+    The history is made of random games. The queries are timed against the per-player totals the store keeps, and against
+    adding up every game of the player instead.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        random.seed(0)
+        secrethitler.sessions.clear()
+        secrethitler.player_sessions.clear()
+        secrethitler.game_store = conn = persistence.open_store(os.path.join(tmp, 'games.db'))
+        stats.create_tables(conn)
+        record_stats = secrethitler.record_stats
+        record_timings = []
+
+        def timed_record_stats(session):
+            began = time.perf_counter()
+            record_stats(session)
+            record_timings.append((time.perf_counter() - began) * 1000)
+        secrethitler.record_stats = timed_record_stats
+        channel = FakeChannel(1)
+        for game in range(games):
+            await play_scripted_game(channel, engine.MIN_PLAYERS + game % (engine.MAX_PLAYERS - engine.MIN_PLAYERS + 1))
+        secrethitler.record_stats = record_stats
+        recorded = conn.execute('SELECT COUNT(*), SUM(players) FROM finished_games').fetchone()
+        counted = conn.execute('SELECT SUM(games) FROM player_stats').fetchone()[0]
+        totals = conn.execute('SELECT * FROM player_stats ORDER BY player_id').fetchall()
+        stats.rebuild(conn)
+        rebuilt = conn.execute('SELECT * FROM player_stats ORDER BY player_id').fetchall() == totals
+        print(f"Played {games} games: {recorded[0]} recorded, {counted}/{recorded[1]} player games counted, "
+              f"same totals when rebuilt from the event log: {rebuilt}. Recording a game takes {statistics.median(record_timings):.2f} ms (median).")
+        sent = []
+        send = channel.send
+
+        async def recording_send(content=None, **kwargs):
+            sent.append(content)
+            return await send(content, **kwargs)
+        channel.send = recording_send
+        await run_command(secrethitler.show_stats, channel, FakePlayer(channel.id * 100))
+        await run_command(secrethitler.leaderboard, channel, FakePlayer(channel.id * 100))
+        print("\n\n".join(sent))
+        secrethitler.game_store = None
+
+        rng = random.Random(0)
+        player_ids = list(range(10**6, 10**6 + players))
+        summaries = (make_game_summary(rng, player_ids, 1.7e9 + game * 60) for game in range(history))
+        began = time.perf_counter()
+        for game, summary in zip(range(committed), summaries):
+            stats.record_game(conn, f"history{game}", 1, summary)
+        elapsed = time.perf_counter() - began
+        # The rest in batches, only to fill the store faster
+        for batch in itertools.count(committed, 1000):
+            with conn:
+                for game, summary in zip(range(batch, batch + 1000), summaries):
+                    stats.add_game(conn, f"history{game}", 1, summary)
+            if batch + 1000 >= history:
+                break
+        print(f"Wrote {history} games of {players} players, {os.path.getsize(os.path.join(tmp, 'games.db')) / 2**20:.0f} MB. "
+              f"The first {committed} were written a transaction each like the bot does, {committed / elapsed:.0f} games/s.")
+        looked_up = [(conn, rng.choice(player_ids)) for _ in range(queries)]
+        print(f"{'query':>32} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, query, args_list in (
+            ('!stats totals', stats.get_player_stats, looked_up),
+            ('!stats last games', stats.get_recent_games, looked_up),
+            ('!stats by name', stats.find_player, [(conn, f"player{player_id}") for _, player_id in looked_up]),
+            ('!leaderboard', stats.get_leaderboard, [(conn,)] * 100),
+            ('totals added up per query', count_player_totals, looked_up),
+            ('leaderboard added up per query', count_leaderboard, [(conn,)] * 3),
+        ):
+            timings = time_queries(query, args_list)
+            print(f"{name:>32} {get_percentile(timings, 0.5):>8.3f} {get_percentile(timings, 0.99):>8.3f} {timings[-1]:>8.3f}")
+        conn.close()
+
+
+class ImmediateInbox(secrethitler.GameInbox):
+    """The inbox without the queue, so a game's commands run concurrently, interleaving at every await."""
+
+    async def run(self, function, *args):
+        return await function(*args)
+
+
+def check_game(session):
+    """What is wrong with a game's state, as a list of problems."""
+    problems = []
+    if session.game_state not in (secrethitler.GAME_NOT_STARTED, secrethitler.GAME_STARTING):
+        cards = len(session.deck.get_draw_pile()) + len(session.deck.get_discard_pile()) + len(session.top_cards)
+        if cards + session.liberal_policies + session.fascist_policies != engine.LIBERAL_POLICY_COUNT + engine.FASCIST_POLICY_COUNT:
+            problems.append('cards lost')
+    expected_cards = {secrethitler.PRESIDENTIAL_LEGISLATION: 3, secrethitler.CHANCELLOR_LEGISLATION: 2}.get(session.game_state)
+    if expected_cards is not None and len(session.top_cards) != expected_cards:
+        problems.append('wrong hand')
+    if any(voter not in session.players for voter in session.votes):
+        problems.append('vote from a non-player')
+    if set(session.registry.by_id) != {player.id for player in session.players}:
+        problems.append('registry out of date')
+    if any(secrethitler.player_sessions.get(player.id) is not session for player in session.players + session.assassinated):
+        problems.append('player without their game')
+    return problems
+
+
+def get_burst(session, players, size, rng):
+    """`size` commands the players of a game might send at once, many of them no longer valid by the time they run."""
+    president, chancellor = session.current_president, session.current_chancellor
+    others = [player for player in players if player is not president]
+    choices = [
+        (4, lambda: (rng.choice((secrethitler.ja, secrethitler.nein)), rng.choice(players))),
+        (1, lambda: (secrethitler.nominate, president or rng.choice(players), rng.choice(others).name)),
+        (1, lambda: (secrethitler.discard, president or rng.choice(players), rng.choice('123'))),
+        (1, lambda: (secrethitler.enact, chancellor or rng.choice(players), rng.choice('12'))),
+        (0.5, lambda: (rng.choice((secrethitler.investigate, secrethitler.appoint, secrethitler.kill)), president or rng.choice(players), rng.choice(others).name)),
+        (0.2, lambda: (secrethitler.veto, chancellor or rng.choice(players))),
+        (0.003, lambda: (secrethitler.reset, rng.choice(players))),
+    ]
+    if session.game_state in (secrethitler.GAME_NOT_STARTED, secrethitler.GAME_STARTING):
+        choices += [(3, lambda: (secrethitler.join, rng.choice(players))), (1, lambda: (rng.choice((secrethitler.ready, secrethitler.start)), players[0]))]
+    weights, makers = zip(*choices)
+    return [maker() for maker in rng.choices(makers, weights, k=size)]
+
+
+async def stress_games(channels, inbox_class, bursts, size, seed):
+    """Fires bursts of concurrent commands at every game at once, returning (seconds, most commands of a game running at once, problems)."""
+    running = {}  # Channel ID -> commands of its game running right now
+    most_running = 0
+    problems = collections.Counter()
+    before_command, after_command = secrethitler.before_command, secrethitler.after_command
+
+    async def counting_before_command(ctx):
+        nonlocal most_running
+        running[ctx.channel.id] += 1
+        most_running = max(most_running, running[ctx.channel.id])
+        session = secrethitler.get_session(ctx)
+        if session is not None:
+            problems.update(check_game(session))
+        await before_command(ctx)
+
+    async def counting_after_command(ctx):
+        await after_command(ctx)
+        running[ctx.channel.id] -= 1
+    game_inbox = secrethitler.GameInbox
+    secrethitler.before_command, secrethitler.after_command = counting_before_command, counting_after_command
+    secrethitler.GameInbox = inbox_class
+    tables = {}
+    for channel in channels:
+        running[channel.id] = 0
+        tables[channel.id] = await start_game(channel, engine.MAX_PLAYERS)
+
+    async def send(command, channel, *args):
+        try:
+            await run_command(command, channel, *args)
+        except Exception as error:
+            # discord.py would log it and carry on
+            problems[f"{command.name} raised {type(error).__name__}"] += 1
+            running[channel.id] -= 1
+
+    async def stress(channel, rng):
+        for _ in range(bursts):
+            # A reset game's session is dropped, and the next !join opens a new one
+            session = secrethitler.sessions.get(channel.id) or secrethitler.GameSession(channel)
+            burst = get_burst(session, tables[channel.id], size, rng)
+            await asyncio.gather(*(send(command, channel, *args) for command, *args in burst))
+            if channel.id in secrethitler.sessions:
+                problems.update(check_game(secrethitler.sessions[channel.id]))
+    began = time.perf_counter()
+    await asyncio.gather(*(stress(channel, random.Random(seed + channel.id)) for channel in channels))
+    elapsed = time.perf_counter() - began
+    secrethitler.before_command, secrethitler.after_command = before_command, after_command
+    secrethitler.GameInbox = game_inbox
+    return elapsed, most_running, problems
+
+
+async def bench_stress(bursts=40, size=200, latency=0.002, game_counts=(1, 10)):
+    """Fires bursts of hundreds of concurrent commands at games, with and without the game's inbox, and checks every game.
+
+    Every game is checked for a consistent state before each command and after each burst, and is replayed from its event log
+    at the end. Each API call takes `latency` seconds, so commands that run concurrently interleave at every send.
+    """
+    global api_latency
+    print(f"{bursts} bursts of {size} concurrent commands per game, each API call takes {latency * 1000:.0f} ms.")
+    print(f"{'inbox':>8} {'games':>6} {'commands':>9} {'seconds':>8} {'at once':>8} {'finished':>9} {'replayed':>9}  problems")
+    with tempfile.TemporaryDirectory() as tmp:
+        for inbox_class, games in [(ImmediateInbox, game_counts[0])] + [(secrethitler.GameInbox, games) for games in game_counts]:
+            secrethitler.sessions.clear()
+            secrethitler.player_sessions.clear()
+            secrethitler.game_store = persistence.open_store(os.path.join(tmp, f"{inbox_class.__name__}{games}.db"))
+            channels = [FakeChannel(i + 1) for i in range(games)]
+            api_latency = latency
+            elapsed, most_running, problems = await stress_games(channels, inbox_class, bursts, size, seed=0)
+            api_latency = 0
+            await asyncio.sleep(0.1)  # Vote progress still waiting to be sent
+            finished = secrethitler.game_store.execute("SELECT COUNT(*) FROM events WHERE type = 'game_over'").fetchone()[0]
+            sessions = [secrethitler.sessions[channel.id] for channel in channels if channel.id in secrethitler.sessions]
+            replayed = sum(replay.get_state_summary(replay.replay(persistence.load_events(secrethitler.game_store, session.game_id)[1]))
+                           == replay.get_state_summary(session) for session in sessions)
+            found = ", ".join(f"{problem} x{count}" for problem, count in problems.most_common()) or "none"
+            name = 'none' if inbox_class is ImmediateInbox else 'queue'
+            print(f"{name:>8} {games:>6} {bursts * size * games:>9} {elapsed:>8.2f} {most_running:>8} {finished:>9} {replayed:>6}/{len(sessions):<2}  {found}")
+            secrethitler.game_store.close()
+            secrethitler.game_store = None
+    print("'at once' is the most commands of one game running at the same time.")
+
+
+BENCHMARKS = {
+    'sessions': bench_sessions,
+    'attachments': bench_attachments,
+    'dashboard': bench_dashboard,
+    'votes': bench_votes,
+    'roles': bench_roles,
+    'handoff': bench_handoff,
+    'persistence': bench_persistence,
+    'replay': bench_replay,
+    'engine': bench_engine,
+    'commands': bench_commands,
+    'simulate': bench_simulate,
+    'deck': bench_deck,
+    'startup': bench_startup,
+    'metrics': bench_metrics,
+    'tracing': bench_tracing,
+    'logging': bench_logging,
+    'timers': bench_timers,
+    'cluster': bench_cluster,
+    'stats': bench_stats,
+    'stress': bench_stress,
+}
+
+if __name__ == '__main__':
+    random.seed(0)
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"\n== {name} ==")
+        result = BENCHMARKS[name]()
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
@@ -0,0 +1,96 @@
+"""Builds recompressed and downscaled variants of the fixed images under ./images.
+
+Usage:
+    python build_assets.py [tier ...]
+
+Each tier is written to ./assets/<tier>/ with a manifest.json that maps the original image path to its variant.
+Set IMAGE_TIER=<tier> in .env to have the bot send that tier's images instead of the originals.
+Boards and card hands are drawn by renderer.py, which encodes them with the same tier settings.
+"""
+import glob
+import json
+import os
+import sys
+
+from PIL import Image
+
+import renderer
+from renderer import IMAGE_TIERS, FORMAT_EXTENSIONS
+
+IMAGES_DIR = './images'
+ASSETS_DIR = './assets'
+MANIFEST_FILENAME = 'manifest.json'
+# A typical dashboard, used to compare the boards uploaded per render
+SAMPLE_DASHBOARD = [('liberal_board', 2, 1), ('fascist_board', 'sevenplayers', 3)]
+
+# Uplink speed used to estimate upload times in the report
+UPLOAD_MBITS_PER_SECOND = 10
+
+
+def build_variant(img_path, variant_path, img_format, quality, max_side):
+    with Image.open(img_path) as img:
+        img = img.convert('RGB')
+        if max_side is not None and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+        if img_format == 'JPEG':
+            img.save(variant_path, img_format, quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(variant_path, img_format, quality=quality, method=6)
+
+
+def build_tier(tier):
+    """Writes every image of a tier and its manifest, returning the manifest."""
+    img_format, quality, max_side = IMAGE_TIERS[tier]
+    tier_dir = os.path.join(ASSETS_DIR, tier)
+    manifest = {}
+    for img_path in sorted(glob.glob(os.path.join(IMAGES_DIR, '**', '*.jpg'), recursive=True)):
+        relative_path = os.path.relpath(img_path, IMAGES_DIR)
+        if relative_path.startswith('sprites'):
+            # Sprites are only read by the renderer, which encodes its output per tier
+            continue
+        variant_path = os.path.join(tier_dir, os.path.splitext(relative_path)[0] + FORMAT_EXTENSIONS[img_format])
+        build_variant(img_path, variant_path, img_format, quality, max_side)
+        # Keys use the same './images/...' form as the paths in secrethitler.py
+        manifest[f"{IMAGES_DIR}/{relative_path.replace(os.sep, '/')}"] = variant_path.replace(os.sep, '/')
+    with open(os.path.join(tier_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def get_dashboard_bytes(tier):
+    """Bytes of the two boards uploaded by one dashboard render."""
+    return sum(len(renderer.render(key, tier)[1]) for key in SAMPLE_DASHBOARD)
+
+
+def get_upload_ms(num_bytes):
+    return num_bytes * 8 / (UPLOAD_MBITS_PER_SECOND * 1000 * 1000) * 1000
+
+
+def print_report(manifests):
+    original_paths = list(next(iter(manifests.values())).keys())
+    original_total = sum(os.path.getsize(path) for path in original_paths)
+    original_dashboard = get_dashboard_bytes('original')
+    print(f"Upload times are estimated at {UPLOAD_MBITS_PER_SECOND} Mbit/s.")
+    print(f"{'tier':>10} {'total MB':>10} {'saved':>8} {'dashboard KB':>14} {'upload ms':>10} {'faster':>8}")
+    print(f"{'original':>10} {original_total / 1024 / 1024:>10.1f} {'':>8} {original_dashboard / 1024:>14.0f} {get_upload_ms(original_dashboard):>10.0f} {'':>8}")
+    for tier, manifest in manifests.items():
+        variant_paths = list(manifest.values())
+        total = sum(os.path.getsize(path) for path in variant_paths)
+        dashboard = get_dashboard_bytes(tier)
+        print(
+            f"{tier:>10} {total / 1024 / 1024:>10.1f} {1 - total / original_total:>8.0%}"
+            f" {dashboard / 1024:>14.0f} {get_upload_ms(dashboard):>10.0f} {original_dashboard / dashboard:>7.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    tiers = sys.argv[1:] or list(IMAGE_TIERS)
+    for tier in tiers:
+        if tier not in IMAGE_TIERS:
+            sys.exit(f"Unknown tier '{tier}', choose from: {', '.join(IMAGE_TIERS)}")
+    manifests = {}
+    for tier in tiers:
+        print(f"Building {tier} images...")
+        manifests[tier] = build_tier(tier)
+    print_report(manifests)
@@ -0,0 +1,127 @@
+"""Runs the bot as several worker processes, each connecting its own contiguous range of gateway shards.
+
+Discord sends the events of a guild to shard (guild_id >> 22) % shard_count, so each worker only ever sees
+the games of its own guilds. Workers share nothing but the SQLite game store, and a game saved by one
+worker is resumed by whichever worker runs its guild's shard next.
+
+Each worker gets its own log file, trace file and metrics port (METRICS_PORT + worker number). The attachment
+cache is shared, and each save replaces the file whole, so workers saving it at once can't corrupt it.
+
+Discord sends every DM to shard 0 only, and DMs aren't forwarded between workers. So DM commands only reach a
+game run by the worker owning shard 0. The other workers' card DMs ask players to send !discard and !enact in
+the game channel, and a DM to shard 0's worker for a game it doesn't run is answered with the same advice.
+SIGHUP drains and restarts the workers one at a time, for deploys. A draining worker stops taking new games
+and exits once its games are over or after DRAIN_TIMEOUT. Sending SIGTERM to one worker drains and replaces
+only that one. SIGTERM or Ctrl+C to this process drains every worker and exits. A worker that exits is restarted.
+
+Usage:
+    python cluster.py --workers 4 --shards 16
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+RESTART_DELAY = 5.0  # Seconds before restarting a worker that exited
+
+
+def get_shard(guild_id, shard_count):
+    """The shard Discord sends a guild's events to."""
+    return (guild_id >> 22) % shard_count
+
+
+def get_shard_ranges(shard_count, workers):
+    """Splits shards 0 to shard_count - 1 into `workers` contiguous ranges, as evenly as possible."""
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker in range(workers):
+        end = start + size + (worker < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Worker:
+    def __init__(self, number, shard_ids, shard_count):
+        self.number = number
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update(
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=','.join(map(str, self.shard_ids)),
+            LOG_FILE=f"secret_hitler.worker{self.number}.log",
+            TRACE_FILE=f"traces.worker{self.number}.jsonl",
+        )
+        if os.getenv('METRICS_PORT', '').strip():
+            env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + self.number)
+        # In its own session, so Ctrl+C reaches only this process, which drains the workers instead
+        self.process = subprocess.Popen([sys.executable, 'secrethitler.py'], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        start_new_session=True)
+        print(f"Worker {self.number} started with shards {self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count} (pid {self.process.pid})")
+
+    def drain(self):
+        """Asks the worker to finish its games and exit."""
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+
+    def wait(self):
+        return self.process.wait()
+
+
+def run(workers, shard_count):
+    cluster = [Worker(number, shard_ids, shard_count) for number, shard_ids in enumerate(get_shard_ranges(shard_count, workers))]
+    requests = []  # Signals received, handled by the loop below rather than in the handler
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: requests.append('restart'))
+    signal.signal(signal.SIGTERM, lambda signum, frame: requests.append('stop'))
+    signal.signal(signal.SIGINT, lambda signum, frame: requests.append('stop'))
+    for worker in cluster:
+        worker.start()
+    while True:
+        if 'stop' in requests:
+            print("Draining every worker...")
+            for worker in cluster:
+                worker.drain()
+            for worker in cluster:
+                worker.wait()
+            return
+        if 'restart' in requests:
+            requests.remove('restart')
+            # One at a time, so only one range of shards is ever waiting on a restart. The new worker can't connect
+            # until the old one has left, or both would receive the same events.
+            for worker in cluster:
+                print(f"Draining worker {worker.number}...")
+                worker.drain()
+                worker.wait()
+                worker.start()
+                if 'stop' in requests:
+                    break
+            continue
+        for worker in cluster:
+            code = worker.process.poll()
+            if code is not None:
+                print(f"Worker {worker.number} exited with code {code}, restarting in {RESTART_DELAY:.0f}s")
+                time.sleep(RESTART_DELAY)
+                worker.start()
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Runs the Secret Hitler bot as several worker processes, each with a range of shards.")
+    parser.add_argument('--workers', type=int, default=2, help="worker processes to run")
+    parser.add_argument('--shards', type=int, help="total gateway shards, at least one per worker, default one per worker")
+    args = parser.parse_args()
+    shard_count = args.shards or args.workers
+    if shard_count < args.workers:
+        parser.error("--shards must be at least --workers")
+    run(args.workers, shard_count)
@@ -0,0 +1,591 @@
+"""The rules of Secret Hitler as a synchronous state machine, with no Discord in sight.
+
+apply(state, action, rng) checks an action against the rules, updates the GameState and returns it with
+the events the action caused, which the bot turns into messages. Players can be any hashable objects,
+the bot uses Discord members and the simulator uses ints.
+
+Actions are tuples of the action type, the player taking it, and its arguments:
+    ('join', player)                ('leave', player)               ('ready', player)
+    ('start', player)               ('nominate', player, chancellor)
+    ('ja', player)                  ('nein', player)                ('veto', player)
+    ('discard', player, card_num)   ('enact', player, card_num)
+    ('investigate', player, suspect)  ('appoint', player, appointed)  ('kill', player, victim)
+    ('reset', player)
+
+Every shuffle takes a fresh 32 bit seed from rng, and reports it in the 'started' or 'reshuffled' event,
+so a game can be replayed exactly by handing the same seeds back.
+
+A GameState plays by the official rules unless it is given HouseRules, which switch the presidential powers,
+the veto, the election tracker and the Hitler Chancellor win to common variants, e.g. for the simulator.
+"""
+import random
+
+# Game States
+GAME_NOT_STARTED = 0
+GAME_STARTING = 1
+NOMINATE_CHANCELLOR = 2
+ELECTION = 3
+PRESIDENTIAL_LEGISLATION = 4
+CHANCELLOR_LEGISLATION = 5
+EXECUTIVE_INVESTIGATION = 6
+EXECUTIVE_EXAMINATION = 7
+EXECUTIVE_APPOINTMENT = 8
+EXECUTIVE_KILL = 9
+AGENDA_VETOED = 10
+GAME_OVER = 11
+
+# Role definitions
+LIBERAL = "Liberal"
+FASCIST = "Fascist"
+HITLER = "Hitler"
+
+# Game Types
+FIVE_SIX_PLAYER_GAME_MODE = 'fiveplayers'
+SEVEN_EIGHT_PLAYER_GAME_MODE = 'sevenplayers'
+NINE_TEN_PLAYER_GAME_MODE = 'nineplayers'
+
+MIN_PLAYERS = 5
+MAX_PLAYERS = 10
+NUM_FASCISTS = {5: 1, 6: 1, 7: 2, 8: 2, 9: 3, 10: 3}
+LIBERAL_POLICY_COUNT = 6
+FASCIST_POLICY_COUNT = 11
+
+# What the President gets for each Fascist policy, by game mode and Fascist policies enacted, as printed on the boards
+OFFICIAL_POWERS = {
+    FIVE_SIX_PLAYER_GAME_MODE: {3: EXECUTIVE_EXAMINATION, 4: EXECUTIVE_KILL, 5: EXECUTIVE_KILL},
+    SEVEN_EIGHT_PLAYER_GAME_MODE: {2: EXECUTIVE_INVESTIGATION, 3: EXECUTIVE_APPOINTMENT, 4: EXECUTIVE_KILL, 5: EXECUTIVE_KILL},
+    NINE_TEN_PLAYER_GAME_MODE: {1: EXECUTIVE_INVESTIGATION, 2: EXECUTIVE_INVESTIGATION, 3: EXECUTIVE_APPOINTMENT, 4: EXECUTIVE_KILL, 5: EXECUTIVE_KILL},
+}
+POWER_TABLES = {
+    'official': OFFICIAL_POWERS,
+    # The 9-10 player board at every player count, e.g. to see whether more powers help the Fascists
+    'large': {game_mode: OFFICIAL_POWERS[NINE_TEN_PLAYER_GAME_MODE] for game_mode in OFFICIAL_POWERS},
+    # Fascist policies give no powers at all
+    'none': {game_mode: {} for game_mode in OFFICIAL_POWERS},
+}
+
+
+class InvalidAction(Exception):
+    """An action the rules don't allow right now. The message is shown to the player.
+
+    It may contain {president} and {chancellor}, for the bot to fill in with their names.
+    """
+
+
+class HouseRules:
+    """Switches for variants of the rules, all set to the official rules by default.
+
+    powers: the table of POWER_TABLES the presidential powers come from.
+    veto_policies: Fascist policies enacted before a Chancellor can call a veto, or None for no veto.
+    failed_elections: failed elections in a row that enact the top policy of the draw pile.
+    hitler_chancellor_policies: Fascist policies enacted before electing Hitler Chancellor wins the game.
+    """
+
+    __slots__ = ('powers', 'veto_policies', 'failed_elections', 'hitler_chancellor_policies')
+
+    def __init__(self, powers='official', veto_policies=5, failed_elections=3, hitler_chancellor_policies=3):
+        if powers not in POWER_TABLES:
+            raise ValueError(f"Unknown power table {powers!r}, choose from {', '.join(POWER_TABLES)}.")
+        if failed_elections < 1:
+            raise ValueError("At least 1 failed election must enact the top policy.")
+        self.powers = powers
+        self.veto_policies = veto_policies
+        self.failed_elections = failed_elections
+        self.hitler_chancellor_policies = hitler_chancellor_policies
+
+    def __repr__(self):
+        return (f"HouseRules(powers={self.powers!r}, veto_policies={self.veto_policies}, "
+                f"failed_elections={self.failed_elections}, hitler_chancellor_policies={self.hitler_chancellor_policies})")
+
+
+OFFICIAL_RULES = HouseRules()
+
+
+class PolicyDeck:
+    """The draw pile and the discard pile, with the Liberal cards in each counted as cards move.
+
+    The draw pile is a list read from a cursor, `head`, so drawing slices the cards off and moves the cursor
+    instead of copying the rest of the pile. The discard pile is a list that discarded cards are added to.
+    The make-up of both piles is therefore always known without counting them.
+    """
+
+    __slots__ = ('cards', 'head', 'drawable', 'discard_pile', 'liberal_drawable', 'liberal_discarded')
+
+    def __init__(self, draw_pile=(), discard_pile=()):
+        self.load(draw_pile, discard_pile)
+
+    def load(self, draw_pile, discard_pile=()):
+        """Replaces both piles with lists of cards, each given top card first."""
+        self.cards = list(draw_pile)
+        self.head = 0
+        self.drawable = len(self.cards)
+        self.liberal_drawable = self.cards.count(LIBERAL)
+        self.discard_pile = list(discard_pile)
+        self.liberal_discarded = self.discard_pile.count(LIBERAL)
+
+    @property
+    def discarded(self):
+        return len(self.discard_pile)
+
+    @property
+    def fascist_drawable(self):
+        return self.drawable - self.liberal_drawable
+
+    @property
+    def fascist_discarded(self):
+        return self.discarded - self.liberal_discarded
+
+    def peek(self, n):
+        """The top `n` cards of the draw pile, or all of them if there are fewer, left where they are."""
+        return self.cards[self.head:self.head + n]
+
+    def draw(self, n):
+        """Takes the top `n` cards of the draw pile, or all of them if there are fewer."""
+        head = self.head
+        drawn = self.cards[head:head + n]
+        n = len(drawn)
+        self.head = head + n
+        self.drawable -= n
+        self.liberal_drawable -= drawn.count(LIBERAL)
+        return drawn
+
+    def discard(self, discarded):
+        """Puts a list of cards on the discard pile."""
+        self.discard_pile += discarded
+        self.liberal_discarded += discarded.count(LIBERAL)
+
+    def reshuffle(self, shuffler):
+        """Shuffles the discard pile into the draw pile with `shuffler`, a random.Random.
+
+        The draw pile and then the discard pile are shuffled as one list, so a seed shuffles them the same way
+        it always has.
+        """
+        cards = self.cards[self.head:] + self.discard_pile
+        shuffler.shuffle(cards)
+        self.cards = cards
+        self.head = 0
+        self.drawable = len(cards)
+        self.liberal_drawable += self.liberal_discarded
+        self.discard_pile = []
+        self.liberal_discarded = 0
+
+    def get_draw_pile(self):
+        return self.cards[self.head:]
+
+    def get_discard_pile(self):
+        return list(self.discard_pile)
+
+
+class GameState:
+    """Everything the rules need to know about one game, played by `rules`, the official rules unless given HouseRules."""
+
+    def __init__(self, rules=OFFICIAL_RULES):
+        self.rules = rules
+        self.reset()
+
+    def reset(self):
+        """Clears the game variables so a new round can be played."""
+        self.game_state = GAME_NOT_STARTED
+        self.players = []
+        self.assassinated = []
+        self.role_assignments = {}
+        self.votes = {}
+        self.liberal_policies = 0
+        self.fascist_policies = 0
+        self.deck = PolicyDeck()
+        self.top_cards = []
+        self.failed_election_count = 0
+        self.previous_president = None
+        self.current_president = None
+        self.current_chancellor = None
+        self.game_mode = None
+        self.winner = None
+        # Seating order as a ring, player -> player to their left and to their right
+        self.next_seat = {}
+        self.previous_seat = {}
+
+
+def apply(state, action, rng=random):
+    """Applies an action to the game and returns the state with a list of the events it caused.
+
+    The state is updated in place. Raises InvalidAction, leaving the state untouched, if the rules don't allow the action.
+    """
+    action_type, player, *args = action
+    events = []
+    ACTIONS[action_type](state, events, rng, player, *args)
+    return state, events
+
+
+def join(state, events, rng, player):
+    if state.game_state != GAME_NOT_STARTED:
+        raise InvalidAction("The game has already started. Please wait for the next round!")
+    if player in state.players:
+        raise InvalidAction("You are already in the game!")
+    if len(state.players) >= MAX_PLAYERS:
+        raise InvalidAction("The game is full. Only 5 to 10 players can join!")
+    state.players.append(player)
+    events.append(('joined', player))
+
+
+def leave(state, events, rng, player):
+    if state.game_state != GAME_NOT_STARTED:
+        raise InvalidAction("Match is in progress.")
+    state.players.remove(player)
+    events.append(('left', player))
+
+
+def check_player_count(state):
+    if len(state.players) < MIN_PLAYERS:
+        raise InvalidAction(f"You need at least 5 players to start the game! ({len(state.players)}/10 players)")
+    if len(state.players) > MAX_PLAYERS:
+        raise InvalidAction(f"The game can only have a maximum of 8 players! ({len(state.players)}/10 players)")
+
+
+def ready(state, events, rng, player):
+    check_player_count(state)
+    if state.game_state != GAME_NOT_STARTED:
+        raise InvalidAction("The game has already started!")
+    if len(state.players) in [5, 6]:
+        state.game_mode = FIVE_SIX_PLAYER_GAME_MODE
+    if len(state.players) in [7, 8]:
+        state.game_mode = SEVEN_EIGHT_PLAYER_GAME_MODE
+    if len(state.players) in [9, 10]:
+        state.game_mode = NINE_TEN_PLAYER_GAME_MODE
+    state.game_state = GAME_STARTING
+    events.append(('ready', state.game_mode))
+
+
+def start(state, events, rng, player):
+    check_player_count(state)
+    if state.game_state == GAME_NOT_STARTED:
+        raise InvalidAction("You must type !ready first.")
+    if state.game_state != GAME_STARTING:
+        raise InvalidAction("The game has already started!")
+    num_fascists = NUM_FASCISTS[len(state.players)]
+    num_liberals = len(state.players) - num_fascists - 1
+    seed = rng.getrandbits(32)
+    shuffler = random.Random(seed)
+
+    # Assign roles randomly
+    roles = [HITLER] + [FASCIST] * num_fascists + [LIBERAL] * num_liberals
+    shuffler.shuffle(roles)
+    state.role_assignments = {player: role for player, role in zip(state.players, roles)}
+
+    # Create the stack of policy cards
+    policy_cards = [LIBERAL] * LIBERAL_POLICY_COUNT + [FASCIST] * FASCIST_POLICY_COUNT
+    shuffler.shuffle(policy_cards)
+    state.deck.load(policy_cards)
+
+    seat_players(state)
+
+    # Randomly select a candidate
+    state.current_president = shuffler.choice(state.players)
+    state.game_state = NOMINATE_CHANCELLOR
+    events.append(('started', seed, num_liberals, num_fascists, state.current_president))
+
+
+def nominate(state, events, rng, player, chancellor):
+    if state.game_state != NOMINATE_CHANCELLOR:
+        raise InvalidAction("Nomination is not allowed at this moment.")
+    if player != state.current_president:
+        raise InvalidAction("Only the President can nominate the Chancellor.")
+    if chancellor not in state.players:
+        raise InvalidAction("Could not find that player, try again.")
+    if chancellor == state.current_president:
+        raise InvalidAction("You can't nominate yourself as Chancellor, pick someone else.")
+    if chancellor == state.previous_president:
+        raise InvalidAction("You can't nominate the most recent President as Chancellor, nominate a different Chancellor.")
+    state.current_chancellor = chancellor
+    state.game_state = ELECTION
+    events.append(('nominated', state.current_president, chancellor))
+
+
+def check_can_vote(state, player):
+    if state.game_state != ELECTION and state.game_state != AGENDA_VETOED:
+        raise InvalidAction("Voting is not allowed at this moment.")
+    if state.game_state == ELECTION:
+        if player == state.current_chancellor or player == state.current_president:
+            raise InvalidAction("Chancellor and President do not vote!")
+        if player in state.votes:
+            raise InvalidAction("You have already voted!")
+    elif player != state.current_president:
+        raise InvalidAction("Only the President can confirm or reject a veto.")
+
+
+def ja(state, events, rng, player):
+    check_can_vote(state, player)
+    if state.game_state == ELECTION:
+        cast_vote(state, events, rng, player, 'ja')
+        return
+    # The President accepts the veto, the policies are all discarded
+    state.deck.discard(state.top_cards)
+    state.top_cards = []
+    state.previous_president = state.current_president
+    state.current_president = get_next_president(state)
+    events.append(('veto_accepted', state.previous_president))
+    start_new_round(state, events, rng)
+    events.append(('new_president', state.current_president))
+    state.game_state = NOMINATE_CHANCELLOR
+
+
+def nein(state, events, rng, player):
+    check_can_vote(state, player)
+    if state.game_state == ELECTION:
+        cast_vote(state, events, rng, player, 'nein')
+        return
+    state.game_state = CHANCELLOR_LEGISLATION
+    events.append(('veto_rejected', state.current_president, state.current_chancellor))
+
+
+def cast_vote(state, events, rng, player, vote):
+    state.votes[player] = vote
+    # Check if all players have voted
+    votes_needed = len(state.players) - 2  # minus chancellor and president
+    voted_players = len(state.votes)
+    if voted_players != votes_needed:
+        events.append(('voted', player, voted_players, votes_needed))
+        return
+    ja_votes = sum(1 for vote in state.votes.values() if vote.lower() == 'ja')
+    nein_votes = votes_needed - ja_votes
+    # Reset the votes for the next round
+    state.votes = {}
+    if ja_votes > nein_votes:
+        election_success(state, events, ja_votes, nein_votes)
+    else:
+        election_failed(state, events, rng, ja_votes, nein_votes)
+
+
+def election_success(state, events, ja_votes, nein_votes):
+    if state.role_assignments[state.current_chancellor] == HITLER and state.fascist_policies >= state.rules.hitler_chancellor_policies:
+        events.append(('election_passed', ja_votes, nein_votes, state.current_president, state.current_chancellor))
+        game_over(state, events, FASCIST, 'hitler_elected')
+        return
+    state.top_cards = state.deck.draw(3)
+    state.game_state = PRESIDENTIAL_LEGISLATION
+    events.append(('election_passed', ja_votes, nein_votes, state.current_president, state.current_chancellor))
+
+
+def election_failed(state, events, rng, ja_votes, nein_votes):
+    state.failed_election_count += 1
+    top_policy = None
+    if state.failed_election_count == state.rules.failed_elections:
+        top_policy = enact_top_policy(state)
+        state.failed_election_count = 0
+    state.current_president = get_next_president(state)
+    state.game_state = NOMINATE_CHANCELLOR
+    events.append(('election_failed', ja_votes, nein_votes, top_policy, state.current_president))
+    if top_policy is not None and not check_policy_win(state, events):
+        # Otherwise the next government could draw fewer than 3 cards, or none at all
+        start_new_round(state, events, rng)
+
+
+def veto(state, events, rng, player):
+    if state.rules.veto_policies is None:
+        raise InvalidAction("Veto power is not used in this game.")
+    if not is_veto_unlocked(state):
+        raise InvalidAction(f"Veto power is not yet unlocked. You must enact {state.rules.veto_policies} Fascist policies.")
+    if player != state.current_chancellor:
+        raise InvalidAction("Only the Chancellor **{chancellor}** can call a veto.")
+    if state.game_state == AGENDA_VETOED:
+        raise InvalidAction("Waiting for veto confirmation from the president **{president}**.")
+    if state.game_state != CHANCELLOR_LEGISLATION:
+        raise InvalidAction("Veto is not allowed at this moment.")
+    state.game_state = AGENDA_VETOED
+    events.append(('veto_called', state.current_chancellor, state.current_president))
+
+
+def is_veto_unlocked(state):
+    return state.rules.veto_policies is not None and state.fascist_policies >= state.rules.veto_policies
+
+
+def discard(state, events, rng, player, card_num):
+    if state.game_state != PRESIDENTIAL_LEGISLATION:
+        raise InvalidAction("You cannot discard any policies at this time.")
+    if player != state.current_president:
+        raise InvalidAction("Only the president can discard a policy.")
+    if card_num not in (1, 2, 3) or card_num > len(state.top_cards):
+        raise InvalidAction("Invalid card number.")
+    state.deck.discard([state.top_cards.pop(card_num - 1)])
+    state.game_state = CHANCELLOR_LEGISLATION
+    events.append(('discarded', state.current_president, state.current_chancellor))
+
+
+def enact(state, events, rng, player, card_num):
+    if state.game_state != CHANCELLOR_LEGISLATION:
+        raise InvalidAction("You cannot enact any policies at this time.")
+    if player != state.current_chancellor:
+        raise InvalidAction("Only the Chancellor can enact a policy.")
+    if card_num not in (1, 2) or card_num > len(state.top_cards):
+        raise InvalidAction("Invalid card number.")
+    policy = get_enacted_policy_and_discard(state, card_num)
+    events.append(('enacted', state.current_chancellor, policy))
+    if check_policy_win(state, events):
+        return
+
+    new_game_state = NOMINATE_CHANCELLOR
+    if policy == FASCIST:
+        new_game_state = get_presidential_power(state)
+        if new_game_state != NOMINATE_CHANCELLOR:
+            events.append(('power', new_game_state, state.current_president))
+    start_new_round(state, events, rng)
+    if new_game_state == EXECUTIVE_EXAMINATION:
+        events.append(('examined', state.current_president, state.deck.peek(3)))
+        new_game_state = NOMINATE_CHANCELLOR
+    if new_game_state == NOMINATE_CHANCELLOR:
+        state.previous_president = state.current_president
+        state.current_president = get_next_president(state)
+        events.append(('new_president', state.current_president))
+    state.game_state = new_game_state
+
+
+def get_enacted_policy_and_discard(state, card_num):
+    policy = state.top_cards.pop(card_num - 1)
+    state.deck.discard(state.top_cards)
+    state.top_cards = []
+    if policy == FASCIST:
+        state.fascist_policies += 1
+    if policy == LIBERAL:
+        state.liberal_policies += 1
+    return policy
+
+
+def get_presidential_power(state):
+    """The executive action the President gets for the Fascist policy just enacted."""
+    return POWER_TABLES[state.rules.powers][state.game_mode].get(state.fascist_policies, NOMINATE_CHANCELLOR)
+
+
+def investigate(state, events, rng, player, suspect):
+    if state.game_state != EXECUTIVE_INVESTIGATION:
+        raise InvalidAction("Investigation is not allowed at this moment.")
+    if player != state.current_president:
+        raise InvalidAction("Only the President can nominate the Chancellor.")
+    if suspect not in state.players:
+        raise InvalidAction("Could not find that player, try again.")
+    events.append(('investigated', player, suspect, state.role_assignments[suspect]))
+    state.previous_president = state.current_president
+    state.current_president = get_next_president(state)
+    start_new_round(state, events, rng)
+    events.append(('new_president', state.current_president))
+    state.game_state = NOMINATE_CHANCELLOR
+
+
+def appoint(state, events, rng, player, appointed):
+    if state.game_state != EXECUTIVE_APPOINTMENT:
+        raise InvalidAction("Appointment is not allowed at this moment.")
+    if player != state.current_president:
+        raise InvalidAction("Only the President can appoint the next president.")
+    if appointed not in state.players:
+        raise InvalidAction("Could not find that player, try again.")
+    if appointed == state.current_president:
+        raise InvalidAction("You can't appoint yourself, choose somebody else.")
+    state.previous_president = state.current_president
+    state.current_president = appointed
+    events.append(('appointed', state.previous_president, appointed))
+    start_new_round(state, events, rng)
+    events.append(('new_president', appointed))
+    state.game_state = NOMINATE_CHANCELLOR
+
+
+def kill(state, events, rng, player, victim):
+    if state.game_state != EXECUTIVE_KILL:
+        raise InvalidAction("Killing is not allowed at this moment.")
+    if player != state.current_president:
+        raise InvalidAction("Only the President can kill.")
+    if victim not in state.players:
+        raise InvalidAction("Could not find that player, try again.")
+    state.players.remove(victim)
+    unseat_player(state, victim)
+    state.assassinated.append(victim)
+    events.append(('killed', player, victim))
+    if state.role_assignments[victim] == HITLER:
+        game_over(state, events, LIBERAL, 'hitler_assassinated')
+        return
+    start_new_round(state, events, rng)
+    state.previous_president = state.current_president
+    state.current_president = get_next_president(state)
+    events.append(('new_president', state.current_president))
+    state.game_state = NOMINATE_CHANCELLOR
+
+
+def reset(state, events, rng, player):
+    state.reset()
+    events.append(('reset', player))
+
+
+def game_over(state, events, winner, reason):
+    state.winner = winner
+    state.game_state = GAME_OVER
+    events.append(('game_over', winner, reason))
+
+
+def enact_top_policy(state):
+    top_policy, = state.deck.draw(1)
+    if top_policy == FASCIST:
+        state.fascist_policies += 1
+    else:
+        state.liberal_policies += 1
+    return top_policy
+
+
+def check_policy_win(state, events):
+    """Ends the game if either party has enacted enough policies, returning whether it did."""
+    if state.fascist_policies == 6:
+        game_over(state, events, FASCIST, 'fascist_policies')
+    elif state.liberal_policies == 5:
+        game_over(state, events, LIBERAL, 'liberal_policies')
+    return state.game_state == GAME_OVER
+
+
+def start_new_round(state, events, rng):
+    """Shuffles the discard pile back into the draw pile when fewer than 3 cards are left."""
+    if state.deck.drawable < 3 and state.deck.discarded > 0:
+        seed = rng.getrandbits(32)
+        state.deck.reshuffle(random.Random(seed))
+        events.append(('reshuffled', seed))
+
+
+def seat_players(state):
+    """Seats the players around the table in the order of state.players."""
+    players = state.players
+    state.next_seat = {player: players[(i + 1) % len(players)] for i, player in enumerate(players)}
+    state.previous_seat = {player: players[i - 1] for i, player in enumerate(players)}
+
+
+def unseat_player(state, player):
+    """Closes the ring around a player who has left the table.
+
+    The player keeps their own links, so the player after them can still be found, e.g. when a President kills themselves.
+    """
+    before, after = state.previous_seat[player], state.next_seat[player]
+    state.next_seat[before] = after
+    state.previous_seat[after] = before
+
+
+def get_next_player(state, current_player):
+    return state.next_seat[current_player]
+
+
+def get_next_president(state):
+    state.current_chancellor = None
+    next_president = get_next_player(state, state.current_president)
+    if next_president == state.previous_president:
+        next_president = get_next_player(state, next_president)
+    return next_president
+
+
+ACTIONS = {
+    'join': join,
+    'leave': leave,
+    'ready': ready,
+    'start': start,
+    'nominate': nominate,
+    'ja': ja,
+    'nein': nein,
+    'veto': veto,
+    'discard': discard,
+    'enact': enact,
+    'investigate': investigate,
+    'appoint': appoint,
+    'kill': kill,
+    'reset': reset,
+}
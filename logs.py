@@ -0,0 +1,99 @@
+"""Logging that never touches the disk on the event loop: records go through a queue to a thread that writes them as JSON lines.
+
+A logger call on the event loop only copies the record, with the fields of the current log context such as the game
+and channel, onto a queue. A background thread formats each record as one JSON object per line and writes it to a
+rotating file. Rotated files are gzipped on that thread too, so neither a slow disk nor a rotation delays a command.
+"""
+import atexit
+import contextlib
+import contextvars
+import copy
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+current_fields = contextvars.ContextVar('log_fields', default={})
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Adds `fields` to every record logged inside the block, including by tasks it starts."""
+    token = current_fields.set({**current_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        current_fields.reset(token)
+
+
+class ContextQueueHandler(QueueHandler):
+    """Queues records with their message and traceback already formatted and the log context attached.
+
+    Formatting here, on the thread that logged the record, means the arguments can't change before it is written.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.fields = {**current_fields.get(), **getattr(record, 'fields', {})}
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def compress(source, destination):
+    """Rotates `source` into a gzipped `destination`."""
+    with open(source, 'rb') as source_file, gzip.open(destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file)
+    os.remove(source)
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """A RotatingFileHandler whose backups are gzipped, e.g. bot.log.1.gz."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = compress
+
+
+class Listener(QueueListener):
+    def stop(self):
+        """Writes everything still queued and stops the thread, if it is still running."""
+        if self._thread is not None:
+            super().stop()
+
+
+def setup(logger, handler):
+    """Sends the records of `logger` through a queue to `handler` on a background thread, returning the thread's listener.
+
+    The listener is stopped at exit, which writes whatever is still queued.
+    """
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = Listener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(ContextQueueHandler(records))
+    return listener
@@ -0,0 +1,147 @@
+"""Counters, gauges and histograms kept in memory and served in the Prometheus text format over local HTTP.
+
+Every metric registers itself on creation and is rendered by render(). serve() starts the HTTP endpoint
+on the bot's event loop, so a scrape never blocks a command for longer than it takes to format the text.
+"""
+import asyncio
+import bisect
+import functools
+import time
+
+from aiohttp import web
+
+# Seconds, from a quick command to a slow upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []  # Every metric, in the order they were created
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value not in (float('inf'), float('-inf')) else ('+Inf' if value > 0 else '-Inf')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # Label values -> value
+        registry.append(self)
+
+    def get_key(self, labels):
+        return tuple(labels[label] for label in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+    def collect(self):
+        return self.values
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down. With a `collect` function, its values are read from it at every scrape instead."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collector = collect
+
+    def set(self, value, **labels):
+        self.values[self.get_key(labels)] = value
+
+    def collect(self):
+        return self.collector() if self.collector is not None else self.values
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # A count per bucket, then the sum and the count of every observation
+            counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            counts[index] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {counts[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(counts[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+def timed(histogram, **labels):
+    """Decorates a coroutine function to observe how long each call takes in `histogram`."""
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            began = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - began, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+async def handle_metrics(request):
+    return web.Response(body=render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def serve(host, port):
+    """Serves /metrics on the running event loop, returning the runner to clean up on shutdown."""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def monitor_event_loop(histogram, interval=1.0):
+    """Measures how late the event loop wakes up from a sleep, which is how long callbacks wait to run."""
+    loop = asyncio.get_running_loop()
+    while True:
+        began = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, loop.time() - began - interval))
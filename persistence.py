@@ -0,0 +1,77 @@
+"""Keeps a snapshot and an event log of every game in SQLite so games survive a crash or redeploy.
+
+Each game is one row holding its latest state as JSON, replaced after every command that changes it.
+The events that led to it are appended to the events table in the same transaction, and are never
+rewritten, so any game can be rebuilt from them later with replay.py.
+The database runs in WAL mode with synchronous=NORMAL, so a snapshot is an append to the write-ahead log
+rather than a rewrite of the database file, and a crash of the bot never loses a committed snapshot.
+"""
+import json
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    channel_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    game_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    time REAL NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+'''
+
+
+def open_store(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    conn.commit()
+    return conn
+
+
+def save_game(conn, channel_id, state, events=()):
+    """Replaces the snapshot of a game with `state`, or deletes it if `state` is None, and appends its new events.
+
+    `state` must be JSON serializable, and each event is a (game_id, seq, time, type, data dict) tuple.
+    """
+    with conn:
+        conn.executemany(
+            'INSERT INTO events (game_id, seq, channel_id, time, type, data) VALUES (?, ?, ?, ?, ?, ?)',
+            [(game_id, seq, channel_id, event_time, event_type, json.dumps(data, separators=(',', ':')))
+             for game_id, seq, event_time, event_type, data in events],
+        )
+        if state is None:
+            conn.execute('DELETE FROM games WHERE channel_id = ?', (channel_id,))
+        else:
+            conn.execute(
+                'INSERT OR REPLACE INTO games (channel_id, state, updated) VALUES (?, ?, ?)',
+                (channel_id, json.dumps(state), time.time()),
+            )
+
+
+def load_games(conn):
+    """Returns channel id -> state of every saved game."""
+    return {channel_id: json.loads(state) for channel_id, state in conn.execute('SELECT channel_id, state FROM games')}
+
+
+def load_events(conn, game_id):
+    """Returns the channel id of a game and its events in order, as (seq, time, type, data) tuples."""
+    rows = conn.execute('SELECT channel_id, seq, time, type, data FROM events WHERE game_id = ? ORDER BY seq', (game_id,)).fetchall()
+    channel_id = rows[0][0] if rows else None
+    return channel_id, [(seq, event_time, event_type, json.loads(data)) for _, seq, event_time, event_type, data in rows]
+
+
+def list_games(conn, limit=20):
+    """The most recent games in the event log, as (game_id, channel_id, started, last event time, number of events) tuples."""
+    return conn.execute(
+        'SELECT game_id, channel_id, MIN(time), MAX(time), COUNT(*) FROM events GROUP BY game_id ORDER BY MAX(time) DESC LIMIT ?',
+        (limit,),
+    ).fetchall()
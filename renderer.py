@@ -0,0 +1,171 @@
+"""Renders the game boards and policy card hands from the sprites in ./images/sprites.
+
+Boards are drawn by placing policy tiles and the election tracker on an empty board, so every
+board state comes from a handful of sprites instead of one photo per combination.
+Requires Pillow (pip install pillow).
+"""
+import functools
+import io
+
+from PIL import Image, ImageFilter
+
+SPRITES_DIR = './images/sprites'
+LIBERAL_POLICY_CARD_IMG = './images/cards/liberal_policy_card.jpg'
+FASCIST_POLICY_CARD_IMG = './images/cards/fascist_policy_card.jpg'
+
+# Board layouts, as fractions of the board sprite's width and height
+# Top left corner of each policy slot
+LIBERAL_POLICY_SLOTS = [(0.1605, 0.265), (0.2970, 0.265), (0.4335, 0.265), (0.5700, 0.265), (0.7065, 0.265)]
+FASCIST_POLICY_SLOTS = [(0.0973, 0.2665), (0.2333, 0.2665), (0.3693, 0.2665), (0.5053, 0.2665), (0.6413, 0.2665), (0.7773, 0.2665)]
+LIBERAL_POLICY_WIDTH = 0.1233
+FASCIST_POLICY_WIDTH = 0.1225
+# Center of each space on the election tracker
+ELECTION_TRACKER_SPACES = [(0.3580, 0.8070), (0.4500, 0.8070), (0.5430, 0.8070), (0.6350, 0.8070)]
+ELECTION_TRACKER_WIDTH = 0.0454
+
+# Gap between cards in a hand, as a fraction of a card's width
+CARD_GAP = 0.04
+CARD_HAND_BACKGROUND = (30, 33, 36)
+
+# Tier -> (format, quality, longest side in pixels or None to keep the original size)
+IMAGE_TIERS = {
+    'high': ('JPEG', 85, None),
+    'medium': ('WEBP', 80, 1600),
+    'low': ('WEBP', 70, 1000),
+}
+RENDER_FORMATS = {'original': ('JPEG', 90, None), **IMAGE_TIERS}
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# Distinct images kept in memory, a game reaches a few dozen at most
+RENDER_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=None)
+def load_sprite(path):
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+def get_sprite_paths():
+    """Every sprite the renderer can use."""
+    return [
+        f"{SPRITES_DIR}/liberal_board.jpg",
+        f"{SPRITES_DIR}/liberal_policy.png",
+        f"{SPRITES_DIR}/fascist_policy.png",
+        f"{SPRITES_DIR}/election_tracker.png",
+        LIBERAL_POLICY_CARD_IMG,
+        FASCIST_POLICY_CARD_IMG,
+    ]
+
+
+def get_fascist_board_sprite_path(game_mode):
+    return f"{SPRITES_DIR}/fascist_board_{game_mode}.jpg"
+
+
+def paste_with_shadow(board, sprite, position):
+    """Pastes an RGBA sprite with a soft drop shadow so it sits on the board like a real tile."""
+    offset = max(2, sprite.width // 40)
+    shadow = Image.new('RGBA', sprite.size, (0, 0, 0, 0))
+    shadow.putalpha(sprite.getchannel('A').point(lambda alpha: alpha * 0.5))
+    shadow = shadow.filter(ImageFilter.GaussianBlur(offset))
+    board.paste(shadow, (position[0] + offset, position[1] + offset), shadow)
+    board.paste(sprite, position, sprite)
+
+
+def place_sprite(board, sprite_path, width, position, centered=False):
+    """Scales a sprite to a fraction of the board's width and pastes it at a fractional position."""
+    sprite = load_sprite(sprite_path)
+    sprite_width = round(board.width * width)
+    sprite = sprite.resize((sprite_width, round(sprite.height * sprite_width / sprite.width)), Image.LANCZOS)
+    x, y = round(board.width * position[0]), round(board.height * position[1])
+    if centered:
+        x, y = x - sprite.width // 2, y - sprite.height // 2
+    paste_with_shadow(board, sprite, (x, y))
+
+
+def render_liberal_board(liberal_policies, failed_election_count):
+    board = load_sprite(f"{SPRITES_DIR}/liberal_board.jpg").convert('RGB')
+    for slot in LIBERAL_POLICY_SLOTS[:liberal_policies]:
+        place_sprite(board, f"{SPRITES_DIR}/liberal_policy.png", LIBERAL_POLICY_WIDTH, slot)
+    place_sprite(board, f"{SPRITES_DIR}/election_tracker.png", ELECTION_TRACKER_WIDTH, ELECTION_TRACKER_SPACES[failed_election_count], centered=True)
+    return board
+
+
+def render_fascist_board(game_mode, fascist_policies):
+    board = load_sprite(get_fascist_board_sprite_path(game_mode)).convert('RGB')
+    for slot in FASCIST_POLICY_SLOTS[:fascist_policies]:
+        place_sprite(board, f"{SPRITES_DIR}/fascist_policy.png", FASCIST_POLICY_WIDTH, slot)
+    return board
+
+
+def render_cards(cards):
+    """Lays out policy cards side by side, in the order they were drawn."""
+    card_imgs = {'Liberal': load_sprite(LIBERAL_POLICY_CARD_IMG), 'Fascist': load_sprite(FASCIST_POLICY_CARD_IMG)}
+    height = max(img.height for img in card_imgs.values())
+    scaled = [card_imgs[card].resize((round(card_imgs[card].width * height / card_imgs[card].height), height), Image.LANCZOS) for card in cards]
+    gap = round(scaled[0].width * CARD_GAP)
+    hand = Image.new('RGB', (sum(img.width for img in scaled) + gap * (len(scaled) + 1), height + gap * 2), CARD_HAND_BACKGROUND)
+    x = gap
+    for img in scaled:
+        hand.paste(img.convert('RGB'), (x, gap))
+        x += img.width + gap
+    return hand
+
+
+def encode(img, tier):
+    img_format, quality, max_side = RENDER_FORMATS[tier]
+    if max_side is not None and max(img.size) > max_side:
+        img = img.copy()
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    output = io.BytesIO()
+    if img_format == 'JPEG':
+        img.save(output, img_format, quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(output, img_format, quality=quality, method=4)
+    return output.getvalue()
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render(key, tier='original'):
+    """Renders the image for an asset key, returning its filename and encoded bytes.
+
+    Cached, so each distinct image is only rendered once. Slow enough to block an event loop,
+    so call it from an executor.
+    """
+    check_renderable(key)
+    kind, *state = key
+    if kind == 'liberal_board':
+        img = render_liberal_board(*state)
+    elif kind == 'fascist_board':
+        img = render_fascist_board(*state)
+    else:
+        img = render_cards(*state)
+    return get_filename(key, tier), encode(img, tier)
+
+
+def get_filename(key, tier='original'):
+    """Filename of a rendered image, e.g. liberal_board_2_1.jpg or top_cards_1_0_1.jpg."""
+    kind, *state = key
+    if kind == 'top_cards':
+        state = ['_'.join('1' if card == 'Fascist' else '0' for card in state[0])]
+    return '_'.join(str(part) for part in [kind, *state]) + FORMAT_EXTENSIONS[RENDER_FORMATS[tier][0]]
+
+
+def check_renderable(key):
+    """Raises ValueError if render() cannot draw the asset key, without rendering it."""
+    kind, *state = key
+    if kind == 'liberal_board':
+        liberal_policies, failed_election_count = state
+        if not 0 <= liberal_policies <= len(LIBERAL_POLICY_SLOTS) or not 0 <= failed_election_count < len(ELECTION_TRACKER_SPACES):
+            raise ValueError(f"No Liberal board layout for {key}")
+    elif kind == 'fascist_board':
+        game_mode, fascist_policies = state
+        load_sprite(get_fascist_board_sprite_path(game_mode))
+        if not 0 <= fascist_policies <= len(FASCIST_POLICY_SLOTS):
+            raise ValueError(f"No Fascist board layout for {key}")
+    elif kind == 'top_cards':
+        if not state[0] or any(card not in ('Liberal', 'Fascist') for card in state[0]):
+            raise ValueError(f"Cannot draw the cards {key}")
+    else:
+        raise ValueError(f"Cannot render asset {key}")
@@ -0,0 +1,114 @@
+"""Rebuilds a game from its event log by applying its actions to a fresh engine.GameState.
+
+Every shuffle reuses the seed recorded in the log, so the rebuilt game is exactly the one that was played.
+Nothing is sent to Discord, and the bot's config isn't needed.
+
+Usage:
+    python replay.py                    lists the most recent games in secret_hitler.db
+    python replay.py <game_id> [seq]    prints the state of a game after its last event, or after event `seq`
+"""
+import json
+import sys
+import time
+
+import engine
+import persistence
+
+GAME_DB_FILE = './secret_hitler.db'  # Same as secrethitler.GAME_DB_FILE
+
+# Logged argument -> whether it names a player
+LOGGED_ARGUMENTS = {'chancellor': True, 'suspect': True, 'appointed': True, 'victim': True, 'card': False}
+
+
+class ReplayPlayer:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class ReplaySeeds:
+    """Hands the engine the recorded seeds, in the order they were drawn."""
+
+    def __init__(self, seeds):
+        self.seeds = iter(seeds)
+
+    def getrandbits(self, k):
+        return next(self.seeds)
+
+
+def get_action(event_type, data, players):
+    """The engine action an event records, or None for events that other actions cause."""
+    if event_type in ('vote', 'veto_vote'):
+        return (data['vote'], players[data['player']])
+    if event_type in ('game_over', 'reshuffle'):
+        return None
+    args = [players[data[key]] if is_player else data[key] for key, is_player in LOGGED_ARGUMENTS.items() if key in data]
+    return (event_type, players[data['player']], *args)
+
+
+def replay(events, until=None):
+    """Applies a game's events in order and returns its state, stopping after event `until` if given."""
+    state = engine.GameState()
+    for _ in replay_actions(state, events, until):
+        pass
+    return state
+
+
+def replay_actions(state, events, until=None):
+    """Applies a game's events to `state` in order, yielding each action with the engine events it caused."""
+    rng = ReplaySeeds([data['seed'] for _, _, _, data in events if 'seed' in data])
+    players = {}
+    for seq, _, event_type, data in events:
+        if until is not None and seq > until:
+            break
+        if event_type == 'join':
+            players[data['player']] = ReplayPlayer(data['player'], data['name'])
+        action = get_action(event_type, data, players)
+        if action is not None:
+            _, caused = engine.apply(state, action, rng)
+            yield action, caused
+
+
+def get_state_summary(state):
+    """The state as JSON-serializable data, with players by name."""
+    def name(player):
+        return player.name if player is not None else None
+    return {
+        'game_state': state.game_state,
+        'players': [name(player) for player in state.players],
+        'assassinated': [name(player) for player in state.assassinated],
+        'role_assignments': {name(player): role for player, role in state.role_assignments.items()},
+        'votes': {name(player): vote for player, vote in state.votes.items()},
+        'liberal_policies': state.liberal_policies,
+        'fascist_policies': state.fascist_policies,
+        'policy_cards': state.deck.get_draw_pile(),
+        'discarded_policies': state.deck.get_discard_pile(),
+        'top_cards': state.top_cards,
+        'failed_election_count': state.failed_election_count,
+        'previous_president': name(state.previous_president),
+        'current_president': name(state.current_president),
+        'current_chancellor': name(state.current_chancellor),
+        'game_mode': state.game_mode,
+        'winner': state.winner,
+    }
+
+
+def print_games(conn):
+    print(f"{'game':<34} {'channel':>20} {'events':>7}  last event")
+    for game_id, channel_id, _, last_time, num_events in persistence.list_games(conn):
+        print(f"{game_id:<34} {channel_id:>20} {num_events:>7}  {time.ctime(last_time)}")
+
+
+if __name__ == '__main__':
+    conn = persistence.open_store(GAME_DB_FILE)
+    if len(sys.argv) < 2:
+        print_games(conn)
+        sys.exit()
+    _, events = persistence.load_events(conn, sys.argv[1])
+    if not events:
+        sys.exit(f"No events for game '{sys.argv[1]}'")
+    until = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(json.dumps(get_state_summary(replay(events, until)), indent=2))
@@ -1,66 +1,125 @@
+import time
+startup_began = time.perf_counter()  # Taken before the imports, so the startup report includes them
 import discord
 import os
 import logging
-from logging.handlers import RotatingFileHandler
 from discord.ext import commands
 from dotenv import load_dotenv
-import random
 import asyncio
-from unittest.mock import MagicMock, AsyncMock
-
-# Load environment variables from .env file
-load_dotenv()
+import collections
+import difflib
+import functools
+import json
+import io
+import itertools
+import random
+import re
+import signal
+import sys
+import uuid
+from urllib.parse import urlparse, parse_qs
+import renderer
+import persistence
+import stats
+import engine
+import logs
+import metrics
+import timers
+import tracing
+from engine import (
+    GAME_NOT_STARTED, GAME_STARTING, NOMINATE_CHANCELLOR, ELECTION, PRESIDENTIAL_LEGISLATION, CHANCELLOR_LEGISLATION,
+    EXECUTIVE_INVESTIGATION, EXECUTIVE_EXAMINATION, EXECUTIVE_APPOINTMENT, EXECUTIVE_KILL, AGENDA_VETOED, GAME_OVER,
+    LIBERAL, FASCIST, HITLER, FIVE_SIX_PLAYER_GAME_MODE, SEVEN_EIGHT_PLAYER_GAME_MODE, NINE_TEN_PLAYER_GAME_MODE,
+    InvalidAction,
+)
 
-# Environment variables
-ENV_TOKEN_SUFFIX = os.getenv('ENV')
-DISCORD_TOKEN = os.getenv('DISCORD_TOKEN' + ENV_TOKEN_SUFFIX)
-SECRET_HITLER_CHANNEL_ID = int(os.getenv('SECRET_HITLER_CHANNEL_ID'))
-FASCIST_CARD_EMOJI_NAME = os.getenv('FASCIST_CARD_EMOJI_NAME')
-LIBERAL_CARD_EMOJI_NAME = os.getenv('LIBERAL_CARD_EMOJI_NAME')
-FASCIST_CARD_EMOJI_ID = int(os.getenv('FASCIST_CARD_EMOJI_ID'))
-LIBERAL_CARD_EMOJI_ID = int(os.getenv('LIBERAL_CARD_EMOJI_ID'))
+# Environment variables, read by load_config() at startup
+ENV_TOKEN_SUFFIX = None
+DISCORD_TOKEN = None
+SECRET_HITLER_CHANNEL_IDS = set()
+FASCIST_CARD_EMOJI_NAME = None
+LIBERAL_CARD_EMOJI_NAME = None
+FASCIST_CARD_EMOJI_ID = None
+LIBERAL_CARD_EMOJI_ID = None
+IMAGE_TIER = 'original'  # 'original' or a tier built by build_assets.py
+DASHBOARD_MODE = 'single'  # 'single' message per dashboard, 'classic' for one per part or 'live' to edit one pinned message
+ROLE_DM_CONCURRENCY = 5  # Role reveal DMs in flight at once
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None  # Serve /metrics on this port, or not at all if None
+TRACE_SAMPLE_RATE = 0.0  # Share of commands traced, 0 turns tracing off
+TRACE_FILE = './traces.jsonl'
+TURN_TIMEOUT = 0  # Seconds each phase of a game waits for its players before playing for them, 0 waits forever
+TURN_REMINDER = 60  # Remind the players a phase is waiting for when this many seconds are left
+IDLE_VOTE = 'nein'  # Vote cast for players who don't vote in time
+SHARD_COUNT = None  # Gateway shards across every worker, None lets Discord recommend a count
+SHARD_IDS = None  # Shards this process connects, None for all of them. cluster.py gives each worker a range
+DRAIN_TIMEOUT = 600  # Seconds a draining worker waits for its games to end before it exits
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-handler = RotatingFileHandler(
-    filename='secret_hitler.log',
+# Written as JSON lines on a background thread, see logs.py
+handler = logs.CompressingRotatingFileHandler(
+    filename=os.getenv('LOG_FILE', 'secret_hitler.log'),  # Set per worker by cluster.py
     mode='a',
     maxBytes=5*1024*1024,  # 5 MB
-    backupCount=2,         # Keep up to 2 backup files
+    backupCount=2,         # Keep up to 2 gzipped backup files
     encoding='utf-8',
     delay=0
 )
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+log_listener = logs.setup(logger, handler)
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# Game States
-GAME_NOT_STARTED = 0
-GAME_STARTING = 1
-NOMINATE_CHANCELLOR = 2
-ELECTION = 3
-PRESIDENTIAL_LEGISLATION = 4
-CHANCELLOR_LEGISLATION = 5
-EXECUTIVE_INVESTIGATION = 6
-EXECUTIVE_EXAMINATION = 7
-EXECUTIVE_APPOINTMENT = 8
-EXECUTIVE_KILL = 9
-AGENDA_VETOED = 10
-
-# Role definitions
-LIBERAL = "Liberal"
-FASCIST = "Fascist"
-HITLER = "Hitler"
-
-# Game Types
-FIVE_SIX_PLAYER_GAME_MODE = 'fiveplayers'
-SEVEN_EIGHT_PLAYER_GAME_MODE = 'sevenplayers'
-NINE_TEN_PLAYER_GAME_MODE = 'nineplayers'
+
+class Bot(commands.AutoShardedBot):
+    """Runs each command, checks included, in a trace when tracing samples it.
+
+    Connects the shards in SHARD_IDS, or all of them, from this one process.
+    """
+
+    async def invoke(self, ctx):
+        """Runs the command once the commands sent to its game before it have finished, see GameInbox."""
+        if ctx.command is None:
+            # Every message goes through here, let discord.py skip the ones that aren't commands
+            return await super().invoke(ctx)
+        await games_resumed.wait()
+        session = get_command_session(ctx)
+        queued = time.perf_counter()
+        if session is None:
+            await self.invoke_now(ctx, queued)
+        else:
+            await session.inbox.run(self.invoke_now, ctx, queued)
+
+    async def invoke_now(self, ctx, queued):
+        with start_command_trace(ctx) as span, logs.context(**get_log_fields(ctx)):
+            span.set(queued_ms=(time.perf_counter() - queued) * 1000)
+            await super().invoke(ctx)
+            span.set(failed=ctx.command_failed)
+
+def start_command_trace(ctx):
+    """The root span of a command's trace, tagged with the phase of its game and the number of players.
+
+    Messages that aren't commands are never traced, so sampled traces only hold commands.
+    """
+    if ctx.command is None:
+        return tracing.Unsampled()
+    session = sessions.get(ctx.channel.id) or player_sessions.get(ctx.author.id)
+    attributes = {'command': ctx.command.qualified_name, 'channel': ctx.channel.id}
+    if session is not None:
+        attributes.update(phase=GAME_STATE_NAMES[session.game_state], players=len(session.players))
+    return tracing.start_trace('command', **attributes)
+
+def get_log_fields(ctx):
+    """The fields added to everything logged while a command runs, so a game's log lines can be picked out."""
+    session = sessions.get(ctx.channel.id) or player_sessions.get(ctx.author.id)
+    fields = {'command': ctx.command.qualified_name if ctx.command else None, 'channel': ctx.channel.id, 'user': ctx.author.id}
+    if session is not None:
+        fields['game'] = session.game_id
+    return fields
+
+bot = Bot(command_prefix="!", intents=intents)
 
 # Images
 SECRET_HITLER_LOGO_IMG = './images/logo/secret_hitler_logo.jpg'
@@ -70,88 +129,469 @@ HITLER_CARD_IMG = './images/cards/hitler_card.jpg'
 HITLER_ASSASSINATED_IMG = './images/cards/hitler_assassinated_card.jpg'
 HITLER_CHANCELLOR_IMG = './images/cards/hitler_chancellor_card.jpg'
 
-# Game Variables
-game_state = GAME_NOT_STARTED
-players = []
-assassinated = []
-role_assignments = {}
-votes = {}
-liberal_policies = 0
-fascist_policies = 0
-policy_cards = []
-discarded_policies = []
-top_cards = []
-failed_election_count = 0
-previous_president = None
-current_president = None
-current_chancellor = None
-game_mode = None
-game_channel = None
+# Asset keys, see get_rendered_asset_keys() for the keys that depend on the game state
+SECRET_HITLER_LOGO_ASSET = ('logo',)
+LIBERAL_PARTY_CARD_ASSET = ('party_card', LIBERAL)
+FASCIST_PARTY_CARD_ASSET = ('party_card', FASCIST)
+HITLER_CARD_ASSET = ('party_card', HITLER)
+HITLER_ASSASSINATED_ASSET = ('game_over', 'hitler_assassinated')
+HITLER_CHANCELLOR_ASSET = ('game_over', 'hitler_chancellor')
+assets = {}  # Asset key -> (path, image bytes), filled by load_assets() at startup
+pending_renders = {}  # Asset key -> future of a render running in the executor
+
+# Discord limits
+DISCORD_MESSAGE_LIMIT = 2000
+DISCORD_ATTACHMENT_LIMIT = 10     # Files per message
+CHANNEL_SEND_RATE_LIMIT = 5       # Messages per channel...
+CHANNEL_SEND_RATE_PERIOD = 5.0    # ...every this many seconds
+SEND_LATENCY_WARNING = 3.0        # Log messages that waited longer than this in a channel's send queue
+ROLE_DM_ATTEMPTS = 3              # Tries per role reveal DM before giving up on a player
+ROLE_DM_RETRY_DELAY = 1.0         # Seconds before the first retry, doubled after each failure
+
+# Attachment cache
+ATTACHMENT_CACHE_FILE = './attachment_cache.json'
+ATTACHMENT_URL_EXPIRY_MARGIN = 60*60  # Re-upload images whose CDN URL expires within the hour
+attachment_urls = {}  # Image path -> CDN URL of its first upload
+
+# A user mention as Discord sends it, <@id> or <@!id> for a server nickname
+MENTION_PATTERN = re.compile(r'<@!?(\d+)>')
+
+# Saved games
+GAME_DB_FILE = './secret_hitler.db'
+game_store = None  # SQLite connection, opened before the bot runs
+
+startup_timings = {}  # Startup step -> seconds it took, logged once the bot is ready
+games_resumed = asyncio.Event()  # Set once resume_games() has run, commands wait for it so they can't replace a saved game
+draining = False  # Set by drain() before a deploy, no new games start once it is
+
+# Deadline of every game's current phase, all on one heap, see schedule_turn()
+turn_timers = timers.Scheduler()
+background_tasks = set()  # Tasks nothing awaits, e.g. idle turns being played, referenced until they finish
+
+# Metrics, served by metrics.serve() when METRICS_PORT is set
+GAME_STATE_NAMES = {
+    GAME_NOT_STARTED: 'not_started', GAME_STARTING: 'starting', NOMINATE_CHANCELLOR: 'nominate_chancellor', ELECTION: 'election',
+    PRESIDENTIAL_LEGISLATION: 'presidential_legislation', CHANCELLOR_LEGISLATION: 'chancellor_legislation',
+    EXECUTIVE_INVESTIGATION: 'executive_investigation', EXECUTIVE_EXAMINATION: 'executive_examination',
+    EXECUTIVE_APPOINTMENT: 'executive_appointment', EXECUTIVE_KILL: 'executive_kill', AGENDA_VETOED: 'agenda_vetoed', GAME_OVER: 'game_over',
+}
+COMMAND_SECONDS = metrics.Histogram('secret_hitler_command_seconds', "Time to run a command after its checks pass, saving included.", ['command'])
+COMMAND_ERRORS = metrics.Counter('secret_hitler_command_errors_total', "Commands that failed a check or raised an error.", ['command', 'error'])
+OPERATION_SECONDS = metrics.Histogram('secret_hitler_operation_seconds', "Time spent in the parts of a command that do the most work.", ['operation'])
+API_CALLS = metrics.Counter('secret_hitler_api_calls_total', "Requests sent to Discord: channel messages with and without files, edits, pins, DMs and opening DM channels.", ['kind'])
+API_BYTES = metrics.Counter('secret_hitler_api_bytes_total', "Bytes of message text and uploaded files sent to Discord.", ['kind'])
+RATE_LIMIT_WAITS = metrics.Counter('secret_hitler_rate_limit_waits_total', "Channel messages held back to stay under Discord's rate limit.")
+RATE_LIMIT_WAIT_SECONDS = metrics.Counter('secret_hitler_rate_limit_wait_seconds_total', "Time channel messages were held back for the rate limit.")
+EVENT_LOOP_LAG_SECONDS = metrics.Histogram('secret_hitler_event_loop_lag_seconds', "How late the event loop runs a timer, sampled every second.")
+loop_monitor = None  # Task of metrics.monitor_event_loop(), started with the metrics server and cancelled when the bot closes
+metrics.Gauge('secret_hitler_games', "Games in memory, by state.", ['state'], collect=lambda: count_games_by_state())
+metrics.Gauge('secret_hitler_send_queue_depth', "Messages waiting in the send queues of every game.", collect=lambda: {(): sum(len(session.outbox.pending) for session in sessions.values())})
+metrics.Gauge('secret_hitler_command_queue_depth', "Commands waiting in the inboxes of every game for the game's previous command to finish.", collect=lambda: {(): sum(len(session.inbox.pending) for session in sessions.values())})
+
+class PlayerRegistry:
+    """Finds the players of a game by ID, @mention, name or display name.
+
+    Names are matched ignoring case and a leading @, then by a prefix only one player's name starts with,
+    then by the closest spelling. Only players still at the table are registered.
+    """
+
+    def __init__(self):
+        self.by_id = {}  # Player ID -> player
+        self.by_name = {}  # Normalized name or display name -> players with it
+        self.names = {}  # Player ID -> their names in by_name, as they were when they joined
+
+    def add(self, player):
+        self.by_id[player.id] = player
+        self.names[player.id] = get_normalized_names(player)
+        for name in self.names[player.id]:
+            self.by_name.setdefault(name, []).append(player)
+
+    def remove(self, player):
+        self.by_id.pop(player.id, None)
+        for name in self.names.pop(player.id, ()):
+            self.by_name[name].remove(player)
+            if not self.by_name[name]:
+                del self.by_name[name]
+
+    def find(self, text):
+        """The player `text` refers to, or None if it matches nobody or more than one player."""
+        mention = MENTION_PATTERN.fullmatch(text.strip())
+        if mention:
+            return self.by_id.get(int(mention.group(1)))
+        name = normalize_name(text)
+        players = self.by_name.get(name)
+        if players is None:
+            players = [player for key, named in self.by_name.items() if key.startswith(name) for player in named]
+        if not players:
+            players = [player for key in difflib.get_close_matches(name, self.by_name, n=1, cutoff=0.75) for player in self.by_name[key]]
+        players = list({player.id: player for player in players}.values())
+        return players[0] if len(players) == 1 else None
+
+class DirectMessages:
+    """A player's DM channel, counting what is sent to it for the metrics."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content=None, **kwargs):
+        count_api_call('dm', content, kwargs)
+        with tracing.span('dm', files=len(get_files(kwargs))):
+            return await self.channel.send(content, **kwargs)
+
+class GameSession(engine.GameState):
+    """Holds the state of a single game, bound to the channel it is played in."""
+
+    def __init__(self, game_channel):
+        self.game_channel = game_channel
+        self.outbox = ChannelSendQueue(game_channel)
+        self.inbox = GameInbox(on_idle=lambda: release_session(self))
+        self.saved_snapshot = None  # JSON of the last snapshot written to game_store
+        self.turn_timer = None  # Reminder or deadline of the current phase
+        self.turn_phase = None  # Game state the turn timer was started for
+        self.dashboard_lock = asyncio.Lock()  # Live dashboard updates, one at a time
+        super().__init__()
+
+    def reset(self):
+        """Clears the game variables so a new round can be played."""
+        super().reset()
+        self.dm_channels = {}  # Player id -> their DM channel, opened at start
+        self.dashboard_message = None  # Pinned message edited in place when DASHBOARD_MODE is 'live'
+        self.dashboard_hash = None  # Hash of what the live dashboard shows, to skip edits that change nothing
+        self.registry = PlayerRegistry()
+        # Event log of this game, see record_event
+        self.game_id = uuid.uuid4().hex
+        self.event_seq = 0
+        self.events = []  # Recorded but not yet written to game_store
+
+class ChannelSendQueue:
+    """Sends messages to one channel in order, pacing them to stay under Discord's rate limit.
+
+    Messages sent with the same coalesce_key while an earlier one is still waiting replace it,
+    so a burst of progress updates only posts the latest.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = collections.deque()  # [coalesce_key, content, kwargs, future, time queued, span of the sender, message to edit]
+        self.worker = None
+        # Token bucket, refilled continuously so sends are spaced out before Discord would return a 429
+        self.tokens = CHANNEL_SEND_RATE_LIMIT
+        self.last_refill = time.monotonic()
+        # Stats
+        self.sent = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.rate_limit_wait = 0.0
+        self.last_send_latency = 0.0
+        self.total_send_latency = 0.0
+
+    async def send(self, content=None, coalesce_key=None, **kwargs):
+        """Queues a message and returns it once it has been sent."""
+        return await self.queue(None, content, coalesce_key, kwargs)
+
+    def post(self, content=None, coalesce_key=None, **kwargs):
+        """Queues a message without waiting for it to be sent, for messages nothing needs back, e.g. vote progress."""
+        future = self.queue(None, content, coalesce_key, kwargs)
+        future.add_done_callback(self.log_failed_post)
+        return future
+
+    async def edit(self, message, content=None, **kwargs):
+        """Queues an edit of a message sent to the channel and returns the edited message, edits share the rate limit with sends."""
+        return await self.queue(message, content, None, kwargs)
+
+    def queue(self, target, content, coalesce_key, kwargs):
+        """Queues a send or edit, returning a future of the message."""
+        if coalesce_key is not None:
+            for entry in self.pending:
+                if entry[0] == coalesce_key:
+                    entry[1], entry[2] = content, kwargs
+                    self.coalesced += 1
+                    return entry[3]
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append([coalesce_key, content, kwargs, future, time.monotonic(), tracing.current_span.get(), target])
+        self.max_depth = max(self.max_depth, len(self.pending))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.process())
+        return future
+
+    def log_failed_post(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Failed to send a message to channel {self.channel.id}: {future.exception()}")
+
+    def discard(self, coalesce_key):
+        """Drops queued messages that are no longer relevant, e.g. vote progress once the votes are tallied."""
+        for entry in [entry for entry in self.pending if entry[0] == coalesce_key]:
+            self.pending.remove(entry)
+            entry[3].set_result(None)
+
+    async def wait_for_rate_limit(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(CHANNEL_SEND_RATE_LIMIT, self.tokens + (now - self.last_refill) * CHANNEL_SEND_RATE_LIMIT / CHANNEL_SEND_RATE_PERIOD)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) * CHANNEL_SEND_RATE_PERIOD / CHANNEL_SEND_RATE_LIMIT
+            self.rate_limit_wait += wait
+            RATE_LIMIT_WAITS.inc()
+            RATE_LIMIT_WAIT_SECONDS.inc(wait)
+            await asyncio.sleep(wait)
+
+    async def process(self):
+        # This task has its own copy of the context, so drop the fields of the command that started it
+        logs.current_fields.set({'channel': self.channel.id})
+        while self.pending:
+            await self.wait_for_rate_limit()
+            if not self.pending:
+                break
+            _, content, kwargs, future, queued, parent, target = self.pending.popleft()
+            count_api_call('text' if target is None else 'edit', content, kwargs)
+            try:
+                # The worker task runs in the context of whichever command started it, so parent the span explicitly
+                with tracing.child_span(parent, 'send' if target is None else 'edit', files=len(get_files(kwargs)), queued_ms=(time.monotonic() - queued) * 1000):
+                    if target is None:
+                        message = await self.channel.send(content, **kwargs)
+                    else:
+                        message = await target.edit(content=content, **kwargs)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            self.sent += 1
+            self.last_send_latency = time.monotonic() - queued
+            self.total_send_latency += self.last_send_latency
+            if self.last_send_latency > SEND_LATENCY_WARNING:
+                logger.warning(f"Message to channel {self.channel.id} waited {self.last_send_latency:.1f}s to be sent. {self.stats()}")
+            if not future.done():
+                future.set_result(message)
+
+    def stats(self):
+        return {
+            'depth': len(self.pending),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'rate_limit_wait': self.rate_limit_wait,
+            'last_send_latency': self.last_send_latency,
+            'mean_send_latency': self.total_send_latency / self.sent if self.sent else 0.0,
+        }
+
+class GameInbox:
+    """Runs the commands of one game one at a time, in the order they arrived, on a single task.
+
+    Each command runs to its end, announcements and save included, before the next one starts, so no command
+    sees the game halfway through another, e.g. a !reset while the end of the game is announced.
+    Every game has its own inbox and task, so games never wait on each other.
+    """
+
+    def __init__(self, on_idle=None):
+        self.pending = collections.deque()  # (coroutine function, args, future of its result)
+        self.worker = None
+        self.on_idle = on_idle  # Called once the queue is empty and the last command has finished
+        # Stats
+        self.processed = 0
+        self.max_depth = 0
+
+    async def run(self, function, *args):
+        """Queues `function(*args)` behind the game's other commands and returns its result once it has run."""
+        if asyncio.current_task() is self.worker:
+            return await function(*args)  # Already running for this game, queueing would wait on itself
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((function, args, future))
+        self.max_depth = max(self.max_depth, len(self.pending))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.process())
+        return await future
+
+    async def process(self):
+        # This task has its own copy of the context of whichever command started it, and each command sets its own
+        logs.current_fields.set({})
+        tracing.current_span.set(None)
+        while self.pending:
+            function, args, future = self.pending.popleft()
+            if future.done():
+                continue  # The sender was cancelled while it waited
+            try:
+                result = await function(*args)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            self.processed += 1
+        if self.on_idle is not None:
+            self.on_idle()
+
+# Active games keyed by the ID of the channel they are played in
+sessions = {}
+# Game each player has joined keyed by player ID, so commands sent to the bot in a DM can find it
+player_sessions = {}
+
+# Commands that open a session for a game channel that has none
+SESSION_OPENING_COMMANDS = {'join', 'tester'}
+
+def get_session(ctx):
+    """Returns the game for the channel of the command, or the game the author joined for DMs, or None."""
+    if isinstance(ctx.channel, discord.DMChannel):
+        return player_sessions.get(ctx.author.id)
+    return sessions.get(ctx.channel.id)
+
+def open_session(ctx):
+    """Returns the game for the channel of the command, starting a session for it if it has none."""
+    session = sessions.get(ctx.channel.id)
+    if session is None:
+        session = GameSession(ctx.channel)
+        sessions[ctx.channel.id] = session
+    return session
+
+def release_session(session):
+    """Forgets a channel's session once it holds no game, so only channels with a game keep one."""
+    if session.game_state == GAME_NOT_STARTED and not session.players and sessions.get(session.game_channel.id) is session:
+        del sessions[session.game_channel.id]
+
+def get_command_session(ctx):
+    """The game a command is queued for, or None for commands outside of any game."""
+    if isinstance(ctx.channel, discord.DMChannel) or not is_allowed_game_channel(ctx.channel):
+        return get_session(ctx)
+    if ctx.command.qualified_name in SESSION_OPENING_COMMANDS:
+        return open_session(ctx)
+    return sessions.get(ctx.channel.id)
+
+def get_reply_destination(ctx):
+    """The game's send queue, so replies keep to the channel's rate limit, or the channel itself if it has no game."""
+    session = get_session(ctx)
+    return session.outbox if session is not None else ctx
 
 @bot.event
 async def on_ready():
-    global game_channel
     print(f"Logged in as {bot.user}")
-    game_channel = bot.get_channel(SECRET_HITLER_CHANNEL_ID)
+    first_ready = 'gateway' not in startup_timings
+    if first_ready:
+        startup_timings['gateway'] = time.perf_counter() - startup_timings.pop('connecting', time.perf_counter())
+    try:
+        await timed_step('resume', resume_games())
+    finally:
+        games_resumed.set()
+    if first_ready:
+        steps = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in startup_timings.items())
+        logger.info(f"Ready {time.perf_counter() - startup_began:.2f}s after launch: {steps} (assets, cache and login run at the same time)")
+
+@bot.before_invoke
+async def before_command(ctx):
+    ctx.command_began = time.perf_counter()
+
+@bot.after_invoke
+async def after_command(ctx):
+    """Snapshots the game of every command that ran, so it can be resumed after a restart, and times the command."""
+    session = get_session(ctx)
+    if session is not None:
+        with tracing.span('save'):
+            save_session(session)
+    if hasattr(ctx, 'command_began'):
+        COMMAND_SECONDS.observe(time.perf_counter() - ctx.command_began, command=ctx.command.qualified_name)
 
 @bot.event
 async def on_command_error(ctx, error):
+    COMMAND_ERRORS.inc(command=ctx.command.qualified_name if ctx.command else 'unknown', error=type(error).__name__)
     if isinstance(error, commands.CheckFailure):
         logger.info(f"User **{get_player_name(ctx.author)}** is not allowed to use this command. Please make sure you meet the requirements.")
     else:
         logger.error(f"Command {ctx.command} caused an error. {error}")
 
+def receives_dms():
+    """Whether Discord sends this process the bot's DMs, which it only sends to the connection of shard 0."""
+    return SHARD_IDS is None or 0 in SHARD_IDS
+
+def get_dm_command_note(session):
+    """Tells a player who was DMed a command where to send it if their DMs go to another worker."""
+    if receives_dms():
+        return ""
+    return f"\nSend it in **#{session.game_channel.name}**, this game's channel. DMs to me don't reach the worker running this game."
+
 def is_player():
     """Checks if the user is a player."""
     async def predicate(ctx):
-        if ctx.author not in players:
+        session = get_session(ctx)
+        if session is None and SHARD_IDS is not None and isinstance(ctx.channel, discord.DMChannel):
+            # Discord sends every DM to shard 0, the game may be run by another worker
+            await ctx.send("I can't see your game from here. Please send the command in your game's channel instead.")
+            return False
+        if session is None or ctx.author.id not in session.registry.by_id:
             await ctx.send("Only players who have joined the game can use this command.")
             return False
         return True
-    return commands.check(predicate)
+    return traced_check('is_player', predicate)
+
+def is_accepting_games():
+    """Checks that the bot isn't draining for a deploy, which lets running games finish but starts no new ones."""
+    async def predicate(ctx):
+        session = get_session(ctx)
+        if draining and session is not None and session.game_state in (GAME_NOT_STARTED, GAME_STARTING):
+            await ctx.send("The bot is restarting for an update. New games can start again in a few minutes!")
+            return False
+        return True
+    return traced_check('is_accepting_games', predicate)
+
+def traced_check(name, predicate):
+    """commands.check() with the check in a span of the command's trace."""
+    async def traced(ctx):
+        with tracing.span('check', check=name) as span:
+            passed = await predicate(ctx)
+            span.set(passed=passed)
+            return passed
+    return commands.check(traced)
+
+def is_allowed_game_channel(channel):
+    """Checks if games can be played in the channel. Any server channel is allowed when no channel IDs are configured."""
+    if SECRET_HITLER_CHANNEL_IDS:
+        return channel.id in SECRET_HITLER_CHANNEL_IDS
+    return not isinstance(channel, discord.abc.PrivateChannel)
+
+def get_game_channel_names():
+    channel_names = [f"**{bot.get_channel(channel_id).name}**" for channel_id in SECRET_HITLER_CHANNEL_IDS if bot.get_channel(channel_id)]
+    return ", ".join(channel_names) if channel_names else "a server channel"
 
 def is_game_channel(showResponse=True):
     """Checks if the user is messaging the game channel or the bot directly in a DM."""
-    global game_channel 
     async def predicateResponse(ctx):
-        # Check if the channel is the game channel
-        if ctx.channel.id == SECRET_HITLER_CHANNEL_ID:
+        # Check if the channel is a game channel
+        if is_allowed_game_channel(ctx.channel):
             return True
         if showResponse:
-            await ctx.send(f"This is the wrong channel! Please use **{game_channel.name}**.")
+            await ctx.send(f"This is the wrong channel! Please use {get_game_channel_names()}.")
         return False
 
     async def predicateNoResponse(ctx):
         # Same logic as above but without responding with a message
-        return ctx.channel.id == SECRET_HITLER_CHANNEL_ID or isinstance(ctx.channel, discord.DMChannel)
+        return is_allowed_game_channel(ctx.channel) or isinstance(ctx.channel, discord.DMChannel)
 
-    return commands.check(predicateResponse if showResponse else predicateNoResponse)
+    return traced_check('is_game_channel', predicateResponse if showResponse else predicateNoResponse)
     
 def is_game_channel_or_bot_itself(showResponse=True):
     """Checks if the user is messaging the game channel or the bot directly in a DM."""
-    global game_channel 
     async def predicateResponse(ctx):
-        # Check if the channel is the game channel or a DM to the bot itself
-        if ctx.channel.id == SECRET_HITLER_CHANNEL_ID or isinstance(ctx.channel, discord.DMChannel):
+        # Check if the channel is a game channel or a DM to the bot itself
+        if is_allowed_game_channel(ctx.channel) or isinstance(ctx.channel, discord.DMChannel):
             return True
         if showResponse:
-            await ctx.send(f"This is the wrong channel! Please use **{game_channel.name}**.")
+            await ctx.send(f"This is the wrong channel! Please use {get_game_channel_names()}.")
         return False
 
     async def predicateNoResponse(ctx):
         # Same logic as above but without responding with a message
-        return ctx.channel.id == SECRET_HITLER_CHANNEL_ID or isinstance(ctx.channel, discord.DMChannel)
+        return is_allowed_game_channel(ctx.channel) or isinstance(ctx.channel, discord.DMChannel)
 
-    return commands.check(predicateResponse if showResponse else predicateNoResponse)
+    return traced_check('is_game_channel_or_bot_itself', predicateResponse if showResponse else predicateNoResponse)
 
 
-@bot.command()
+@commands.command()
 @is_game_channel()
 async def tester(ctx, cmd, arg1, arg2=None):
-    """Testing utility for developers."""
-    global players
-    if ENV_TOKEN_SUFFIX == '_PROD':
-        return
+    """Testing utility for developers, only added to the bot outside production."""
+    from unittest.mock import MagicMock, AsyncMock
+    session = get_session(ctx)
     _players = {
         '1': {'name': '_boo_radley_', 'id': 1},
         '2': {'name': 'Player2', 'id': 2},
@@ -186,6 +626,8 @@ async def tester(ctx, cmd, arg1, arg2=None):
         if arg1 in _players:
             mock_author = MagicMock()
             mock_author.send = AsyncMock()
+            mock_author.dm_channel = None
+            mock_author.create_dm = AsyncMock(return_value=mock_author)
             mock_author.name = _players[arg1]['name']
             mock_author.id = _players[arg1]['id']
             ctx.author = mock_author
@@ -193,14 +635,11 @@ async def tester(ctx, cmd, arg1, arg2=None):
             await ctx.send('Invalid test player. Must be 1-9.')
             return
     else:
-        found = False
-        for player in players:
-            if int(player.id) == int(arg1):
-                ctx.author = player
-                found = True
-        if not found:
+        player = session.registry.by_id.get(int(arg1)) if session is not None and arg1.isdigit() else None
+        if player is None:
             await ctx.send('Invalid test player.')
             return
+        ctx.author = player
     if cmd in noArgCommands:
         await noArgCommands[cmd](ctx)
     elif cmd in argCommands:
@@ -211,630 +650,514 @@ async def tester(ctx, cmd, arg1, arg2=None):
 
 @bot.command()
 @is_game_channel()
+@is_accepting_games()
 async def join(ctx):
     """Allows a player to join the game."""
-    global game_state
-
-    if game_state != GAME_NOT_STARTED:
-        await game_channel.send("The game has already started. Please wait for the next round!")
+    session = open_session(ctx)
+    if session.game_state == GAME_NOT_STARTED and ctx.author not in session.players and player_sessions.get(ctx.author.id) not in (None, session):
+        await session.outbox.send("You are already in a game in another channel!")
         return
-
-    if ctx.author in players:
-        await game_channel.send("You are already in the game!")
-    elif len(players) >= 10:
-        await game_channel.send("The game is full. Only 5 to 10 players can join!")
-    else:
-        players.append(ctx.author)
-        await game_channel.send(f"**{get_player_name(ctx.author)}** has joined the game! ({len(players)}/10 players)")
+    events = await run_action(session, ('join', ctx.author))
+    if events:
+        player_sessions[ctx.author.id] = session
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def leave(ctx):
     """Leave a lobby."""
-    global players
-    if game_state == GAME_NOT_STARTED:
-        players.remove(ctx.author)
-        message = (f"**{get_player_name(ctx.author)}** has left the lobby. ({len(players)}/8 players)")
-        await game_channel.send(message)
-    else:
-        await game_channel.send("Match is in progress.")
+    session = get_session(ctx)
+    events = await run_action(session, ('leave', ctx.author))
+    if events:
+        player_sessions.pop(ctx.author.id, None)
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
+@is_accepting_games()
 async def ready(ctx):
     """Ready to play the game if enough players have joined."""
-    global game_state, players, game_mode
-
-    if len(players) < 5:
-        await game_channel.send(f"You need at least 5 players to start the game! ({len(players)}/10 players)")
-        return
-
-    if len(players) > 10:
-        await game_channel.send(f"The game can only have a maximum of 8 players! ({len(players)}/10 players)")
-        return
-    
-    if game_state != GAME_NOT_STARTED:
-        await game_channel.send("The game has already started!")
-        return
-    
-    if len(players) in [5,6]:
-        game_mode = FIVE_SIX_PLAYER_GAME_MODE
-    if len(players) in [7,8]:
-        game_mode = SEVEN_EIGHT_PLAYER_GAME_MODE
-    if len(players) in [9,10]:
-        game_mode = NINE_TEN_PLAYER_GAME_MODE
-    await game_channel.send(file=discord.File(SECRET_HITLER_LOGO_IMG))
-    await game_channel.send(get_intro_screen())
-    game_state = GAME_STARTING
+    session = get_session(ctx)
+    events = await run_action(session, ('ready', ctx.author))
+    if events:
+        await announce(session, events)
     
 @bot.command()
 @is_player()
 @is_game_channel()
+@is_accepting_games()
 async def start(ctx):
     """Starts the game after ready."""
-    global role_assignments, policy_cards, game_state, current_president, players, game_mode
-
-    if len(players) < 5:
-        await game_channel.send(f"You need at least 5 players to start the game! ({len(players)}/10 players)")
-        return
-
-    if len(players) > 10:
-        await game_channel.send(f"The game can only have a maximum of 8 players! ({len(players)}/10 players)")
+    session = get_session(ctx)
+    events = await run_action(session, ('start', ctx.author))
+    if not events:
         return
-    
-    if game_state == GAME_NOT_STARTED:
-        await game_channel.send("You must type !ready first.")
-        return
-
-    if game_state != GAME_STARTING:
-        await game_channel.send("The game has already started!")
-        return
-
-    num_players = len(players)
-    num_fascists = {5: 1, 6: 1, 7: 2, 8: 2, 9:3, 10:3}[num_players]
-    num_liberals = num_players - num_fascists - 1
-
-    logger.info(f"Starting game with {num_players} players in {game_mode} mode.")
-
-    # Assign roles randomly
-    roles = [HITLER] + [FASCIST] * num_fascists + [LIBERAL] * num_liberals
-    random.shuffle(roles)
-    role_assignments = {player: role for player, role in zip(players, roles)}
-    logger.info("Players: [%s]", ", ".join(f"{get_player_name(player)} ({player.id}) ({role})" for player, role in role_assignments.items()))
-
-    # Create the stack of policy cards
-    policy_cards = [LIBERAL] * 6 + [FASCIST] * 11
-    random.shuffle(policy_cards)
-
-    # Randomly select a candidate
-    candidate = random.choice(players)
-    current_president = candidate
-    messageAfter = (
-        f"The game has started! There will be **{num_liberals} Liberals** and **{num_fascists} Fascists** with **1 Secret Hitler**."
-        f"\nYour first Presidential Candidate has been randomly selected as **{get_player_name(candidate)}**!"
-        f"\n**{get_player_name(candidate)}** you must **!nominate** a Chancellor then the group will vote."
-        )
-    await print_game_dashboard(None, messageAfter)
-    await send_roles_to_players()
-    game_state = NOMINATE_CHANCELLOR
+    logger.info(f"Starting game with {len(session.players)} players in {session.game_mode} mode.")
+    logger.info("Players: [%s]", ", ".join(f"{get_player_name(player)} ({player.id}) ({role})" for player, role in session.role_assignments.items()))
+    # Open every DM channel while the dashboard is being sent, so no DM has to open one later
+    await asyncio.gather(announce(session, events), open_dm_channels(session))
+    delivered = await send_roles_to_players(session)
+    undelivered = [get_player_name(player) for player, ok in delivered.items() if not ok]
+    if undelivered:
+        await session.outbox.send(f"I couldn't send a role to **{'**, **'.join(undelivered)}**. Please allow direct messages from server members, then ask to **!reset** if you can't play without it.")
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def nominate(ctx, nomination: str):
-    """Allows the President to choose a Chancellor."""
-    global game_state, current_chancellor, current_president
-
-    # Check if the game state is in the nomination phase
-    if game_state != NOMINATE_CHANCELLOR:
-        await game_channel.send("Nomination is not allowed at this moment.")
-        return
-    
-    if ctx.author != current_president:
-        await game_channel.send("Only the President can nominate the Chancellor.")
-        return
-    
-    chancellor = get_player_by_name(nomination)
-    if chancellor is None:
-        await game_channel.send("Could not find that player, try again.")
-        return
-
-    if chancellor == current_president:
-        await game_channel.send("You can't nominate yourself as Chancellor, pick someone else.")
-        return
-    
-    if chancellor == previous_president:
-        await game_channel.send("You can't nominate the most recent President as Chancellor, nominate a different Chancellor.")
-        return
-    
-    current_chancellor = chancellor
-    await game_channel.send(f"President **{get_player_name(current_president)}** has nominated **{get_player_name(chancellor)}** as Chancellor, everyone vote **!ja** or **!nein**.")
-    game_state = ELECTION
+    """Allows the President to choose a Chancellor, by name or @mention."""
+    session = get_session(ctx)
+    events = await run_action(session, ('nominate', ctx.author, get_player_by_name(session, nomination)))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def ja(ctx):
     """Allows players to vote Ja! on the current candidate or veto."""
-    global game_state, current_president, previous_president, current_chancellor, top_cards, votes
-    
-    if game_state != ELECTION and game_state != AGENDA_VETOED:
-        await game_channel.send("Voting is not allowed at this moment.")
-        return
-    
-    if game_state == ELECTION:
-        if ctx.author == current_chancellor or ctx.author == current_president:
-            await game_channel.send("Chancellor and President do not vote!")
-            return    
-        if ctx.author in votes:
-            await game_channel.send("You have already voted!")
-            return
-        await cast_vote(ctx, 'ja')
-
-    if game_state == AGENDA_VETOED:
-        if ctx.author != current_president:
-            await game_channel.send(f"Only the President can confirm or reject a veto.")
-            return
-        discarded_policies.extend(top_cards)
-        top_cards = []
-        previous_president = current_president
-        current_president = get_next_president()
-        messageAfter = (
-            f"The President **{get_player_name(current_president)}** has voted in **favor** of a veto to this policy agenda!"
-            f"\nThe policies will all be discarded and this will be considered an election failure."
-            )
-        reshuffle_msg = start_new_round()
-        if reshuffle_msg is not None:
-            messageAfter += f"\n\n{reshuffle_msg}"
-        messageAfter += (
-            f"\nIt's time for a new election! **{get_player_name(current_president)}** will be nominated as new President!"
-            f"\n**{get_player_name(current_president)}** you must **!nominate** a Chancellor then the group will vote."
-        )
-        await print_game_dashboard(None, messageAfter)
-        game_state = NOMINATE_CHANCELLOR
+    session = get_session(ctx)
+    events = await run_action(session, ('ja', ctx.author))
+    if events:
+        await announce(session, events)
     
 @bot.command()
 @is_player()
 @is_game_channel()
 async def nein(ctx):
     """Allows players to vote Nein! on the current candidate."""
-    global game_state, current_president, current_chancellor, votes
-    
-    if game_state != ELECTION and game_state != AGENDA_VETOED:
-        await game_channel.send("Voting is not allowed at this moment.")
-        return
-    
-    if game_state == ELECTION:
-        if ctx.author == current_chancellor or ctx.author == current_president:
-            await game_channel.send("Chancellor and President do not vote!")
-            return    
-        if ctx.author in votes:
-            await game_channel.send("You have already voted!")
-            return
-        await cast_vote(ctx, 'nein')
-    
-    if game_state == AGENDA_VETOED:
-        if ctx.author != current_president:
-            await game_channel.send(f"Only the President can confirm or reject a veto.")
-            return
-        await game_channel.send(f"The President **{get_player_name(current_president)}** has voted **against** a veto of this policy agenda!"
-                    f"\nThe current chancellor **{get_player_name(current_chancellor)}** must **!enact** a policy!.")
-        game_state = CHANCELLOR_LEGISLATION
-    
-async def cast_vote(ctx, vote):
-    global votes
-    # Record the vote
-    votes[ctx.author] = vote
-
-    # Check if all players have voted
-    votes_needed = len(players) - 2 # minus chancellor and president
-    voted_players = len(votes)
-
-    if voted_players != votes_needed:
-        await game_channel.send(f"votes: ({voted_players}/{votes_needed})")
-    if voted_players == votes_needed:
-        # Tally votes
-        ja_votes = sum(1 for vote in votes.values() if vote.lower() == 'ja')
-        nein_votes = votes_needed - ja_votes
-        message = (f"- Ja!: {ja_votes} votes\n- Nein!: {nein_votes} votes")
-        if ja_votes > nein_votes:
-            await election_success(message)
-        else:
-            await election_failed(message)
-        # Reset the votes for the next round
-        votes = {}
-
-async def election_success(message):
-    global role_assignments, fascist_policies, current_president, top_cards, game_state, policy_cards
-    if role_assignments[current_chancellor] == HITLER and fascist_policies >= 3:
-        message += "\n\n**GAME OVER, HITLER WAS ELECTED CHANCELLOR! FASCISTS WIN!**"
-        await game_over(message, HITLER_CHANCELLOR_IMG)
-        return
-    top_cards = policy_cards[:min(3, len(policy_cards))]
-    policy_cards = policy_cards[min(3, len(policy_cards)):]
-    message += (
-        f"\nThe vote **passed**!"
-        f"\n**{get_player_name(current_president)}** is your **President** and **{get_player_name(current_chancellor)}** is your **Chancellor**!"
-        f"\nDrawing the top 3 policy cards and sending them to President **{get_player_name(current_president)}** for review..."
-        f"\nPresident **{get_player_name(current_president)}** must **!discard** one policy before Chancellor **{get_player_name(current_chancellor)}** will **!enact** one."
-        )
-    await print_game_dashboard(None, message)
-    president_message = (
-        "As President, you will select 1 of the top policies to be discarded before the Chancellor has a chance to enact one of the policies."
-        "\nDiscard one card using **!discard 1** or **!discard 2** or **!discard 3** to select."
-    )
-    await send_top_cards_img(current_president, president_message)
-    game_state = PRESIDENTIAL_LEGISLATION
-
-async def election_failed(message):
-    global current_president, policy_cards, game_state, failed_election_count
-    enact_top_policy_msg = ''
-    failed_election_count += 1
-    if failed_election_count == 3:
-        top_policy = policy_cards[0]
-        enact_top_policy()
-        enact_top_policy_msg = f"This is the 3rd failed election so the **{top_policy}** policy on the top of the draw pile has been **enacted**."
-        failed_election_count = 0
-    current_president = get_next_president()
-    message += (
-        f"\nThe vote **failed**! {enact_top_policy_msg}"
-        f"Choosing new candidates..."
-        f"\n**{get_player_name(current_president)}** has been chosen as the new Presidential Candidate."
-        f"\n**{get_player_name(current_president)}** you must **!nominate** a Chancellor then the group will vote again."
-        )
-    await print_game_dashboard(None, message)
-    game_state = NOMINATE_CHANCELLOR
+    session = get_session(ctx)
+    events = await run_action(session, ('nein', ctx.author))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def veto(ctx):
     """Allows the Chancellor to veto a policy agenda."""
-    global game_state, current_president
-
-    if fascist_policies != 5:
-        await game_channel.send("Veto power is not yet unlocked. You must enact 5 Fascist policies.")
-        return
-    if ctx.author != current_chancellor:
-        await game_channel.send(f"Only the Chancellor **{get_player_name(current_chancellor)}** can call a veto.")
-        return
-    if game_state == AGENDA_VETOED:
-        await game_channel.send(f"Waiting for veto confirmation from the president **{get_player_name(current_president)}**.")
-        return
-    if game_state != CHANCELLOR_LEGISLATION:
-        await game_channel.send("Veto is not allowed at this moment.")
-        return
-    
-    await game_channel.send(f"The Chancellor **{get_player_name(current_chancellor)}** has called a veto to this policy agenda!"
-                    f"\nThe president **{get_player_name(current_president)}** must either **!veto ja** or **!veto nein** to accept or block the veto.")
-    game_state = AGENDA_VETOED
+    session = get_session(ctx)
+    events = await run_action(session, ('veto', ctx.author))
+    if events:
+        await announce(session, events)
     
 @bot.command()
 @is_player()
 @is_game_channel_or_bot_itself()
 async def discard(ctx, card: str):
     """Allows President to discard a policy."""
-    global top_cards, game_state, current_chancellor, current_president
-    
-    if game_state != PRESIDENTIAL_LEGISLATION:
-        await game_channel.send("You cannot discard any policies at this time.")
-        return
-    
-    if ctx.author != current_president:
-        await game_channel.send("Only the president can discard a policy.")
-        return
-    
-    if card != '1' and card != '2' and card != '3':
-        await game_channel.send("Invalid card number.")
-        return
-    
-    cardNum = int(card)
-    
-    if cardNum > len(top_cards):
-        await game_channel.send("Invalid card number.")
-        return
-    
-    discarded_policies.append(top_cards.pop(cardNum-1))
-    await game_channel.send(f"Your President **{get_player_name(current_president)}** has chosen a policy to **discard**.\nIt's time for your Chancellor **{get_player_name(current_chancellor)}** to **!enact** a policy!")
-    game_state = CHANCELLOR_LEGISLATION
-    chancellor_message = (
-        "As Chancellor, you will select one of the two policies left for you by the President to enact."
-        "\nEnact one card using **!enact 1** or **!enact 2** to select"
-    )
-    await send_top_cards_img(current_chancellor, chancellor_message)
+    session = get_session(ctx)
+    events = await run_action(session, ('discard', ctx.author, get_card_number(card)))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel_or_bot_itself()
 async def enact(ctx, card=None):
     """Allows Chancellor to enact a policy."""
-    global top_cards, game_state, current_chancellor, current_president, previous_president, fascist_policies, liberal_policies
-    
-    if game_state != CHANCELLOR_LEGISLATION:
-        await game_channel.send("You cannot enact any policies at this time.")
-        return
-    
-    if ctx.author != current_chancellor:
-        await game_channel.send("Only the Chancellor can enact a policy.")
-        return
-    
-    if card not in {'1', '2'}:
-        await game_channel.send("Invalid card number.")
-        return
-
-    cardNum = int(card)
-    if cardNum > len(top_cards):
-        await game_channel.send("Invalid card number.")
-        return
-    policy = get_enacted_policy_and_discard(cardNum)
-    message = (
-        f"Your Chancellor **{get_player_name(current_chancellor)}** has chosen to enact a **{policy}** policy!"
-    )
-
-    if fascist_policies == 6:
-        await game_channel.send(message)
-        await game_over("**GAME OVER, 6 FASCIST POLICIES WERE ENACTED! FASCISTS WIN!**", get_fascist_board_img_file())
-        return
-    if liberal_policies == 5:
-        await game_channel.send(message)
-        await game_over("**GAME OVER, 5 LIBERAL POLICIES WERE ENACTED! LIBERALS WIN!**", get_liberal_board_img_file())
-        return
-    
-    newGameState = NOMINATE_CHANCELLOR
-    if policy == FASCIST:
-        newGameState, message = process_presidential_powers(message)
-    
-    reshuffle_msg = start_new_round()
-    if reshuffle_msg is not None:
-        message += f"\n{reshuffle_msg}"
-
-    if newGameState == EXECUTIVE_EXAMINATION:
-        message += (
-            f"\nSince 3 Fascist policies have been enacted, your President **{get_player_name(current_president)}** gets to view the top 3 cards on the draw pile!"
-        )
-        await examine_top_cards()
-        newGameState = NOMINATE_CHANCELLOR
-    if newGameState == NOMINATE_CHANCELLOR:
-        previous_president = current_president
-        current_president = get_next_president()
-        message += (
-            f"\nIt's time for a new election! **{get_player_name(current_president)}** will be nominated as new President!"
-            f"\n**{get_player_name(current_president)}** you must **!nominate** a Chancellor then the group will vote."
-        )
-    await print_game_dashboard(None, message)
-    game_state = newGameState
-
-def get_enacted_policy_and_discard(cardNum):
-    global top_cards, discarded_policies, fascist_policies, liberal_policies
-    policy = top_cards.pop(cardNum-1)
-    discarded_policies.extend(top_cards)
-    top_cards = []
-    if policy == FASCIST:
-        fascist_policies += 1
-    if policy == LIBERAL:
-        liberal_policies += 1
-    return policy
-
-def process_presidential_powers(message):
-    global fascist_policies, game_mode, current_president
-    if (fascist_policies == 2 and game_mode == SEVEN_EIGHT_PLAYER_GAME_MODE) or (fascist_policies in [1,2] and game_mode == NINE_TEN_PLAYER_GAME_MODE):
-        message += (
-            f"\nSince 2 Fascist policies have been enacted, your President **{get_player_name(current_president)}** gets to investigate one player's party membership!"
-            f"\n**{get_player_name(current_president)}** please choose a player to investigate using **!investigate [player_name]** (Ex. !investigate bob)"
-            )
-        return EXECUTIVE_INVESTIGATION, message
-    elif fascist_policies == 3 and game_mode in [SEVEN_EIGHT_PLAYER_GAME_MODE, NINE_TEN_PLAYER_GAME_MODE]:
-        message += (
-            f"\nSince 3 Fascist policies have been enacted, your President **{get_player_name(current_president)}** gets to appoint the next president!"
-            f"\n**{get_player_name(current_president)}** please choose a player to appoint to president using **!appoint [player_name]** (Ex. !appoint bob)"
-            )
-        return EXECUTIVE_APPOINTMENT, message
-    elif fascist_policies == 3 and game_mode == FIVE_SIX_PLAYER_GAME_MODE:
-        return EXECUTIVE_EXAMINATION, message
-    elif fascist_policies == 4:
-        message += (
-            f"\nSince 4 Fascist policies have been enacted, your President **{get_player_name(current_president)}** gets to assassinate another player!"
-            f"\n**{get_player_name(current_president)}** please choose a player to assassinate using **!kill [player_name]** (Ex. !kill bob)"
-            )
-        return EXECUTIVE_KILL, message
-    elif fascist_policies == 5:
-        message += (
-            f"\nSince 5 Fascist policies have been enacted, your President **{get_player_name(current_president)}** gets to assassinate another player and **!veto** power is unlocked!"
-            f"\nWhen choosing a policy, the **Chancellor** may **!veto** the policy agenda. If the **President** agrees, no policy is enacted."
-            f"\n**{get_player_name(current_president)}** please choose a player to assassinate using **!kill [player_name]** (Ex. !kill bob)"
-            )
-        return EXECUTIVE_KILL, message
-    else:
-        return NOMINATE_CHANCELLOR, message
+    session = get_session(ctx)
+    events = await run_action(session, ('enact', ctx.author, get_card_number(card)))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def investigate(ctx, suspect_name: str):
     """Allows the President to investigate a party member."""
-    global role_assignments, game_state, current_chancellor, current_president, previous_president, game_channel
-
-    # Check if the game state is in the nomination phase
-    if game_state != EXECUTIVE_INVESTIGATION:
-        await game_channel.send("Investigation is not allowed at this moment.")
-        return
-    
-    if ctx.author != current_president:
-        await game_channel.send("Only the President can nominate the Chancellor.")
-        return
-    
-    suspect = get_player_by_name(suspect_name)
-    if suspect is None:
-        await game_channel.send("Could not find that player, try again.")
-        return
-    
-    await ctx.author.send(
-        f"**{get_player_name(suspect)}** is part of the **{role_assignments[suspect]}** party"
-    )
-    previous_president = current_president
-    current_president = get_next_president()
-    messageAfter = f"**{get_player_name(ctx.author)}** has investigated which party **{suspect_name}** is truly loyal to."
-    reshuffle_msg = start_new_round()
-    if reshuffle_msg is not None:
-        messageAfter += f"\n\n{reshuffle_msg}"
-    messageAfter = (
-        f"\n\n It's time for a new election! **{get_player_name(current_president)}** will be nominated as new President!"
-        f"\n**{get_player_name(current_president)}** you must **!nominate** a Chancellor then the group will vote."
-    )
-    await print_game_dashboard(None, messageAfter)
-    game_state = NOMINATE_CHANCELLOR
+    session = get_session(ctx)
+    events = await run_action(session, ('investigate', ctx.author, get_player_by_name(session, suspect_name)))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def appoint(ctx, appointed_name: str):
     """Allows the President to appoint a party member."""
-    global game_state, current_president, previous_president, game_channel
-
-    # Check if the game state is in the nomination phase
-    if game_state != EXECUTIVE_APPOINTMENT:
-        await game_channel.send("Appointment is not allowed at this moment.")
-        return
-    
-    if ctx.author != current_president:
-        await game_channel.send("Only the President can appoint the next president.")
-        return
-    
-    appointed_president = get_player_by_name(appointed_name)
-    if appointed_president is None:
-        await game_channel.send("Could not find that player, try again.")
-        return
-  
-    if appointed_president == current_president:
-        await game_channel.send("You can't appoint yourself, choose somebody else.")
-        return
-    
-    previous_president = current_president
-    current_president = appointed_president
-    messageAfter = f"**{get_player_name(previous_president)}** has appointed **{get_player_name(appointed_president)}** as the next president!"
-    reshuffle_msg = start_new_round()
-    if reshuffle_msg is not None:
-        messageAfter += f"\n\n{reshuffle_msg}"
-    messageAfter += (
-        f"\n\n It's time for a new election! **{get_player_name(appointed_president)}** will be nominated as new President!"
-        f"\n**{get_player_name(appointed_president)}** you must **!nominate** a Chancellor then the group will vote."
-    )
-    await print_game_dashboard(None, messageAfter)
-    game_state = NOMINATE_CHANCELLOR
+    session = get_session(ctx)
+    events = await run_action(session, ('appoint', ctx.author, get_player_by_name(session, appointed_name)))
+    if events:
+        await announce(session, events)
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def kill(ctx, targetName: str):
     """Allows the President to kill a party member."""
-    global game_state, current_president, previous_president, players, game_channel
+    session = get_session(ctx)
+    events = await run_action(session, ('kill', ctx.author, get_player_by_name(session, targetName)))
+    if events:
+        await announce(session, events)
+
+async def run_action(session, action):
+    """Applies a player's action to their game, returning the events it caused.
+
+    Returns None after telling the player why if the rules don't allow it.
+    """
+    vetoed = session.game_state == AGENDA_VETOED
+    began = time.perf_counter()
+    try:
+        with tracing.span('apply', action=action[0]):
+            _, events = engine.apply(session, action)
+    except InvalidAction as e:
+        await session.outbox.send(str(e).format(
+            president=get_player_name(session.current_president) if session.current_president else '',
+            chancellor=get_player_name(session.current_chancellor) if session.current_chancellor else '',
+        ))
+        return None
+    OPERATION_SECONDS.observe(time.perf_counter() - began, operation='apply')
+    record_action(session, action, events, vetoed)
+    for event in events:
+        if event[0] == 'joined':
+            session.registry.add(event[1])
+        elif event[0] in ('left', 'killed'):
+            session.registry.remove(event[-1])
+    schedule_turn(session)
+    return events
+
+def get_card_number(card):
+    """The card a player picked with !discard or !enact, or None if it isn't a card number."""
+    return int(card) if card in {'1', '2', '3'} else None
+
+@metrics.timed(OPERATION_SECONDS, operation='announce')
+@tracing.traced('announce')
+async def announce(session, events):
+    """Tells the players what happened, from the events an action caused.
+
+    The messages are built before anything is sent, so they describe the game as the action left it.
+    """
+    images = []
+    message = ''
+    dashboard = False
+    dms = []  # (player, cards, text)
+    ending = None
+    for event in events:
+        kind = event[0]
+        if kind == 'joined':
+            message = f"**{get_player_name(event[1])}** has joined the game! ({len(session.players)}/10 players)"
+        elif kind == 'left':
+            message = f"**{get_player_name(event[1])}** has left the lobby. ({len(session.players)}/8 players)"
+        elif kind == 'ready':
+            images.append(SECRET_HITLER_LOGO_ASSET)
+            message = get_intro_screen()
+        elif kind == 'started':
+            _, _, num_liberals, num_fascists, candidate = event
+            dashboard = True
+            message = (
+                f"The game has started! There will be **{num_liberals} Liberals** and **{num_fascists} Fascists** with **1 Secret Hitler**."
+                f"\nYour first Presidential Candidate has been randomly selected as **{get_player_name(candidate)}**!"
+                f"\n**{get_player_name(candidate)}** you must **!nominate** a Chancellor then the group will vote."
+                )
+        elif kind == 'nominated':
+            message = f"President **{get_player_name(event[1])}** has nominated **{get_player_name(event[2])}** as Chancellor, everyone vote **!ja** or **!nein**."
+        elif kind == 'voted':
+            # Not awaited, so the next vote in the game's inbox can replace it while it waits for the rate limit
+            session.outbox.post(f"votes: ({event[2]}/{event[3]})", coalesce_key='votes')
+            return
+        elif kind == 'election_passed':
+            _, ja_votes, nein_votes, president, chancellor = event
+            session.outbox.discard('votes')
+            dashboard = True
+            message = f"- Ja!: {ja_votes} votes\n- Nein!: {nein_votes} votes"
+            if session.game_state == PRESIDENTIAL_LEGISLATION:
+                message += (
+                    f"\nThe vote **passed**!"
+                    f"\n**{get_player_name(president)}** is your **President** and **{get_player_name(chancellor)}** is your **Chancellor**!"
+                    f"\nDrawing the top 3 policy cards and sending them to President **{get_player_name(president)}** for review..."
+                    f"\nPresident **{get_player_name(president)}** must **!discard** one policy before Chancellor **{get_player_name(chancellor)}** will **!enact** one."
+                    )
+                dms.append((president, list(session.top_cards), (
+                    "As President, you will select 1 of the top policies to be discarded before the Chancellor has a chance to enact one of the policies."
+                    "\nDiscard one card using **!discard 1** or **!discard 2** or **!discard 3** to select."
+                    + get_dm_command_note(session)
+                )))
+        elif kind == 'election_failed':
+            _, ja_votes, nein_votes, top_policy, president = event
+            session.outbox.discard('votes')
+            dashboard = True
+            enact_top_policy_msg = ''
+            if top_policy is not None:
+                enact_top_policy_msg = f"This is the 3rd failed election so the **{top_policy}** policy on the top of the draw pile has been **enacted**."
+            message = (
+                f"- Ja!: {ja_votes} votes\n- Nein!: {nein_votes} votes"
+                f"\nThe vote **failed**! {enact_top_policy_msg}"
+                f"Choosing new candidates..."
+                f"\n**{get_player_name(president)}** has been chosen as the new Presidential Candidate."
+                f"\n**{get_player_name(president)}** you must **!nominate** a Chancellor then the group will vote again."
+                )
+        elif kind == 'veto_called':
+            message = (f"The Chancellor **{get_player_name(event[1])}** has called a veto to this policy agenda!"
+                       f"\nThe president **{get_player_name(event[2])}** must either **!veto ja** or **!veto nein** to accept or block the veto.")
+        elif kind == 'veto_accepted':
+            dashboard = True
+            message = (
+                f"The President **{get_player_name(event[1])}** has voted in **favor** of a veto to this policy agenda!"
+                f"\nThe policies will all be discarded and this will be considered an election failure."
+                )
+        elif kind == 'veto_rejected':
+            message = (f"The President **{get_player_name(event[1])}** has voted **against** a veto of this policy agenda!"
+                       f"\nThe current chancellor **{get_player_name(event[2])}** must **!enact** a policy!.")
+        elif kind == 'discarded':
+            _, president, chancellor = event
+            message = f"Your President **{get_player_name(president)}** has chosen a policy to **discard**.\nIt's time for your Chancellor **{get_player_name(chancellor)}** to **!enact** a policy!"
+            dms.append((chancellor, list(session.top_cards), (
+                "As Chancellor, you will select one of the two policies left for you by the President to enact."
+                "\nEnact one card using **!enact 1** or **!enact 2** to select"
+                + get_dm_command_note(session)
+            )))
+        elif kind == 'enacted':
+            dashboard = True
+            message = f"Your Chancellor **{get_player_name(event[1])}** has chosen to enact a **{event[2]}** policy!"
+        elif kind == 'power':
+            message += get_presidential_power_message(session, event[1], event[2])
+        elif kind == 'examined':
+            _, president, cards = event
+            message += f"\nSince 3 Fascist policies have been enacted, your President **{get_player_name(president)}** gets to view the top 3 cards on the draw pile!"
+            dms.append((president, cards, "As an executive power, you get to view the top 3 policies in the draw deck. Here they are!"))
+        elif kind == 'investigated':
+            _, president, suspect, party = event
+            dashboard = True
+            message = f"**{get_player_name(president)}** has investigated which party **{get_player_name(suspect)}** is truly loyal to."
+            dms.append((president, None, f"**{get_player_name(suspect)}** is part of the **{party}** party"))
+        elif kind == 'appointed':
+            dashboard = True
+            message = f"**{get_player_name(event[1])}** has appointed **{get_player_name(event[2])}** as the next president!"
+        elif kind == 'killed':
+            dashboard = True
+            message = f"**{get_player_name(event[2])}** has been assassinated in cold blood! Oh dear!"
+        elif kind == 'reshuffled':
+            message += f"\n\nRan out of policy cards. Adding back all discarded policies and shuffling the deck..."
+        elif kind == 'new_president':
+            message += (
+                f"\nIt's time for a new election! **{get_player_name(event[1])}** will be nominated as new President!"
+                f"\n**{get_player_name(event[1])}** you must **!nominate** a Chancellor then the group will vote."
+            )
+        elif kind == 'game_over':
+            ending = GAME_OVER_MESSAGES[event[2]]
 
-    if game_state != EXECUTIVE_KILL:
-        await game_channel.send("Killing is not allowed at this moment.")
-        return
-    
-    if ctx.author != current_president:
-        await game_channel.send("Only the President can kill.")
-        return
-    
-    victim = get_player_by_name(targetName)
-    if victim is None:
-        await game_channel.send("Could not find that player, try again.")
+    if ending is not None:
+        text, asset = ending
+        await game_over(session, f"{message}\n\n{text}" if message else text, asset(session) if callable(asset) else asset)
         return
-    
-    players.remove(victim)
-    assassinated.append(victim)
-    if role_assignments[victim] == HITLER:
-        await game_over("**GAME OVER, HITLER HAS BEEN ASSASSINATED! LIBERALS WIN!**", HITLER_ASSASSINATED_IMG)
-        return
-    messageAfter = f"**{get_player_name(victim)}** has been assassinated in cold blood! Oh dear!"
-    reshuffle_msg = start_new_round()
-    if reshuffle_msg is not None:
-        messageAfter += f"\n\n{reshuffle_msg}"
-    previous_president = current_president
-    current_president = get_next_president()
-    messageAfter += (
-        f"\nIt's time for a new election! **{get_player_name(current_president)}** will be nominated as new President!"
-        f"\n**{get_player_name(current_president)}** you must **!nominate** a Chancellor then the group will vote."
-    )
-    await print_game_dashboard(None, messageAfter)
-    game_state = NOMINATE_CHANCELLOR
+    sends = [send_private_message(session, player, cards, text) for player, cards, text in dms]
+    for asset in images:
+        await send_image(session.outbox, asset)
+    if dashboard:
+        sends.append(print_game_dashboard(session, None, message))
+    elif message:
+        sends.append(session.outbox.send(message))
+    await asyncio.gather(*sends)
+
+def get_presidential_power_message(session, power, president):
+    name = get_player_name(president)
+    if power == EXECUTIVE_INVESTIGATION:
+        return (
+            f"\nSince 2 Fascist policies have been enacted, your President **{name}** gets to investigate one player's party membership!"
+            f"\n**{name}** please choose a player to investigate using **!investigate [player_name]** (Ex. !investigate bob)"
+            )
+    elif power == EXECUTIVE_APPOINTMENT:
+        return (
+            f"\nSince 3 Fascist policies have been enacted, your President **{name}** gets to appoint the next president!"
+            f"\n**{name}** please choose a player to appoint to president using **!appoint [player_name]** (Ex. !appoint bob)"
+            )
+    elif power == EXECUTIVE_KILL and session.fascist_policies == 5:
+        return (
+            f"\nSince 5 Fascist policies have been enacted, your President **{name}** gets to assassinate another player and **!veto** power is unlocked!"
+            f"\nWhen choosing a policy, the **Chancellor** may **!veto** the policy agenda. If the **President** agrees, no policy is enacted."
+            f"\n**{name}** please choose a player to assassinate using **!kill [player_name]** (Ex. !kill bob)"
+            )
+    elif power == EXECUTIVE_KILL:
+        return (
+            f"\nSince 4 Fascist policies have been enacted, your President **{name}** gets to assassinate another player!"
+            f"\n**{name}** please choose a player to assassinate using **!kill [player_name]** (Ex. !kill bob)"
+            )
+    return ''
+
+# Game over reason -> message and image, or a function of the session returning the image
+GAME_OVER_MESSAGES = {
+    'hitler_elected': ("**GAME OVER, HITLER WAS ELECTED CHANCELLOR! FASCISTS WIN!**", HITLER_CHANCELLOR_ASSET),
+    'fascist_policies': ("**GAME OVER, 6 FASCIST POLICIES WERE ENACTED! FASCISTS WIN!**", lambda session: get_fascist_board_asset(session)),
+    'liberal_policies': ("**GAME OVER, 5 LIBERAL POLICIES WERE ENACTED! LIBERALS WIN!**", lambda session: get_liberal_board_asset(session)),
+    'hitler_assassinated': ("**GAME OVER, HITLER HAS BEEN ASSASSINATED! LIBERALS WIN!**", HITLER_ASSASSINATED_ASSET),
+}
     
 @bot.command()
 @is_game_channel()
 async def lobby(ctx):
     """Displays the members in the lobby."""
-    global players
-    if game_state == GAME_NOT_STARTED:
-        if players:
+    session = get_session(ctx)
+    if session is None:
+        await ctx.send("No players are currently in the lobby.")
+    elif session.game_state == GAME_NOT_STARTED:
+        if session.players:
             message = (f"**Players waiting in lobby:**")
-            for player in players:
+            for player in session.players:
                 message += (f"\n- {get_player_name(player)}")
         else:
             message = "No players are currently in the lobby."
-        await game_channel.send(message)
+        await session.outbox.send(message)
     else:
-        await game_channel.send("Match is in progress.")
+        await session.outbox.send("Match is in progress.")
 
 @bot.command()
 @is_player()
 @is_game_channel()
 async def reset(ctx):
     """Resets the game to allow a new round."""
-    reset_game()
-    await game_channel.send("The game has been reset. Players can now join a new round!")
-
-def get_player_by_name(player_name):
-    # Find the player with the given name
-    for player in players:
-        if player.name == player_name:
-            return player
-    return None  # Return None if no player with that name is found
-
-def get_next_player(current_player):
-    global players
-    current_index = players.index(current_player)
-    next_index = (current_index + 1) % len(players)
-    return players[next_index]
-
-def get_next_president():
-    global current_chancellor
-    current_chancellor = None
-    next_president = get_next_player(current_president)
-    if next_president == previous_president:
-        next_president = get_next_player(next_president)
-    return next_president
-
-async def print_game_dashboard(msgBefore=None, msgAfter=None):
-    global players, assassinated, liberal_policies, fascist_policies, previous_president, policy_cards, discarded_policies
+    session = get_session(ctx)
+    record_event(session, 'reset', player=ctx.author.id)
+    reset_game(session)
+    await session.outbox.send("The game has been reset. Players can now join a new round!")
+
+@bot.command(name='stats')
+@is_game_channel()
+async def show_stats(ctx, *, player_name=None):
+    """Shows the statistics of a player, or of the author if no player is given."""
+    destination = get_reply_destination(ctx)
+    player_id = find_stats_player(get_session(ctx), player_name) if player_name else ctx.author.id
+    totals = stats.get_player_stats(game_store, player_id) if player_id is not None and game_store is not None else None
+    if totals is None:
+        who = f"**{escape_name(player_name)}**" if player_name else "you"
+        await destination.send(f"No finished games found for {who}.")
+        return
+    await destination.send(get_stats_message(totals, stats.get_recent_games(game_store, player_id)))
+
+@bot.command()
+@is_game_channel()
+async def leaderboard(ctx):
+    """Shows the players with the most wins."""
+    destination = get_reply_destination(ctx)
+    rows = stats.get_leaderboard(game_store) if game_store is not None else []
+    if not rows:
+        await destination.send("No games have been finished yet.")
+        return
+    message = "**Leaderboard:**"
+    for rank, (_, name, games, wins) in enumerate(rows, 1):
+        message += f"\n{rank}. {escape_name(name)}: {wins} wins in {games} games ({get_percentage(wins, games)})"
+    await destination.send(message)
+
+def find_stats_player(session, player_name):
+    """The ID of a player by @mention, by the name they last finished a game with, or by name in the current game."""
+    mention = MENTION_PATTERN.fullmatch(player_name.strip())
+    if mention:
+        return int(mention.group(1))
+    player_id = stats.find_player(game_store, player_name.strip().lstrip('@'))
+    if player_id is None and session is not None:
+        player = get_player_by_name(session, player_name)
+        player_id = player.id if player is not None else None
+    return player_id
+
+def get_stats_message(totals, recent_games):
+    message = f"**Statistics for {escape_name(totals['name'])}:**"
+    message += f"\nWon {totals['wins']} of {totals['games']} games ({get_percentage(totals['wins'], totals['games'])})"
+    for role, prefix in stats.ROLES.items():
+        message += f"\n- {role}: won {totals[prefix + '_wins']} of {totals[prefix + '_games']}"
+    message += (f"\nPresident {totals['presidencies']} times, Chancellor {totals['chancellorships']} times, "
+                f"enacted {totals['liberal_enacted']} liberal and {totals['fascist_enacted']} fascist policies.")
+    message += f"\nInvestigated {totals['investigations']}, killed {totals['kills']}, vetoed {totals['vetoes']}, assassinated in {totals['killed']} games."
+    if recent_games:
+        message += "\n\n**Last games:**"
+        for _, role, won, reason in recent_games:
+            message += f"\n- {'Won' if won else 'Lost'} as {role} ({stats.WIN_CONDITIONS.get(reason, reason)})"
+    return message
+
+def get_percentage(part, whole):
+    return f"{part / whole:.0%}" if whole else "0%"
+
+def get_player_by_name(session, player_name):
+    """Finds a player still in the game by @mention or name, or returns None."""
+    return session.registry.find(player_name)
+
+def get_normalized_names(player):
+    """The player's username and display names, normalized for lookups."""
+    names = (player.name, getattr(player, 'display_name', None), getattr(player, 'global_name', None))
+    return {normalize_name(name) for name in names if isinstance(name, str)}
+
+def normalize_name(name):
+    return name.strip().lstrip('@').casefold()
+
+@metrics.timed(OPERATION_SECONDS, operation='dashboard')
+@tracing.traced('dashboard')
+async def print_game_dashboard(session, msgBefore=None, msgAfter=None):
     message = (f"**Players**")
-    for player in players:
+    for player in session.players:
         message += f"\n- {get_player_name(player)}"
-        if player == current_president:
+        if player == session.current_president:
             message += " **(President)**"
-        if player == current_chancellor:
+        if player == session.current_chancellor:
             message += " **(Chancellor)**"
-        if player == previous_president and (liberal_policies + fascist_policies) > 0:
+        if player == session.previous_president and (session.liberal_policies + session.fascist_policies) > 0:
             message += " (Previous President)"
-    for player in assassinated:
+    for player in session.assassinated:
         message += f"\n- {get_player_name(player)} (Assassinated)"
     message += (
         f"\n\n**Policy Deck** <:{LIBERAL_CARD_EMOJI_NAME}:{LIBERAL_CARD_EMOJI_ID}><:{FASCIST_CARD_EMOJI_NAME}:{FASCIST_CARD_EMOJI_ID}>"
-        f"\n- Draw Pile: {len(policy_cards)} Cards"
-        f"\n- Discard Pile: {len(discarded_policies)}"
+        f"\n- Draw Pile: {session.deck.drawable} Cards"
+        f"\n- Discard Pile: {session.deck.discarded}"
         )
+    boards = [get_liberal_board_asset(session), get_fascist_board_asset(session)]
+    if DASHBOARD_MODE == 'live':
+        # Only the narrative is posted, the players, deck and boards are kept up to date in the pinned message
+        if msgBefore:
+            await session.outbox.send(msgBefore)
+        await update_live_dashboard(session, message, boards)
+        if msgAfter:
+            await session.outbox.send("**Game Updates**\n" + msgAfter)
+        return
+    if DASHBOARD_MODE == 'single':
+        # One message with the text above both boards, in a fixed order
+        single_message = "\n\n".join(part for part in [msgBefore, message, msgAfter and "**Game Updates**\n" + msgAfter] if part)
+        if len(single_message) <= DISCORD_MESSAGE_LIMIT:
+            await send_images(session.outbox, boards, single_message)
+            return
     if msgBefore:
-        await game_channel.send(msgBefore)
-    await game_channel.send(message)
+        await session.outbox.send(msgBefore)
+    await session.outbox.send(message)
     tasks = [
-        game_channel.send(file=discord.File(get_liberal_board_img_file())), 
-        game_channel.send(file=discord.File(get_fascist_board_img_file()))
+        send_image(session.outbox, boards[0]),
+        send_image(session.outbox, boards[1])
         ]
     await asyncio.gather(*tasks)
     if msgAfter:
-        await game_channel.send("\n**Game Updates**\n" + msgAfter)
+        await session.outbox.send("\n**Game Updates**\n" + msgAfter)
+
+async def update_live_dashboard(session, message, boards):
+    """Posts and pins the game's dashboard the first time, then edits it in place whenever what it shows changes.
+
+    A dashboard with no room left for a board it must upload is replaced by a new pinned one, and the old one is
+    unpinned but kept, so the boards uploaded to it keep their cached URLs for later games.
+    """
+    async with session.dashboard_lock:
+        dashboard_hash = hash((message, tuple(get_asset_name(board) for board in boards)))
+        if dashboard_hash == session.dashboard_hash:
+            return
+        previous = session.dashboard_message
+        if previous is not None:
+            try:
+                edited = await edit_images(session.outbox, previous, boards, message)
+            except discord.NotFound:
+                edited = previous = None  # Deleted by someone, post a new one
+            if edited is not None:
+                session.dashboard_message = edited
+                session.dashboard_hash = dashboard_hash
+                return
+        session.dashboard_message = await send_images(session.outbox, boards, message)
+        session.dashboard_hash = dashboard_hash
+        await set_pinned(session.dashboard_message, True)
+        if previous is not None:
+            await set_pinned(previous, False)
+
+async def set_pinned(message, pinned):
+    """Pins or unpins a message, which needs the Manage Messages permission. The game goes on without it."""
+    count_api_call('pin')
+    try:
+        await (message.pin() if pinned else message.unpin())
+    except discord.HTTPException as error:
+        logger.warning(f"Could not {'pin' if pinned else 'unpin'} the dashboard in channel {message.channel.id}: {error}")
 
 def get_intro_screen():
     message = (
@@ -868,127 +1191,803 @@ def get_intro_screen():
     )
     return message
 
-async def send_roles_to_players():
-    global role_assignments, players
-    # Send roles to players
-    for player, role in role_assignments.items():
-        if role == LIBERAL:
-            await player.send(file=discord.File(LIBERAL_PARTY_CARD_IMG))
-        elif role == FASCIST:
-            other_fascists = [get_player_name(p) for p, r in role_assignments.items() if r == FASCIST and p.id != player.id]
-            hitler = [get_player_name(p) for p, r in role_assignments.items() if r == HITLER]
-            await player.send(file=discord.File(FASCIST_PARTY_CARD_IMG))
-            await player.send(f"Other Fascists: {', '.join(other_fascists)}\nHitler: {', '.join(hitler)}")
-        elif role == HITLER:
-            fascists = [get_player_name(p) for p, r in role_assignments.items() if r == FASCIST]
-            await player.send(file=discord.File(HITLER_CARD_IMG))
-            if len(players) < 7:
-                await player.send(f"Other Fascists: {', '.join(fascists)}")
-
-def enact_top_policy():
-    global policy_cards, fascist_policies, liberal_policies
-    top_policy = policy_cards.pop(0)
-    discarded_policies.append(top_policy)
-    if top_policy == FASCIST:
-        fascist_policies += 1
+@metrics.timed(OPERATION_SECONDS, operation='roles')
+@tracing.traced('roles')
+async def send_roles_to_players(session):
+    """Sends every player their role at once, at most ROLE_DM_CONCURRENCY at a time.
+
+    Returns player -> whether their role was delivered.
+    """
+    semaphore = asyncio.Semaphore(ROLE_DM_CONCURRENCY)
+    players = list(session.role_assignments)
+    results = await asyncio.gather(*(send_role_to_player(session, player, semaphore) for player in players))
+    return dict(zip(players, results))
+
+def get_role_messages(session, player):
+    """The DMs that reveal a player's role, as (image asset, text) pairs."""
+    role = session.role_assignments[player]
+    if role == LIBERAL:
+        return [(LIBERAL_PARTY_CARD_ASSET, None)]
+    elif role == FASCIST:
+        other_fascists = [get_player_name(p) for p, r in session.role_assignments.items() if r == FASCIST and p.id != player.id]
+        hitler = [get_player_name(p) for p, r in session.role_assignments.items() if r == HITLER]
+        return [(FASCIST_PARTY_CARD_ASSET, None), (None, f"Other Fascists: {', '.join(other_fascists)}\nHitler: {', '.join(hitler)}")]
+    elif len(session.players) < 7:
+        fascists = [get_player_name(p) for p, r in session.role_assignments.items() if r == FASCIST]
+        return [(HITLER_CARD_ASSET, None), (None, f"Other Fascists: {', '.join(fascists)}")]
+    return [(HITLER_CARD_ASSET, None)]
+
+async def send_role_to_player(session, player, semaphore):
+    """Sends a player's role DMs, retrying failures without repeating the ones already delivered."""
+    messages = get_role_messages(session, player)
+    delay = ROLE_DM_RETRY_DELAY
+    for attempt in range(1, ROLE_DM_ATTEMPTS + 1):
+        try:
+            async with semaphore:
+                dm_channel = await get_dm_channel(session, player)
+                while messages:
+                    asset, text = messages[0]
+                    if asset is not None:
+                        await send_image(dm_channel, asset, text)
+                    else:
+                        await dm_channel.send(text)
+                    messages.pop(0)
+            logger.info(f"Role delivered to {player.name} ({player.id}) after {attempt} attempt(s).")
+            return True
+        except discord.HTTPException as e:
+            logger.warning(f"Attempt {attempt} to send a role to {player.name} ({player.id}) failed: {e}")
+            if attempt < ROLE_DM_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay *= 2
+    logger.error(f"Could not deliver a role to {player.name} ({player.id}).")
+    return False
+
+async def send_private_message(session, player, cards, text):
+    """DMs a player, with an image of the policy cards if there are any, as one message."""
+    dm_channel = await get_dm_channel(session, player)
+    if cards:
+        await send_image(dm_channel, get_top_cards_asset(cards), text)
     else:
-        liberal_policies += 1
-    
-async def examine_top_cards():
-    global policy_cards
-    card_img_file = './images/cards/top_cards'
-    for card in policy_cards[:3]:
-        if card == FASCIST:
-            card_img_file += '_1'
-        else:
-            card_img_file += '_0'
-    card_img_file += '.jpg'
-    await current_president.send(file=discord.File(card_img_file))
-    await current_president.send("As an executive power, you get to view the top 3 policies in the draw deck. Here they are!")
-
-async def send_top_cards_img(player, msg):
-    global top_cards
-    card_img_file = './images/cards/top_cards'
-    for card in top_cards:
-        if card == FASCIST:
-            card_img_file += '_1'
+        await dm_channel.send(text)
+
+async def get_dm_channel(session, player):
+    """Returns the player's DM channel, opening it only the first time in a session."""
+    dm_channel = session.dm_channels.get(player.id)
+    if dm_channel is None:
+        dm_channel = player.dm_channel
+        if dm_channel is None:
+            count_api_call('open_dm')
+            with tracing.span('open_dm'):
+                dm_channel = await player.create_dm()
+        dm_channel = DirectMessages(dm_channel)
+        session.dm_channels[player.id] = dm_channel
+    return dm_channel
+
+async def open_dm_channels(session):
+    """Opens the DM channel of every player at once."""
+    results = await asyncio.gather(*(get_dm_channel(session, player) for player in session.players), return_exceptions=True)
+    for player, result in zip(session.players, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not open a DM channel with {player.name} ({player.id}): {result}")
+
+# Phases a game waits in for a player -> what they are asked to do, for reminders
+TURN_PROMPTS = {
+    NOMINATE_CHANCELLOR: "**!nominate** a Chancellor",
+    ELECTION: "vote **!ja** or **!nein**",
+    PRESIDENTIAL_LEGISLATION: "**!discard** a policy",
+    CHANCELLOR_LEGISLATION: "**!enact** a policy",
+    AGENDA_VETOED: "**!veto ja** or **!veto nein**",
+    EXECUTIVE_INVESTIGATION: "**!investigate** a player",
+    EXECUTIVE_APPOINTMENT: "**!appoint** the next President",
+    EXECUTIVE_KILL: "**!kill** a player",
+}
+
+def schedule_turn(session):
+    """Starts the deadline of the phase the game is in, unless it is still the phase the running deadline is for.
+
+    Every game's deadline sits on the shared turn_timers heap, so thousands of games cost a single event loop timer.
+    """
+    phase = session.game_state if TURN_TIMEOUT and session.game_state in TURN_PROMPTS else None
+    if phase == session.turn_phase:
+        return
+    cancel_turn(session)
+    if phase is None:
+        return
+    session.turn_phase = phase
+    if 0 < TURN_REMINDER < TURN_TIMEOUT:
+        session.turn_timer = turn_timers.call_later(TURN_TIMEOUT - TURN_REMINDER, on_turn_timer, session, True)
+    else:
+        session.turn_timer = turn_timers.call_later(TURN_TIMEOUT, on_turn_timer, session, False)
+
+def cancel_turn(session):
+    if session.turn_timer is not None:
+        session.turn_timer.cancel()
+    session.turn_timer = None
+    session.turn_phase = None
+
+def on_turn_timer(session, remind):
+    """Reminds the players the game is waiting for, or plays for them once the phase is out of time."""
+    if remind:
+        session.turn_timer = turn_timers.call_later(TURN_REMINDER, on_turn_timer, session, False)
+        run_in_background(remind_idle_players(session))
+    else:
+        session.turn_timer = None
+        run_in_background(session.inbox.run(play_idle_turn, session))
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def get_idle_players(session):
+    """The players the current phase is waiting for."""
+    if session.game_state == ELECTION:
+        return [player for player in session.players
+                if player not in session.votes and player not in (session.current_president, session.current_chancellor)]
+    if session.game_state == CHANCELLOR_LEGISLATION:
+        return [session.current_chancellor]
+    return [session.current_president]
+
+def get_idle_action(session):
+    """The next action played for an idle player: IDLE_VOTE for a missing vote, a rejected veto, and a random pick otherwise."""
+    president = session.current_president
+    others = [player for player in session.players if player != president]
+    if session.game_state == NOMINATE_CHANCELLOR:
+        return ('nominate', president, random.choice([player for player in others if player != session.previous_president]))
+    if session.game_state == ELECTION:
+        return (IDLE_VOTE, get_idle_players(session)[0])
+    if session.game_state == PRESIDENTIAL_LEGISLATION:
+        return ('discard', president, random.randint(1, len(session.top_cards)))
+    if session.game_state == CHANCELLOR_LEGISLATION:
+        return ('enact', session.current_chancellor, random.randint(1, len(session.top_cards)))
+    if session.game_state == AGENDA_VETOED:
+        return ('nein', president)
+    power = {EXECUTIVE_INVESTIGATION: 'investigate', EXECUTIVE_APPOINTMENT: 'appoint', EXECUTIVE_KILL: 'kill'}[session.game_state]
+    return (power, president, random.choice(others))
+
+async def remind_idle_players(session):
+    logs.current_fields.set({'channel': session.game_channel.id, 'game': session.game_id})
+    names = '**, **'.join(get_player_name(player) for player in get_idle_players(session))
+    await session.outbox.send(f"**{names}**, you have {TURN_REMINDER} seconds left to {TURN_PROMPTS[session.game_state]}!")
+
+async def play_idle_turn(session):
+    """Plays the current phase for the players who ran out of time, then saves the game like a command would."""
+    if session.turn_timer is not None or session.turn_phase != session.game_state:
+        return  # The phase ended or the game was reset while this waited in the game's inbox
+    with tracing.start_trace('turn_timeout', channel=session.game_channel.id, phase=GAME_STATE_NAMES[session.game_state]), \
+            logs.context(channel=session.game_channel.id, game=session.game_id):
+        idle = get_idle_players(session)
+        logger.info(f"Playing {GAME_STATE_NAMES[session.game_state]} for {', '.join(f'{player.name} ({player.id})' for player in idle)}, out of time.")
+        await session.outbox.send(f"Time's up! Playing for **{'**, **'.join(get_player_name(player) for player in idle)}**.")
+        # One action at a time, each idle player's. Once the phase moves on, schedule_turn() has started the next deadline.
+        while session.turn_timer is None and session.turn_phase == session.game_state:
+            events = await run_action(session, get_idle_action(session))
+            if not events:
+                break
+            await announce(session, events)
+        with tracing.span('save'):
+            save_session(session)
+
+def reset_game(session):
+    cancel_turn(session)
+    if session.dashboard_message is not None:
+        run_in_background(set_pinned(session.dashboard_message, False))
+    for player in session.players + session.assassinated:
+        if player_sessions.get(player.id) is session:
+            del player_sessions[player.id]
+    # Write the end of this game's event log before the session moves on to the next game
+    save_session(session)
+    if session.game_state == GAME_OVER:
+        record_stats(session)
+    session.reset()
+    save_session(session)
+
+def record_event(session, event_type, **data):
+    """Appends a state transition to the game's event log, which is written to game_store with the next snapshot.
+
+    Events hold what the command did and every RNG seed, so replay.py can rebuild the game from them.
+    """
+    session.events.append((session.game_id, session.event_seq, time.time(), event_type, data))
+    session.event_seq += 1
+
+# Action argument -> the key it is logged under
+LOGGED_ARGUMENTS = {
+    'nominate': 'chancellor',
+    'investigate': 'suspect',
+    'appoint': 'appointed',
+    'kill': 'victim',
+    'discard': 'card',
+    'enact': 'card',
+}
+
+def record_action(session, action, events, vetoed):
+    """Logs an action the engine accepted, and the seeds and results of what it caused."""
+    action_type, player, *args = action
+    data = {'player': player.id}
+    if action_type == 'join':
+        data['name'] = player.name
+    elif action_type in ('ja', 'nein'):
+        data['vote'] = action_type
+        action_type = 'veto_vote' if vetoed else 'vote'
+    elif action_type == 'start':
+        data['seed'] = events[0][1]
+    elif action_type in LOGGED_ARGUMENTS:
+        data[LOGGED_ARGUMENTS[action_type]] = args[0] if action_type in ('discard', 'enact') else args[0].id
+    record_event(session, action_type, **data)
+    for event in events:
+        if event[0] == 'reshuffled':
+            record_event(session, 'reshuffle', seed=event[1])
+        elif event[0] == 'game_over':
+            record_event(session, 'game_over', winner=event[1])
+
+def get_session_snapshot(session):
+    """The game state of a session as JSON-serializable data, with players stored by ID."""
+    def player_id(player):
+        return player.id if player is not None else None
+    return {
+        'game_state': session.game_state,
+        'players': [player.id for player in session.players],
+        'assassinated': [player.id for player in session.assassinated],
+        'role_assignments': [[player.id, role] for player, role in session.role_assignments.items()],
+        'votes': [[player.id, vote] for player, vote in session.votes.items()],
+        'liberal_policies': session.liberal_policies,
+        'fascist_policies': session.fascist_policies,
+        'policy_cards': session.deck.get_draw_pile(),
+        'discarded_policies': session.deck.get_discard_pile(),
+        'top_cards': session.top_cards,
+        'failed_election_count': session.failed_election_count,
+        'previous_president': player_id(session.previous_president),
+        'current_president': player_id(session.current_president),
+        'current_chancellor': player_id(session.current_chancellor),
+        'game_mode': session.game_mode,
+        'game_id': session.game_id,
+        'event_seq': session.event_seq,
+        'dashboard_message_id': session.dashboard_message.id if session.dashboard_message is not None else None,
+        'guild_id': get_guild_id(session.game_channel),
+    }
+
+def save_session(session):
+    """Writes the session's snapshot if it changed since the last write, or deletes it once the game is empty."""
+    if game_store is None:
+        return
+    began = time.perf_counter()
+    snapshot = get_session_snapshot(session)
+    snapshot_json = json.dumps(snapshot)
+    if snapshot_json == session.saved_snapshot and not session.events:
+        return
+    if session.game_state == GAME_NOT_STARTED and not session.players:
+        if session.saved_snapshot is None and not session.events:
+            return  # Never loaded or played in this process, so whatever is saved for the channel isn't this session's to delete
+        snapshot = None
+    try:
+        persistence.save_game(game_store, session.game_channel.id, snapshot, session.events)
+        session.saved_snapshot = snapshot_json
+        session.events = []
+    except Exception as e:
+        logger.error(f"Failed to save the game in channel {session.game_channel.id}: {e}")
+    OPERATION_SECONDS.observe(time.perf_counter() - began, operation='save')
+
+def record_stats(session):
+    """Adds a finished game to the player statistics, replaying its event log for what each player did."""
+    if game_store is None:
+        return
+    began = time.perf_counter()
+    try:
+        channel_id, events = persistence.load_events(game_store, session.game_id)
+        summary = stats.summarize_game(events)
+        if summary is not None:
+            stats.record_game(game_store, session.game_id, channel_id, summary)
+    except Exception as e:
+        logger.error(f"Failed to record the statistics of game {session.game_id}: {e}")
+    OPERATION_SECONDS.observe(time.perf_counter() - began, operation='stats')
+
+def restore_session(session, snapshot, members):
+    """Loads a snapshot into a session, given player ID -> member for everyone in it."""
+    def member(player_id):
+        return members[player_id] if player_id is not None else None
+    session.game_state = snapshot['game_state']
+    session.players = [members[player_id] for player_id in snapshot['players']]
+    engine.seat_players(session)
+    for player in session.players:
+        session.registry.add(player)
+    session.assassinated = [members[player_id] for player_id in snapshot['assassinated']]
+    session.role_assignments = {members[player_id]: role for player_id, role in snapshot['role_assignments']}
+    session.votes = {members[player_id]: vote for player_id, vote in snapshot['votes']}
+    session.liberal_policies = snapshot['liberal_policies']
+    session.fascist_policies = snapshot['fascist_policies']
+    session.deck.load(snapshot['policy_cards'], snapshot['discarded_policies'])
+    session.top_cards = snapshot['top_cards']
+    session.failed_election_count = snapshot['failed_election_count']
+    session.previous_president = member(snapshot['previous_president'])
+    session.current_president = member(snapshot['current_president'])
+    session.current_chancellor = member(snapshot['current_chancellor'])
+    session.game_mode = snapshot['game_mode']
+    # Snapshots saved before the event log existed keep the new log started by reset()
+    session.game_id = snapshot.get('game_id', session.game_id)
+    session.event_seq = snapshot.get('event_seq', 0)
+    session.saved_snapshot = json.dumps(snapshot)
+
+async def fetch_member(channel, player_id):
+    """Looks up a player of a saved game, from the member cache first and Discord's API otherwise."""
+    member = channel.guild.get_member(player_id)
+    if member is None:
+        try:
+            member = await channel.guild.fetch_member(player_id)
+        except discord.HTTPException:
+            # They may have left the server, DMs still work with the user
+            member = await bot.fetch_user(player_id)
+    return member
+
+async def resume_games():
+    """Rebuilds every saved game that isn't already running and announces it in its channel."""
+    if game_store is None:
+        return
+    for channel_id, snapshot in persistence.load_games(game_store).items():
+        if channel_id in sessions or not owns_guild(snapshot.get('guild_id')):
+            continue
+        try:
+            channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+            if not owns_guild(get_guild_id(channel)):
+                continue  # Saved before snapshots had the guild, and another worker runs it
+            player_ids = set(snapshot['players']) | set(snapshot['assassinated'])
+            members = {player_id: await fetch_member(channel, player_id) for player_id in player_ids}
+        except discord.HTTPException as e:
+            logger.error(f"Could not resume the game in channel {channel_id}: {e}", extra={'fields': {'channel': channel_id, 'game': snapshot.get('game_id')}})
+            continue
+        session = GameSession(channel)
+        restore_session(session, snapshot, members)
+        if snapshot.get('dashboard_message_id') is not None:
+            try:
+                session.dashboard_message = await channel.fetch_message(snapshot['dashboard_message_id'])
+            except discord.HTTPException:
+                pass  # Deleted, the next dashboard is posted and pinned again
+        sessions[channel_id] = session
+        for player in session.players + session.assassinated:
+            player_sessions[player.id] = session
+        schedule_turn(session)
+        logger.info(f"Resumed the game in channel {channel_id} with {len(session.players)} players.", extra={'fields': {'channel': channel_id, 'game': session.game_id}})
+        if session.game_state in (GAME_NOT_STARTED, GAME_STARTING):
+            await session.outbox.send(f"The bot restarted and kept the lobby. ({len(session.players)}/10 players)")
         else:
-            card_img_file += '_0'
-    card_img_file += '.jpg'
-    await player.send(file=discord.File(card_img_file))
-    await player.send(msg)
-
-def start_new_round():
-    global game_state, policy_cards, discarded_policies
-    message = None
-    if len(policy_cards) < 3 and len(discarded_policies) > 0:
-        policy_cards.extend(discarded_policies)
-        discarded_policies.clear()
-        random.shuffle(policy_cards)
-        message = (f"Ran out of policy cards. Adding back all discarded policies and shuffling the deck...")
-    return message
+            await print_game_dashboard(session, "The bot restarted and resumed the game where it left off!", None)
 
-def reset_game():
-    global players, game_started, role_assignments, game_state, liberal_policies, fascist_policies, policy_cards, failed_election_count, previous_president, current_president, current_chancellor
-    players = []
-    game_started = False
-    role_assignments = {}
-    game_state = 0
-    liberal_policies = 0
-    fascist_policies = 0
-    policy_cards = []
-    failed_election_count = 0
-    previous_president = None
-    current_president = None
-    current_chancellor = None
-
-async def game_over(msg, img=None):
-    global players, assassinated, role_assignments
+async def game_over(session, msg, asset=None):
     fascists = []
     liberals = []
     hitler = None
     
     # Add players from the role_assignments
-    for player in players:
-        if role_assignments[player] == FASCIST:
+    for player in session.players:
+        if session.role_assignments[player] == FASCIST:
             fascists.append(player)
-        if role_assignments[player] == LIBERAL:
+        if session.role_assignments[player] == LIBERAL:
             liberals.append(player)
-        if role_assignments[player] == HITLER:
+        if session.role_assignments[player] == HITLER:
             hitler = player
 
     # Add players from the assassinated list
-    for player in assassinated:
-        if role_assignments[player] == FASCIST:
+    for player in session.assassinated:
+        if session.role_assignments[player] == FASCIST:
             fascists.append(player)
-        if role_assignments[player] == LIBERAL:
+        if session.role_assignments[player] == LIBERAL:
             liberals.append(player)
-        if role_assignments[player] == HITLER:
+        if session.role_assignments[player] == HITLER:
             hitler = player
 
     # Construct the message with the list of players in each role
-    msg += f"\n\n**Hitler:**\n- {get_player_name(hitler)} (Assassinated)" if hitler in assassinated else f"\n\n**Hitler:**\n- {get_player_name(hitler)}"
+    msg += f"\n\n**Hitler:**\n- {get_player_name(hitler)} (Assassinated)" if hitler in session.assassinated else f"\n\n**Hitler:**\n- {get_player_name(hitler)}"
     
-    msg += f"\n\n**Fascists:**\n" + "\n".join(f"- {get_player_name(fascist)} (Assassinated)" if fascist in assassinated else f"- {get_player_name(fascist)}" for fascist in fascists)
+    msg += f"\n\n**Fascists:**\n" + "\n".join(f"- {get_player_name(fascist)} (Assassinated)" if fascist in session.assassinated else f"- {get_player_name(fascist)}" for fascist in fascists)
     
-    msg += f"\n\n**Liberals:**\n" + "\n".join(f"- {get_player_name(liberal)} (Assassinated)" if liberal in assassinated else f"- {get_player_name(liberal)}" for liberal in liberals)
+    msg += f"\n\n**Liberals:**\n" + "\n".join(f"- {get_player_name(liberal)} (Assassinated)" if liberal in session.assassinated else f"- {get_player_name(liberal)}" for liberal in liberals)
     
-    if img:
-        await game_channel.send(file=discord.File(img))
-    await game_channel.send(msg)
-    reset_game()
+    if asset:
+        await send_image(session.outbox, asset)
+    await session.outbox.send(msg)
+    reset_game(session)
 
 def get_player_name(player):
-    escaped_name = player.name.replace("_", "\\_") # If player name contains _ then need to add backslash so Discord doesn't make it italic
-    return f"{escaped_name}"
+    return escape_name(player.name)
+
+@functools.lru_cache(maxsize=4096)
+def escape_name(name):
+    return name.replace("_", "\\_") # If player name contains _ then need to add backslash so Discord doesn't make it italic
+
+def get_liberal_board_asset(session):
+    return ('liberal_board', session.liberal_policies, session.failed_election_count)
+
+def get_fascist_board_asset(session):
+    return ('fascist_board', session.game_mode, session.fascist_policies)
+
+def get_top_cards_asset(cards):
+    return ('top_cards', tuple(cards))
+
+def get_asset_manifest():
+    """Maps the key of every fixed image to the file it is loaded from."""
+    return {
+        SECRET_HITLER_LOGO_ASSET: SECRET_HITLER_LOGO_IMG,
+        LIBERAL_PARTY_CARD_ASSET: LIBERAL_PARTY_CARD_IMG,
+        FASCIST_PARTY_CARD_ASSET: FASCIST_PARTY_CARD_IMG,
+        HITLER_CARD_ASSET: HITLER_CARD_IMG,
+        HITLER_ASSASSINATED_ASSET: HITLER_ASSASSINATED_IMG,
+        HITLER_CHANCELLOR_ASSET: HITLER_CHANCELLOR_IMG,
+    }
+
+def get_rendered_asset_keys():
+    """Lists the key of every board and card hand image a game can reach, which are drawn by the renderer."""
+    keys = []
+    # 0-5 Liberal policies with 0-3 failed elections on the tracker
+    for liberal_policies, failed_election_count in itertools.product(range(6), range(4)):
+        keys.append(('liberal_board', liberal_policies, failed_election_count))
+    # 0-6 Fascist policies on each game mode's board
+    for game_mode, fascist_policies in itertools.product([FIVE_SIX_PLAYER_GAME_MODE, SEVEN_EIGHT_PLAYER_GAME_MODE, NINE_TEN_PLAYER_GAME_MODE], range(7)):
+        keys.append(('fascist_board', game_mode, fascist_policies))
+    # The President's 3 cards and the 2 passed on to the Chancellor, in any order
+    for num_cards in [2, 3]:
+        for cards in itertools.product([LIBERAL, FASCIST], repeat=num_cards):
+            keys.append(get_top_cards_asset(cards))
+    return keys
+
+def load_image_tier_manifest():
+    """Returns the original image path -> variant path mapping written by build_assets.py for IMAGE_TIER."""
+    if IMAGE_TIER == 'original':
+        return {}
+    manifest_path = f"./assets/{IMAGE_TIER}/manifest.json"
+    try:
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except OSError:
+        raise RuntimeError(f"Image tier '{IMAGE_TIER}' has not been built, run: python build_assets.py {IMAGE_TIER}")
+
+def load_assets():
+    """Reads every fixed image and sprite into memory so sends never touch the disk, failing fast if any are missing."""
+    variants = load_image_tier_manifest()
+    missing = []
+    for key, img_path in get_asset_manifest().items():
+        path = variants.get(img_path) if variants else img_path
+        if path is None:
+            missing.append(f"{img_path} ({IMAGE_TIER})")
+            continue
+        try:
+            with open(path, 'rb') as img_file:
+                assets[key] = (path, img_file.read())
+        except OSError:
+            missing.append(path)
+    for sprite_path in renderer.get_sprite_paths():
+        try:
+            renderer.load_sprite(sprite_path)
+        except OSError:
+            missing.append(sprite_path)
+    for key in get_rendered_asset_keys():
+        try:
+            renderer.check_renderable(key)
+        except (OSError, ValueError) as error:
+            missing.append(str(error))
+    if missing:
+        raise RuntimeError(f"Missing {len(missing)} image(s) needed during a game: {', '.join(missing)}")
+    logger.info(f"Loaded {len(assets)} {IMAGE_TIER} images ({sum(len(data) for _, data in assets.values()) // 1024} KB).")
+
+def get_asset_name(key):
+    """Path of a fixed image, or a path-like name for a rendered one. Used as the attachment cache key."""
+    if key in assets:
+        return assets[key][0]
+    return f"rendered/{IMAGE_TIER}/{renderer.get_filename(key, IMAGE_TIER)}"
+
+async def get_asset_data(key):
+    """Returns the bytes of an image, rendering it in the executor the first time it is needed."""
+    if key in assets:
+        return assets[key][1]
+    render = pending_renders.get(key)
+    if render is None:
+        # Concurrent sends of the same image share one render
+        render = asyncio.get_running_loop().run_in_executor(None, renderer.render, key, IMAGE_TIER)
+        pending_renders[key] = render
+        render.add_done_callback(lambda _: pending_renders.pop(key, None))
+    with tracing.span('render', asset=key[0]):
+        _, data = await render
+    return data
+
+async def get_asset_file(key):
+    return discord.File(io.BytesIO(await get_asset_data(key)), filename=os.path.basename(get_asset_name(key)))
+
+def load_attachment_cache():
+    global attachment_urls
+    try:
+        with open(ATTACHMENT_CACHE_FILE, encoding='utf-8') as cache_file:
+            attachment_urls = json.load(cache_file)
+    except FileNotFoundError:
+        attachment_urls = {}
+    except (OSError, ValueError) as error:
+        logger.error(f"Could not load the attachment cache, images will be uploaded again. {error}")
+        attachment_urls = {}
+
+def save_attachment_cache():
+    """Writes the cache to a file of this process and renames it over the cache, so workers saving at once can't mix their writes."""
+    temp_file = f"{ATTACHMENT_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as cache_file:
+            json.dump(attachment_urls, cache_file, indent=2)
+        os.replace(temp_file, ATTACHMENT_CACHE_FILE)
+    except OSError as error:
+        logger.error(f"Could not save the attachment cache. {error}")
+
+def get_cached_attachment_url(img):
+    url = attachment_urls.get(img)
+    if url is None:
+        return None
+    # Discord CDN links are signed and stop working after the timestamp in their 'ex' parameter
+    expires = parse_qs(urlparse(url).query).get('ex')
+    if expires and int(expires[0], 16) <= time.time() + ATTACHMENT_URL_EXPIRY_MARGIN:
+        del attachment_urls[img]
+        return None
+    return url
+
+async def send_image(destination, asset, content=None):
+    """Sends an image, uploading it only the first time and referencing its CDN URL in an embed afterwards."""
+    img = get_asset_name(asset)
+    url = get_cached_attachment_url(img)
+    if url is not None:
+        embed = discord.Embed()
+        embed.set_image(url=url)
+        return await destination.send(content, embed=embed)
+    message = await destination.send(content, file=await get_asset_file(asset))
+    if message is not None and message.attachments:
+        attachment_urls[img] = message.attachments[0].url
+        save_attachment_cache()
+    return message
 
-def get_liberal_board_img_file():
-    global liberal_policies, failed_election_count
-    return f"./images/boards/liberal/liberal_board_{liberal_policies}_{failed_election_count}.jpg"
+async def send_images(destination, assets, content=None):
+    """Sends several images as embeds of one message, uploading only those without a cached CDN URL."""
+    embeds, files, uploads = await get_image_embeds(assets)
+    message = await destination.send(content, embeds=embeds, files=files)
+    cache_uploads(message, uploads)
+    return message
+
+async def edit_images(destination, message, assets, content=None):
+    """Edits a message sent by send_images to show other images, uploading only those without a cached CDN URL.
+
+    Discord deletes the attachments an edit leaves out, which would break their cached URLs, so the message keeps
+    all of them. Returns None without editing if the images to upload don't fit next to them.
+    """
+    uncached = sum(get_cached_attachment_url(get_asset_name(asset)) is None for asset in assets)
+    if len(message.attachments) + uncached > DISCORD_ATTACHMENT_LIMIT:
+        return None
+    embeds, files, uploads = await get_image_embeds(assets)
+    edited = await destination.edit(message, content, embeds=embeds, attachments=message.attachments + files)
+    cache_uploads(edited, uploads)
+    return edited
+
+async def get_image_embeds(assets):
+    """An embed per image, and the files to upload with filename -> attachment cache key for those without a cached URL."""
+    embeds = []
+    files = []
+    uploads = {}
+    for asset in assets:
+        img = get_asset_name(asset)
+        url = get_cached_attachment_url(img)
+        if url is None:
+            file = await get_asset_file(asset)
+            files.append(file)
+            uploads[file.filename] = img
+            url = f"attachment://{file.filename}"
+        embed = discord.Embed()
+        embed.set_image(url=url)
+        embeds.append(embed)
+    return embeds, files, uploads
+
+def cache_uploads(message, uploads):
+    if message is not None and uploads:
+        for attachment in message.attachments:
+            if attachment.filename in uploads:
+                attachment_urls[uploads[attachment.filename]] = attachment.url
+        save_attachment_cache()
+
+def get_files(kwargs):
+    """The files a send or edit uploads, given its keyword arguments."""
+    attachments = [attachment for attachment in kwargs.get('attachments') or [] if isinstance(attachment, discord.File)]
+    return ([kwargs['file']] if kwargs.get('file') else []) + list(kwargs.get('files') or []) + attachments
+
+def count_api_call(kind, content=None, kwargs={}):
+    """Counts a request to Discord and the bytes it sends. Channel messages with files count as kind 'file'."""
+    files = get_files(kwargs)
+    if files and kind == 'text':
+        kind = 'file'
+    size = len(content.encode('utf-8')) if content else 0
+    size += sum(len(file.fp.getbuffer()) for file in files)
+    API_CALLS.inc(kind=kind)
+    API_BYTES.inc(size, kind=kind)
+
+def count_games_by_state():
+    counts = dict.fromkeys(((name,) for name in GAME_STATE_NAMES.values()), 0)
+    for session in sessions.values():
+        counts[(GAME_STATE_NAMES[session.game_state],)] += 1
+    return counts
+
+def get_guild_id(channel):
+    guild = getattr(channel, 'guild', None)
+    return guild.id if guild is not None else None
+
+def owns_guild(guild_id):
+    """Checks if this process runs the shard Discord sends the guild's events to. With all shards, it runs every guild."""
+    if SHARD_IDS is None or guild_id is None:
+        return True
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
 
-def get_fascist_board_img_file():
-    global liberal_policies, game_mode
-    return f"./images/boards/fascist/{game_mode}/fascist_board_{fascist_policies}.jpg"
+def count_running_games():
+    return sum(session.game_state not in (GAME_NOT_STARTED, GAME_STARTING) for session in sessions.values())
+
+async def drain():
+    """Stops new games and waits for the running ones to end, or for DRAIN_TIMEOUT, then disconnects.
+
+    Every game is saved after each command, so a game still running is resumed by the next process for its shard.
+    """
+    global draining
+    if draining:
+        return
+    draining = True
+    logger.info(f"Draining: waiting up to {DRAIN_TIMEOUT}s for {count_running_games()} games to end.")
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while count_running_games() and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+    # Let the last messages out before disconnecting
+    workers = [session.outbox.worker for session in sessions.values() if session.outbox.worker is not None]
+    if workers:
+        await asyncio.wait(workers, timeout=10)
+    logger.info(f"Drained, leaving {count_running_games()} games to be resumed.")
+    await bot.close()
 
 # Run the bot
-bot.run(DISCORD_TOKEN)
+def load_config():
+    """Reads the configuration from the environment, raising a RuntimeError that lists every problem at once."""
+    global ENV_TOKEN_SUFFIX, DISCORD_TOKEN, SECRET_HITLER_CHANNEL_IDS, FASCIST_CARD_EMOJI_NAME, LIBERAL_CARD_EMOJI_NAME
+    global FASCIST_CARD_EMOJI_ID, LIBERAL_CARD_EMOJI_ID, IMAGE_TIER, DASHBOARD_MODE, ROLE_DM_CONCURRENCY, METRICS_HOST, METRICS_PORT
+    global TRACE_SAMPLE_RATE, TRACE_FILE, TURN_TIMEOUT, TURN_REMINDER, IDLE_VOTE, SHARD_COUNT, SHARD_IDS, DRAIN_TIMEOUT
+    errors = []
+
+    def require(key):
+        value = os.getenv(key, '').strip()
+        if not value:
+            errors.append(f"{key} is not set")
+        return value
+
+    def parse_int(key, value, minimum=None):
+        if not value:
+            return None  # Already reported by require()
+        try:
+            number = int(value)
+        except ValueError:
+            errors.append(f"{key} must be a whole number, got '{value}'")
+            return None
+        if minimum is not None and number < minimum:
+            errors.append(f"{key} must be at least {minimum}, got {number}")
+        return number
+
+    def choose(key, default, choices):
+        value = os.getenv(key, '').strip() or default
+        if value not in choices:
+            errors.append(f"{key} must be one of {', '.join(choices)}, got '{value}'")
+        return value
+
+    ENV_TOKEN_SUFFIX = choose('ENV', '', ['_DEV', '_PROD'])
+    if not errors:
+        DISCORD_TOKEN = require('DISCORD_TOKEN' + ENV_TOKEN_SUFFIX)
+    channel_ids = [channel_id.strip() for channel_id in os.getenv('SECRET_HITLER_CHANNEL_ID', '').split(',') if channel_id.strip()]
+    SECRET_HITLER_CHANNEL_IDS = {parse_int('SECRET_HITLER_CHANNEL_ID', channel_id) for channel_id in channel_ids}
+    FASCIST_CARD_EMOJI_NAME = require('FASCIST_CARD_EMOJI_NAME')
+    LIBERAL_CARD_EMOJI_NAME = require('LIBERAL_CARD_EMOJI_NAME')
+    FASCIST_CARD_EMOJI_ID = parse_int('FASCIST_CARD_EMOJI_ID', require('FASCIST_CARD_EMOJI_ID'))
+    LIBERAL_CARD_EMOJI_ID = parse_int('LIBERAL_CARD_EMOJI_ID', require('LIBERAL_CARD_EMOJI_ID'))
+    IMAGE_TIER = choose('IMAGE_TIER', 'original', list(renderer.RENDER_FORMATS))
+    DASHBOARD_MODE = choose('DASHBOARD_MODE', 'single', ['single', 'classic', 'live'])
+    ROLE_DM_CONCURRENCY = parse_int('ROLE_DM_CONCURRENCY', os.getenv('ROLE_DM_CONCURRENCY', '5'), minimum=1)
+    METRICS_HOST = os.getenv('METRICS_HOST', '').strip() or '127.0.0.1'
+    METRICS_PORT = parse_int('METRICS_PORT', os.getenv('METRICS_PORT', '').strip(), minimum=1)
+    TRACE_FILE = os.getenv('TRACE_FILE', '').strip() or './traces.jsonl'
+    try:
+        TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '').strip() or 0)
+        if not 0 <= TRACE_SAMPLE_RATE <= 1:
+            raise ValueError
+    except ValueError:
+        errors.append(f"TRACE_SAMPLE_RATE must be a number from 0 to 1, got '{os.getenv('TRACE_SAMPLE_RATE')}'")
+    TURN_TIMEOUT = parse_int('TURN_TIMEOUT', os.getenv('TURN_TIMEOUT', '').strip() or '0', minimum=0)
+    TURN_REMINDER = parse_int('TURN_REMINDER', os.getenv('TURN_REMINDER', '').strip() or '60', minimum=0)
+    IDLE_VOTE = choose('IDLE_VOTE', 'nein', ['nein', 'ja'])
+    SHARD_COUNT = parse_int('SHARD_COUNT', os.getenv('SHARD_COUNT', '').strip(), minimum=1)
+    SHARD_IDS = None
+    shard_ids = os.getenv('SHARD_IDS', '').strip()
+    if shard_ids:
+        SHARD_IDS = []
+        for part in shard_ids.split(','):
+            first, _, last = part.strip().partition('-')
+            first = parse_int('SHARD_IDS', first.strip(), minimum=0)
+            last = parse_int('SHARD_IDS', last.strip(), minimum=0) if last else first
+            if first is not None and last is not None:
+                SHARD_IDS.extend(range(first, last + 1))
+        if SHARD_COUNT is None:
+            errors.append("SHARD_IDS needs SHARD_COUNT to be set")
+        elif any(shard_id >= SHARD_COUNT for shard_id in SHARD_IDS):
+            errors.append(f"SHARD_IDS must be below SHARD_COUNT ({SHARD_COUNT}), got '{shard_ids}'")
+    DRAIN_TIMEOUT = parse_int('DRAIN_TIMEOUT', os.getenv('DRAIN_TIMEOUT', '').strip() or '600', minimum=0)
+    if errors:
+        raise RuntimeError("Invalid configuration in .env or the environment:\n- " + "\n- ".join(errors))
+
+def warm_caches():
+    """Loads the images and the attachment cache, and renders the boards every game starts with."""
+    load_assets()
+    load_attachment_cache()
+    keys = [get_liberal_board_asset(engine.GameState())]
+    for game_mode in [FIVE_SIX_PLAYER_GAME_MODE, SEVEN_EIGHT_PLAYER_GAME_MODE, NINE_TEN_PLAYER_GAME_MODE]:
+        keys.append(('fascist_board', game_mode, 0))
+    for key in keys:
+        renderer.render(key, IMAGE_TIER)
+
+async def timed_step(step, awaitable):
+    """Awaits one step of the startup and records how long it took."""
+    began = time.perf_counter()
+    result = await awaitable
+    startup_timings[step] = time.perf_counter() - began
+    return result
+
+async def run_bot():
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: run_in_background(drain()))
+    except NotImplementedError:
+        pass  # No signal handlers on Windows, the bot stops at once with Ctrl+C there
+    global loop_monitor
+    if METRICS_PORT is not None:
+        await timed_step('metrics', metrics.serve(METRICS_HOST, METRICS_PORT))
+        loop_monitor = asyncio.create_task(metrics.monitor_event_loop(EVENT_LOOP_LAG_SECONDS))
+        logger.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    try:
+        async with bot:
+            # Nothing touches the images or the cache until the gateway connects, so they load while the bot logs in
+            await asyncio.gather(
+                timed_step('login', bot.login(DISCORD_TOKEN)),
+                timed_step('assets', asyncio.to_thread(warm_caches)),
+            )
+            startup_timings['connecting'] = time.perf_counter()
+            await bot.connect()
+    finally:
+        await stop_loop_monitor()
+
+async def stop_loop_monitor():
+    """Cancels the event loop monitor, if it runs, and waits for it to stop."""
+    global loop_monitor
+    if loop_monitor is None:
+        return
+    loop_monitor.cancel()
+    try:
+        await loop_monitor
+    except asyncio.CancelledError:
+        pass
+    loop_monitor = None
+
+def main():
+    global game_store
+    startup_timings['imports'] = time.perf_counter() - startup_began
+    began = time.perf_counter()
+    load_dotenv()
+    try:
+        load_config()
+    except RuntimeError as error:
+        logger.critical(str(error))
+        sys.exit(str(error))
+    if ENV_TOKEN_SUFFIX != '_PROD':
+        bot.add_command(tester)
+    tracing.configure(TRACE_FILE, TRACE_SAMPLE_RATE)
+    bot.shard_count, bot.shard_ids = SHARD_COUNT, SHARD_IDS
+    game_store = persistence.open_store(GAME_DB_FILE)
+    stats.create_tables(game_store)
+    startup_timings['config'] = time.perf_counter() - began
+    # bot.run() would set up discord.py's log output and handle Ctrl+C, so do the same
+    discord.utils.setup_logging(root=False)
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as error:
+        logger.critical(str(error))
+        sys.exit(str(error))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Plays large numbers of games on the rules engine with scripted players, to measure how balanced the game is.
+
+Each player count is played with the strategy chosen for each team, by the official rules or engine.HouseRules
+switched on the command line. Batches of games run on a process pool
+across all cores. Each batch is boiled down to running totals before it is sent back, so memory use stays flat
+however many games are played. Every batch is seeded from the base seed and its index, so a run gives the same
+results on any number of processes.
+
+Usage:
+    python simulate.py [--games N] [--players 5 6 ...] [--liberals random] [--fascists partisan] [--processes N] [--seed N]
+                       [--powers official|large|none] [--veto N|none] [--failed-elections N] [--hitler-chancellor N]
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import engine
+from engine import LIBERAL, FASCIST, HITLER
+
+BATCH_SIZE = 1000
+POWER_ACTIONS = {engine.EXECUTIVE_INVESTIGATION: 'investigate', engine.EXECUTIVE_APPOINTMENT: 'appoint', engine.EXECUTIVE_KILL: 'kill'}
+
+
+class RandomStrategy:
+    """Picks uniformly among the legal choices, ignoring its role."""
+
+    def nominate(self, state, player, candidates, rng):
+        return rng.choice(candidates)
+
+    def vote(self, state, player, rng):
+        return rng.choice(('ja', 'nein'))
+
+    def discard(self, state, player, rng):
+        return rng.randint(1, len(state.top_cards))
+
+    def enact(self, state, player, rng):
+        return rng.randint(1, len(state.top_cards))
+
+    def call_veto(self, state, player, rng):
+        return rng.random() < 0.5
+
+    def accept_veto(self, state, player, rng):
+        return rng.random() < 0.5
+
+    def target(self, state, player, power, candidates, rng):
+        return rng.choice(candidates)
+
+
+class PartisanStrategy(RandomStrategy):
+    """Plays for its own team with what its role lets it know.
+
+    Liberals and a Hitler who doesn't know the Fascists (7 or more players) only know their own cards,
+    so they pass on the Liberal policies they're dealt and otherwise play at random.
+    Fascists know their team, so they back governments with a Fascist in them, bury Liberal policies
+    and use their powers on Liberals.
+    """
+
+    def get_team(self, state, player):
+        """The players `player` knows to be on their side, or None if they only know themselves."""
+        role = state.role_assignments[player]
+        if role == LIBERAL or (role == HITLER and state.game_mode != engine.FIVE_SIX_PLAYER_GAME_MODE):
+            return None
+        return {p for p, r in state.role_assignments.items() if r != LIBERAL}
+
+    def get_policy(self, state, player):
+        return FASCIST if state.role_assignments[player] != LIBERAL else LIBERAL
+
+    def nominate(self, state, player, candidates, rng):
+        team = self.get_team(state, player)
+        allies = [p for p in candidates if team is not None and p in team]
+        return rng.choice(allies or candidates)
+
+    def vote(self, state, player, rng):
+        team = self.get_team(state, player)
+        if team is None:
+            return super().vote(state, player, rng)
+        return 'ja' if state.current_president in team or state.current_chancellor in team else 'nein'
+
+    def discard(self, state, player, rng):
+        # Throw away a card of the other party if there is one
+        keep = self.get_policy(state, player)
+        for card_num, card in enumerate(state.top_cards, 1):
+            if card != keep:
+                return card_num
+        return super().discard(state, player, rng)
+
+    def enact(self, state, player, rng):
+        keep = self.get_policy(state, player)
+        for card_num, card in enumerate(state.top_cards, 1):
+            if card == keep:
+                return card_num
+        return super().enact(state, player, rng)
+
+    def call_veto(self, state, player, rng):
+        return self.get_policy(state, player) not in state.top_cards
+
+    def accept_veto(self, state, player, rng):
+        return self.get_policy(state, player) == LIBERAL
+
+    def target(self, state, player, power, candidates, rng):
+        team = self.get_team(state, player)
+        if team is None:
+            return super().target(state, player, power, candidates, rng)
+        # Appoint an ally, investigate or kill anyone else
+        picks = [p for p in candidates if (p in team) == (power == engine.EXECUTIVE_APPOINTMENT)]
+        return rng.choice(picks or candidates)
+
+
+STRATEGIES = {
+    'random': RandomStrategy,
+    'partisan': PartisanStrategy,
+}
+
+
+class Totals:
+    """Running totals for the games played with one number of players. Totals from different batches add up with merge()."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.rounds = collections.Counter()  # governments nominated -> number of games
+
+    def add_game(self, counts, rounds):
+        self.counts.update(counts)
+        self.counts['games'] += 1
+        self.rounds[rounds] += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.rounds.update(other.rounds)
+
+    def get_rounds_percentile(self, fraction):
+        seen = 0
+        for rounds in sorted(self.rounds):
+            seen += self.rounds[rounds]
+            if seen >= fraction * self.counts['games']:
+                return rounds
+        return 0
+
+
+def get_action(state, strategies, vetoed, rng):
+    """The next action in the game, decided by the strategy of the player whose turn it is."""
+    president = state.current_president
+    chancellor = state.current_chancellor
+
+    def strategy(player):
+        return strategies[state.role_assignments[player]]
+
+    if state.game_state == engine.NOMINATE_CHANCELLOR:
+        candidates = [p for p in state.players if p != president and p != state.previous_president]
+        return ('nominate', president, strategy(president).nominate(state, president, candidates, rng))
+    if state.game_state == engine.ELECTION:
+        voter = next(p for p in state.players if p not in state.votes and p != president and p != chancellor)
+        return (strategy(voter).vote(state, voter, rng), voter)
+    if state.game_state == engine.PRESIDENTIAL_LEGISLATION:
+        return ('discard', president, strategy(president).discard(state, president, rng))
+    if state.game_state == engine.CHANCELLOR_LEGISLATION:
+        # The agenda can only be vetoed once
+        if engine.is_veto_unlocked(state) and not vetoed and strategy(chancellor).call_veto(state, chancellor, rng):
+            return ('veto', chancellor)
+        return ('enact', chancellor, strategy(chancellor).enact(state, chancellor, rng))
+    if state.game_state == engine.AGENDA_VETOED:
+        return ('ja' if strategy(president).accept_veto(state, president, rng) else 'nein', president)
+    power = state.game_state
+    candidates = [p for p in state.players if p != president]
+    return (POWER_ACTIONS[power], president, strategy(president).target(state, president, power, candidates, rng))
+
+
+def play_game(num_players, strategies, rng, rules=engine.OFFICIAL_RULES):
+    """Plays one game to the end, returning its counts and the number of governments nominated."""
+    state = engine.GameState(rules)
+    for action in [('join', player) for player in range(num_players)] + [('ready', 0), ('start', 0)]:
+        engine.apply(state, action, rng)
+    counts = collections.Counter()
+    vetoed = False
+    while state.game_state != engine.GAME_OVER:
+        action = get_action(state, strategies, vetoed, rng)
+        vetoed = action[0] == 'veto' or (vetoed and state.game_state == engine.AGENDA_VETOED)
+        _, events = engine.apply(state, action, rng)
+        counts['actions'] += 1
+        for event in events:
+            event_type = event[0]
+            if event_type in ('nominated', 'reshuffled', 'veto_accepted', 'killed'):
+                counts[event_type] += 1
+            elif event_type == 'election_failed' and event[3] is not None:
+                counts['chaos'] += 1
+            elif event_type == 'game_over':
+                counts[event[1]] += 1
+                counts[event[2]] += 1
+    counts['games_with_chaos'] += counts['chaos'] > 0
+    counts['games_with_reshuffle'] += counts['reshuffled'] > 0
+    return counts, counts.pop('nominated', 0)
+
+
+def play_batch(batch):
+    """Plays one batch of games in a worker process, returning number of players -> Totals."""
+    seed, games, player_counts, strategy_names, rules = batch
+    rng = random.Random(seed)
+    strategies = {role: STRATEGIES[strategy_names[role]]() for role in (LIBERAL, FASCIST, HITLER)}
+    totals = collections.defaultdict(Totals)
+    for i in range(games):
+        num_players = player_counts[i % len(player_counts)]
+        totals[num_players].add_game(*play_game(num_players, strategies, rng, rules))
+    return dict(totals)
+
+
+def get_batches(games, player_counts, liberals, fascists, seed, rules):
+    strategy_names = {LIBERAL: liberals, FASCIST: fascists, HITLER: fascists}
+    for index, start in enumerate(range(0, games, BATCH_SIZE)):
+        yield (seed * 1000003 + index, min(BATCH_SIZE, games - start), player_counts, strategy_names, rules)
+
+
+def simulate(games, player_counts=range(engine.MIN_PLAYERS, engine.MAX_PLAYERS + 1), liberals='random', fascists='random',
+             processes=None, seed=0, progress=None, rules=engine.OFFICIAL_RULES):
+    """Plays `games` games by `rules` spread over `processes` worker processes and returns number of players -> Totals.
+
+    `progress`, if given, is called with the number of games played so far as each batch finishes.
+    """
+    player_counts = list(player_counts)
+    totals = collections.defaultdict(Totals)
+    played = 0
+    batches = get_batches(games, player_counts, liberals, fascists, seed, rules)
+    with multiprocessing.Pool(processes) as pool:
+        for batch_totals in pool.imap_unordered(play_batch, batches):
+            for num_players, batch in batch_totals.items():
+                totals[num_players].merge(batch)
+                played += batch.counts['games']
+            if progress is not None:
+                progress(played)
+    return dict(sorted(totals.items()))
+
+
+def get_game_mode(num_players):
+    state = engine.GameState()
+    state.players = list(range(num_players))
+    engine.apply(state, ('ready', 0))
+    return state.game_mode
+
+
+def print_totals(totals):
+    print(f"{'players':>7} {'mode':>12} {'games':>9} {'liberal':>8} {'fascist':>8} {'hitler':>7} {'rounds':>7} {'p50':>4} {'p90':>4} "
+          f"{'chaos':>6} {'w/chaos':>8} {'reshuf':>7} {'w/reshuf':>9} {'vetoes':>7}")
+    for num_players, total in totals.items():
+        counts = total.counts
+        games = counts['games']
+
+        def rate(key):
+            return f"{100 * counts[key] / games:.1f}%"
+
+        def per_game(key):
+            return f"{counts[key] / games:.2f}"
+
+        rounds = sum(rounds * number for rounds, number in total.rounds.items()) / games
+        print(f"{num_players:>7} {get_game_mode(num_players):>12} {games:>9} {rate(LIBERAL):>8} {rate(FASCIST):>8} {rate('hitler_elected'):>7} "
+              f"{rounds:>7.2f} {total.get_rounds_percentile(0.5):>4} {total.get_rounds_percentile(0.9):>4} "
+              f"{per_game('chaos'):>6} {rate('games_with_chaos'):>8} {per_game('reshuffled'):>7} {rate('games_with_reshuffle'):>9} {per_game('veto_accepted'):>7}")
+    print("\nliberal/fascist: win rate, hitler: Fascist wins by electing Hitler, rounds: governments nominated per game (mean, median, 90th percentile)")
+    print("chaos: policies enacted by the election tracker after too many failed elections, reshuf: deck reshuffles, w/: share of games with at least one")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulates games of Secret Hitler with scripted players.")
+    parser.add_argument('--games', type=int, default=100000, help="number of games to play, spread evenly over the player counts")
+    parser.add_argument('--players', type=int, nargs='+', choices=range(engine.MIN_PLAYERS, engine.MAX_PLAYERS + 1),
+                        default=list(range(engine.MIN_PLAYERS, engine.MAX_PLAYERS + 1)), help="player counts to play, default 5 to 10")
+    parser.add_argument('--liberals', choices=STRATEGIES, default='random', help="strategy of the Liberals")
+    parser.add_argument('--fascists', choices=STRATEGIES, default='random', help="strategy of the Fascists and Hitler")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="worker processes, default one per core")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--powers', choices=engine.POWER_TABLES, default='official', help="presidential powers: official, the 9-10 player board at every count, or none")
+    parser.add_argument('--veto', type=lambda value: None if value == 'none' else int(value), default=5,
+                        help="Fascist policies that unlock the veto, or none for no veto, default 5")
+    parser.add_argument('--failed-elections', type=int, default=3, help="failed elections in a row that enact the top policy, default 3")
+    parser.add_argument('--hitler-chancellor', type=int, default=3, help="Fascist policies before electing Hitler Chancellor wins, default 3")
+    args = parser.parse_args()
+    try:
+        rules = engine.HouseRules(args.powers, args.veto, args.failed_elections, args.hitler_chancellor)
+    except ValueError as error:
+        parser.error(str(error))
+
+    began = time.perf_counter()
+
+    def progress(played):
+        elapsed = time.perf_counter() - began
+        print(f"\r{played}/{args.games} games, {played / elapsed:.0f} games/s", end='', file=sys.stderr, flush=True)
+
+    totals = simulate(args.games, args.players, args.liberals, args.fascists, args.processes, args.seed, progress, rules)
+    print(file=sys.stderr)
+    print(f"Liberals: {args.liberals}, Fascists: {args.fascists}, {args.processes} processes, {time.perf_counter() - began:.1f}s")
+    print(f"{rules}\n")
+    print_totals(totals)
@@ -0,0 +1,222 @@
+"""Keeps every finished game and running totals per player in SQLite, so statistics are one indexed lookup away.
+
+Finished games are replayed from their event log once, when they end, to find out what each player did. The game,
+a row per player and an update of each player's totals in player_stats are written in one transaction, so the
+totals never disagree with the games they count. !stats reads one player_stats row and the player's latest games
+through an index on (player_id, ended), and !leaderboard reads the first rows of an index on wins, so neither gets
+slower as games pile up.
+
+Usage:
+    python stats.py            prints the leaderboard of secret_hitler.db
+    python stats.py rebuild    recounts every finished game in the event log, e.g. the ones played before this
+"""
+import collections
+import sys
+
+import engine
+import persistence
+import replay
+from engine import LIBERAL, FASCIST, HITLER
+
+GAME_DB_FILE = './secret_hitler.db'  # Same as secrethitler.GAME_DB_FILE
+
+ROLES = {LIBERAL: 'liberal', FASCIST: 'fascist', HITLER: 'hitler'}  # Role -> prefix of its columns in player_stats
+# What each player did in a game, counted from the engine events
+ACTION_COUNTERS = ('presidencies', 'chancellorships', 'liberal_enacted', 'fascist_enacted', 'vetoes', 'investigations', 'kills')
+STAT_COUNTERS = ('games', 'wins', *(f'{prefix}_{count}' for prefix in ROLES.values() for count in ('games', 'wins')), 'killed', *ACTION_COUNTERS)
+WIN_CONDITIONS = {
+    'liberal_policies': "5 liberal policies",
+    'fascist_policies': "6 fascist policies",
+    'hitler_elected': "Hitler elected Chancellor",
+    'hitler_assassinated': "Hitler assassinated",
+}
+
+
+def get_columns(names, indent='    '):
+    return ''.join(f'{indent}{name} INTEGER NOT NULL DEFAULT 0,\n' for name in names)
+
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS finished_games (
+    game_id TEXT PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    players INTEGER NOT NULL,
+    winner TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    liberal_policies INTEGER NOT NULL,
+    fascist_policies INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS finished_games_ended ON finished_games (ended);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id TEXT NOT NULL,
+    player_id INTEGER NOT NULL,
+    ended REAL NOT NULL,
+    role TEXT NOT NULL,
+    won INTEGER NOT NULL,
+    killed INTEGER NOT NULL,
+{get_columns(ACTION_COUNTERS)}    PRIMARY KEY (game_id, player_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS game_players_player ON game_players (player_id, ended);
+CREATE TABLE IF NOT EXISTS player_stats (
+    player_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    last_played REAL NOT NULL,
+{get_columns(STAT_COUNTERS)[:-2]}
+);
+CREATE INDEX IF NOT EXISTS player_stats_wins ON player_stats (wins DESC, games);
+CREATE INDEX IF NOT EXISTS player_stats_name ON player_stats (name COLLATE NOCASE);
+'''
+
+INSERT_PLAYER = f'''
+INSERT INTO game_players (game_id, player_id, ended, role, won, killed, {', '.join(ACTION_COUNTERS)})
+VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' for _ in ACTION_COUNTERS)})
+'''
+ADD_TO_STATS = f'''
+INSERT INTO player_stats (player_id, name, last_played, {', '.join(STAT_COUNTERS)})
+VALUES (?, ?, ?, {', '.join('?' for _ in STAT_COUNTERS)})
+ON CONFLICT (player_id) DO UPDATE SET
+    name = excluded.name,
+    last_played = MAX(last_played, excluded.last_played),
+    {', '.join(f'{name} = {name} + excluded.{name}' for name in STAT_COUNTERS)}
+'''
+
+
+def create_tables(conn):
+    conn.executescript(SCHEMA)
+    conn.commit()
+
+
+def summarize_game(events):
+    """Replays a game's events, returning what record_game() stores about it, or None if the game didn't finish."""
+    state = engine.GameState()
+    counters = collections.defaultdict(collections.Counter)  # Player -> ACTION_COUNTERS
+    reason = None
+    for _, caused in replay.replay_actions(state, events):
+        for event in caused:
+            if event[0] == 'election_passed':
+                counters[event[3]]['presidencies'] += 1
+                counters[event[4]]['chancellorships'] += 1
+            elif event[0] == 'enacted':
+                counters[event[1]][f'{ROLES[event[2]]}_enacted'] += 1
+            elif event[0] == 'veto_called':
+                counters[event[1]]['vetoes'] += 1
+            elif event[0] == 'investigated':
+                counters[event[1]]['investigations'] += 1
+            elif event[0] == 'killed':
+                counters[event[1]]['kills'] += 1
+            elif event[0] == 'game_over':
+                reason = event[2]
+    if state.winner is None:
+        return None
+    players = []
+    for player, role in state.role_assignments.items():
+        won = (role == LIBERAL) == (state.winner == LIBERAL)
+        players.append({
+            'id': player.id, 'name': player.name, 'role': role, 'won': won, 'killed': player in state.assassinated,
+            **{name: counters[player][name] for name in ACTION_COUNTERS},
+        })
+    return {
+        'started': events[0][1],
+        'ended': events[-1][1],
+        'winner': state.winner,
+        'reason': reason,
+        'liberal_policies': state.liberal_policies,
+        'fascist_policies': state.fascist_policies,
+        'players': players,
+    }
+
+
+def record_game(conn, game_id, channel_id, summary):
+    """Writes a finished game and adds it to its players' totals in one transaction, returning False if it was already recorded."""
+    with conn:
+        return add_game(conn, game_id, channel_id, summary)
+
+
+def add_game(conn, game_id, channel_id, summary):
+    """record_game() without the commit, to write many games in one transaction."""
+    ended = summary['ended']
+    inserted = conn.execute(
+        'INSERT OR IGNORE INTO finished_games (game_id, channel_id, started, ended, players, winner, reason, liberal_policies, fascist_policies) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (game_id, channel_id, summary['started'], ended, len(summary['players']), summary['winner'], summary['reason'],
+         summary['liberal_policies'], summary['fascist_policies']),
+    ).rowcount
+    if not inserted:
+        return False
+    players = summary['players']
+    conn.executemany(INSERT_PLAYER, [
+        (game_id, player['id'], ended, player['role'], player['won'], player['killed'], *(player[name] for name in ACTION_COUNTERS))
+        for player in players
+    ])
+    conn.executemany(ADD_TO_STATS, [(player['id'], player['name'], ended, *get_stat_increments(player).values()) for player in players])
+    return True
+
+
+def get_stat_increments(player):
+    """What one game adds to each of a player's STAT_COUNTERS."""
+    increments = dict.fromkeys(STAT_COUNTERS, 0)
+    prefix = ROLES[player['role']]
+    increments.update({'games': 1, f'{prefix}_games': 1, 'wins': int(player['won']), f'{prefix}_wins': int(player['won'])})
+    increments['killed'] = int(player['killed'])
+    increments.update({name: player[name] for name in ACTION_COUNTERS})
+    return increments
+
+
+def get_player_stats(conn, player_id):
+    """A player's totals as a dict of player_stats columns, or None if they haven't finished a game."""
+    cursor = conn.execute('SELECT * FROM player_stats WHERE player_id = ?', (player_id,))
+    row = cursor.fetchone()
+    return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+
+def find_player(conn, name):
+    """The ID of the player last seen with `name`, ignoring case, or None."""
+    row = conn.execute('SELECT player_id FROM player_stats WHERE name = ? COLLATE NOCASE ORDER BY last_played DESC LIMIT 1', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def get_recent_games(conn, player_id, limit=5):
+    """A player's latest finished games, newest first, as (ended, role, won, reason) tuples."""
+    return conn.execute(
+        'SELECT game_players.ended, role, won, reason FROM game_players JOIN finished_games USING (game_id) '
+        'WHERE player_id = ? ORDER BY game_players.ended DESC LIMIT ?',
+        (player_id, limit),
+    ).fetchall()
+
+
+def get_leaderboard(conn, limit=10):
+    """The players with the most wins, fewest games first on a tie, as (player_id, name, games, wins) tuples."""
+    return conn.execute('SELECT player_id, name, games, wins FROM player_stats ORDER BY wins DESC, games LIMIT ?', (limit,)).fetchall()
+
+
+def rebuild(conn):
+    """Recounts every finished game from the event log in one transaction, returning how many there are."""
+    game_ids = [row[0] for row in conn.execute("SELECT game_id FROM events WHERE type = 'game_over'").fetchall()]
+    recorded = 0
+    with conn:
+        for table in ('finished_games', 'game_players', 'player_stats'):
+            conn.execute(f'DELETE FROM {table}')
+        for game_id in game_ids:
+            channel_id, events = persistence.load_events(conn, game_id)
+            summary = summarize_game(events)
+            if summary is not None:
+                recorded += add_game(conn, game_id, channel_id, summary)
+    return recorded
+
+
+def print_leaderboard(conn):
+    print(f"{'':>4} {'player':<32} {'wins':>6} {'games':>6}")
+    for rank, (_, name, games, wins) in enumerate(get_leaderboard(conn), 1):
+        print(f"{rank:>4} {name:<32} {wins:>6} {games:>6}")
+
+
+if __name__ == '__main__':
+    conn = persistence.open_store(GAME_DB_FILE)
+    create_tables(conn)
+    if sys.argv[1:] == ['rebuild']:
+        print(f"Recorded {rebuild(conn)} finished games.")
+    elif len(sys.argv) > 1:
+        sys.exit(__doc__)
+    print_leaderboard(conn)
@@ -0,0 +1,92 @@
+"""Deadlines for any number of games on one shared heap, armed on the event loop as a single timer.
+
+Arming a timer pushes it on the heap, and cancelling one only marks it, so both are cheap however many are
+pending. The event loop only ever holds one timer, for the earliest deadline. When it fires, every timer that is
+due runs and the loop timer is moved to the next deadline. Cancelled timers are dropped as they reach the top of
+the heap, and the heap is compacted when most of it is cancelled.
+"""
+import asyncio
+import heapq
+import itertools
+
+
+class Timer:
+    __slots__ = ('scheduler', 'when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, scheduler, when, callback, args):
+        self.scheduler = scheduler
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the timer from running, if it hasn't run yet."""
+        if not self.cancelled:
+            self.cancelled = True
+            self.scheduler.discard(self)
+
+
+class Scheduler:
+    def __init__(self):
+        self.heap = []  # (deadline, tiebreak, Timer), deadlines in loop.time()
+        self.sequence = itertools.count()
+        self.handle = None  # Event loop timer for the earliest deadline
+        self.armed_for = None
+        self.cancelled = 0  # Cancelled timers still in the heap
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def call_later(self, delay, callback, *args):
+        """Runs `callback(*args)` on the event loop in `delay` seconds, returning the Timer to cancel it with."""
+        loop = asyncio.get_running_loop()
+        timer = Timer(self, loop.time() + delay, callback, args)
+        heapq.heappush(self.heap, (timer.when, next(self.sequence), timer))
+        if self.handle is None or timer.when < self.armed_for:
+            self.arm(loop)
+        return timer
+
+    def discard(self, timer):
+        self.cancelled += 1
+        if self.cancelled > 64 and self.cancelled > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def arm(self, loop):
+        """Points the event loop timer at the earliest deadline still pending."""
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.heap:
+            self.armed_for = self.heap[0][0]
+            self.handle = loop.call_at(self.armed_for, self.run_due, loop)
+
+    def run_due(self, loop):
+        self.handle = None
+        now = loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                self.cancelled -= 1
+                continue
+            timer.cancelled = True  # So cancelling it now does nothing
+            try:
+                timer.callback(*timer.args)
+            except Exception as error:
+                loop.call_exception_handler({'message': f"Error in timer callback {timer.callback!r}", 'exception': error})
+        self.arm(loop)
+
+    def clear(self):
+        """Cancels every timer."""
+        for _, _, timer in self.heap:
+            timer.cancelled = True
+        self.heap = []
+        self.cancelled = 0
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
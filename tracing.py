@@ -0,0 +1,162 @@
+"""Opt-in tracing of commands as trees of timed spans, written as JSON lines with OTLP's span field names.
+
+A trace starts at the root span of a command, and only a `sample_rate` share of commands are traced.
+Spans opened outside a sampled trace cost one context variable lookup and record nothing, so tracing
+can be left on at a low rate in production. Each span is queued when it ends and written to the file by a
+background thread, as logs.py does for log records, so the event loop never waits for the disk. The file
+is flushed when a root span has been written.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+current_span = contextvars.ContextVar('current_span', default=None)
+sample_rate = 0.0
+sampler = random.Random()  # Separate from the global RNG, so sampling never changes what else draws from it
+output = None  # File the spans are written to, None when tracing is off
+writer = None  # Thread writing the queued spans to `output`
+spans = queue.SimpleQueue()  # Records of ended spans waiting for the writer, then None to stop it
+
+
+class NullSpan:
+    """Stands in for a span that isn't recorded."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'start', 'end', 'error', 'token', 'root')
+
+    def __init__(self, trace_id, parent_id, name, attributes, root=False):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+        self.root = root
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end = time.time_ns()
+        current_span.reset(self.token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        export(self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Unsampled(NullSpan):
+    """Runs a command that wasn't sampled outside of any trace, so its spans are skipped too."""
+
+    def __enter__(self):
+        self.token = current_span.set(None)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_span.reset(self.token)
+        return False
+
+
+def configure(path, rate):
+    """Turns tracing on for a `rate` share of commands, writing to `path`, or off if `rate` is 0."""
+    global sample_rate, output, writer
+    stop()
+    sample_rate = rate
+    if rate > 0:
+        output = open(path, 'a', encoding='utf-8')
+        writer = threading.Thread(target=write_spans, args=(output,), name='tracing', daemon=True)
+        writer.start()
+
+
+def stop():
+    """Writes every span still queued, then stops the writer and closes the file."""
+    global output, writer
+    if writer is None:
+        return
+    spans.put(None)
+    writer.join()
+    output.close()
+    output = writer = None
+
+
+atexit.register(stop)
+
+
+def start_trace(name, **attributes):
+    """The root span of a new trace if the sampler picks it, otherwise a span that hides any trace around it."""
+    if output is None or sampler.random() >= sample_rate:
+        return Unsampled()
+    return Span(os.urandom(16).hex(), None, name, attributes, root=True)
+
+
+def span(name, **attributes):
+    """A child of the current span, or a NullSpan outside a sampled trace."""
+    return child_span(current_span.get(), name, **attributes)
+
+
+def child_span(parent, name, **attributes):
+    """A child of `parent`, for work that runs outside the context it was started in, e.g. a queued send."""
+    if parent is None:
+        return NULL_SPAN
+    return Span(parent.trace_id, parent.span_id, name, attributes)
+
+
+def export(span):
+    """Queues an ended span for the writer thread."""
+    if output is None:
+        return
+    spans.put({
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'parentSpanId': span.parent_id or '',
+        'name': span.name,
+        'startTimeUnixNano': span.start,
+        'endTimeUnixNano': span.end,
+        'attributes': span.attributes,
+        'status': {'code': 'ERROR', 'message': span.error} if span.error else {'code': 'OK'},
+        'root': span.root,
+    })
+
+
+def write_spans(file):
+    """Writes queued spans as JSON lines until it gets None, flushing after each root span."""
+    while (record := spans.get()) is not None:
+        root = record.pop('root')
+        file.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+        if root:
+            file.flush()
+
+
+def traced(name):
+    """Decorates a coroutine function to run each call in a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator